@@ -0,0 +1,354 @@
+# app/api.py
+# Streamlit を通さない JSON API（WSGI）。モバイル／LMS 連携など、画面の再実行が要らないクライアント向け。
+#   python -m app.api --port 8600                 標準ライブラリのスレッド付きサーバーで起動
+#   gunicorn -w 2 --threads 8 'app.api:application'   など、任意の WSGI サーバーでも動く
+# サービス層（selector / grader / ai_eval / attempts / summary_jobs / auth）をそのまま使うので、
+# バンクのキャッシュ・DB の接続プール・LLM のスケジューラや先回り生成は Streamlit 側と同じものが効く。
+# 認証：POST /api/login（または /api/register）で bearer トークンを受け取り、以降は Authorization: Bearer <token>。
+# トークンは user_id と期限を HMAC で署名したもの（サーバー側に状態を持たない。bcrypt はログイン時の1回だけ）。
+#   CQ_API_SECRET       署名鍵（未設定ならプロセスごとの乱数。再起動やプロセス間でトークンが無効になる）
+#   CQ_API_TOKEN_TTL_S  トークンの有効秒数（既定 86400）
+# エンドポイント（本文・応答とも JSON。エラーは {"error": "..."} とステータスコード）:
+#   GET  /api/health
+#   POST /api/register        {account_id, password, display_name?} → {token, user_id}
+#   POST /api/login           {account_id, password}                → {token, user_id}
+#   GET  /api/questions       ?skill=&limit=5                         ランダム抽出（load_questions）
+#   GET  /api/batch           ?skill=&domain=&n=2&exclude=id,id       出題選定（pick_batch。出題回数にも数える）
+#   POST /api/grade/mcq       {answers: {question_id: "A"}}           採点して通算に記録
+#   POST /api/grade/sjt       {answers: {...}, free: {question_id: text}, wait?: bool}
+#                             自由記述は締め切りモード（間に合わなければ暫定評価。記録は本評価で行う）。wait=true なら待つ
+#   POST /api/eval/free       {question_id | prompt, text}            自由記述の評価だけ（記録しない）
+#   POST /api/feedback/session {session_items?}                       講評。省略時は通算（先回り生成済みならそれ）
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from app.services import adaptive as _adaptive
+from app.services import attempts as _attempts
+from app.services import auth as _auth
+from app.services import exposure as _exposure
+from app.services import selector as _sel
+from app.services import summary_jobs as _summary_jobs
+from app.services.ai_eval import eval_free_response, eval_free_responses, gen_session_feedback, when_all_done
+from app.services.db import load_questions
+from app.services.grader import grade_mcq, grade_sjt
+from app.services.metrics import API_DURATION, start_exporters
+
+API_SECRET = os.getenv("CQ_API_SECRET", "")
+TOKEN_TTL_S = int(os.getenv("CQ_API_TOKEN_TTL_S", "86400"))
+MAX_BODY = 1 << 20
+MAX_BATCH = 20
+
+_secret = API_SECRET.encode("utf-8") if API_SECRET else secrets.token_bytes(32)
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+# ---- トークン ----
+
+def _sign(payload: str) -> str:
+    return hmac.new(_secret, payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def issue_token(user_id: int, ttl_s: int = TOKEN_TTL_S) -> str:
+    payload = f"{int(user_id)}.{int(time.time()) + ttl_s}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_token(token: str) -> Optional[int]:
+    """有効なら user_id、無効・期限切れなら None"""
+    try:
+        uid, exp, sig = (token or "").split(".")
+        if not hmac.compare_digest(sig, _sign(f"{uid}.{exp}")) or int(exp) < time.time():
+            return None
+        return int(uid)
+    except ValueError:
+        return None
+
+
+# ---- ルーティング ----
+
+_routes: Dict[Tuple[str, str], Tuple[Callable, bool]] = {}
+
+
+def route(method: str, path: str, auth: bool = True):
+    """fn(body, query, user_id) → 応答の dict。auth=True ならトークン必須（user_id が入る）"""
+    def deco(fn):
+        _routes[(method, path)] = (fn, auth)
+        return fn
+    return deco
+
+
+def _public(q) -> dict:
+    """クライアントに返す問題（正答・解説・SJT の選択肢別講評は含めない）"""
+    return {"id": q.id, "skill": q.skill, "level": q.level, "type": q.type, "prompt": q.prompt,
+            "choices": q.choices or [], "difficulty": q.difficulty, "tags": q.tags or []}
+
+
+def _int(query: dict, key: str, default: int) -> int:
+    try:
+        return max(1, min(int(query.get(key, default)), MAX_BATCH))
+    except ValueError:
+        raise ApiError(400, f"{key} must be an integer")
+
+
+def _skill_norm(skill: Optional[str]) -> str:
+    return (skill or "").replace(" ", "").replace("　", "")
+
+
+def _answered(body: dict, key: str = "answers") -> Dict[str, Optional[str]]:
+    answers = body.get(key)
+    if not isinstance(answers, dict) or not answers:
+        raise ApiError(400, f"{key} must be a non-empty object")
+    if len(answers) > MAX_BATCH:
+        raise ApiError(400, f"at most {MAX_BATCH} questions per request")
+    return answers
+
+
+def _questions_for(ids) -> List:
+    qs = _sel.get_questions(ids)
+    missing = set(ids) - {q.id for q in qs}
+    if missing:
+        raise ApiError(404, f"unknown question_id: {', '.join(sorted(missing))}")
+    return qs
+
+
+def _persist(user_id: int, session_items: list):
+    try:
+        _attempts.enqueue(user_id, session_items)
+    except Exception as e:
+        print(f"[WARN] attempts enqueue failed: {e}")
+    _summary_jobs.enqueue(user_id)
+
+
+@route("GET", "/api/health", auth=False)
+def _health(body, query, user_id):
+    return {"ok": True, "attempts_writer": _attempts.writer_stats(), "summary_jobs": _summary_jobs.stats()}
+
+
+@route("POST", "/api/register", auth=False)
+def _register(body, query, user_id):
+    try:
+        user = _auth.create_user(body.get("account_id", ""), body.get("password", ""), body.get("display_name"))
+    except ValueError as e:
+        raise ApiError(409 if "already" in str(e) else 400, str(e))
+    return {"token": issue_token(user.id), "user_id": user.id}
+
+
+@route("POST", "/api/login", auth=False)
+def _login(body, query, user_id):
+    user = _auth.authenticate(body.get("account_id", ""), body.get("password", ""))
+    if user is None:
+        raise ApiError(401, "invalid account_id or password")
+    return {"token": issue_token(user.id), "user_id": user.id}
+
+
+@route("GET", "/api/questions")
+def _questions(body, query, user_id):
+    limit = _int(query, "limit", 5)
+    return {"questions": [_public(q) for q in load_questions(query.get("skill") or None, limit=limit)]}
+
+
+@route("GET", "/api/batch")
+def _batch(body, query, user_id):
+    skill, domain = query.get("skill"), query.get("domain", "ビジネス")
+    if not skill:
+        raise ApiError(400, "skill is required")
+    want = _int(query, "n", 2)
+    exclude = [i for i in (query.get("exclude") or "").split(",") if i]
+    picked = _sel.pick_batch(skill, domain, want=want, exclude=exclude, user_id=user_id)
+    _sel.mark_shown(skill, domain, [q.id for q in picked], user_id)
+    _exposure.record(q.id for q in picked)
+    return {"questions": [_public(q) for q in picked]}
+
+
+@route("POST", "/api/grade/mcq")
+def _grade_mcq(body, query, user_id):
+    answers = _answered(body)
+    qs = _questions_for(list(answers))
+    results, correct, total = grade_mcq(qs, [answers[q.id] for q in qs])
+    session_items = [{
+        "id": q.id,
+        "type": q.type,
+        "skill": _skill_norm(q.skill),
+        "difficulty": q.difficulty,
+        "tags": q.tags or [],
+        "correct": r.is_correct,
+        "chosen": r.chosen,
+        "answer_key": r.correct_key,
+    } for q, r in zip(qs, results) if r.is_correct is not None or r.chosen]  # 未回答は除外
+    try:
+        _adaptive.record(user_id, session_items)
+    except Exception as e:
+        print(f"[WARN] ability update failed: {e}")
+    _persist(user_id, session_items)
+    return {"correct": correct, "total": total,
+            "results": [{"question_id": r.question_id, "chosen": r.chosen, "is_correct": r.is_correct,
+                         "correct_key": r.correct_key, "explanation": r.explanation} for r in results]}
+
+
+@route("POST", "/api/grade/sjt")
+def _grade_sjt(body, query, user_id):
+    answers = _answered(body)
+    free = body.get("free") or {}
+    if not isinstance(free, dict) or not all(isinstance(v, str) for v in free.values()):
+        raise ApiError(400, "free must be an object of question_id: text")
+    qs = _questions_for(list(answers))
+    feedbacks = grade_sjt(qs, [answers[q.id] for q in qs])
+    free_items = {q.id: (q.prompt, free[q.id].strip()) for q in qs if (free.get(q.id) or "").strip()}
+    free_ai, pending = eval_free_responses(free_items, user_id=user_id, deadline_s=0 if body.get("wait") else None)
+
+    session_items = []
+    for q, fb in zip(qs, feedbacks):
+        ai = free_ai.get(q.id)
+        free_score01 = ai.get("score_total", 0) / 100.0 if ai else 0.0
+        best = q.answer_key or next((k for k, v in (q.feedbacks or {}).items()
+                                     if (v or {}).get("type") in ("best", "good")), None)
+        if (best is None or fb.get("chosen") is None) and free_score01 == 0.0:
+            continue  # 選択評価も自由記述も無い → 平均を歪めるので除外
+        session_items.append({"id": q.id, "type": q.type, "skill": _skill_norm(q.skill), "tags": q.tags or [],
+                              "free_score01": free_score01, "chosen": fb.get("chosen"), "best": best})
+
+    if pending:
+        # 暫定を含むときは、本評価で free_score01 を差し替えてから記録する（応答は待たない）
+        def _apply(finals, items=session_items):
+            for item in items:
+                if finals.get(item["id"]):
+                    item["free_score01"] = finals[item["id"]].get("score_total", 0) / 100.0
+            _persist(user_id, items)
+        when_all_done(pending, _apply)
+    else:
+        _persist(user_id, session_items)
+    return {"feedbacks": feedbacks, "free_ai": free_ai, "pending": sorted(pending)}
+
+
+@route("POST", "/api/eval/free")
+def _eval_free(body, query, user_id):
+    prompt = body.get("prompt")
+    if body.get("question_id"):
+        prompt = _questions_for([body["question_id"]])[0].prompt
+    if not prompt:
+        raise ApiError(400, "question_id or prompt is required")
+    return eval_free_response(prompt, str(body.get("text") or ""), user_id=user_id)
+
+
+@route("POST", "/api/feedback/session")
+def _session_feedback(body, query, user_id):
+    items = body.get("session_items")
+    if items is not None:
+        if not isinstance(items, list):
+            raise ApiError(400, "session_items must be a list")
+        return gen_session_feedback(items, user_id=user_id)
+    # 通算：採点のたびに裏で作っている講評（同じ履歴の版）があればそれ、無ければその場で生成
+    stats = _attempts.get_skill_stats(user_id)
+    ready = _summary_jobs.get_ready(user_id, _summary_jobs.history_version(stats), wait_s=_summary_jobs.WAIT_S)
+    if ready is not None:
+        return ready
+    return gen_session_feedback(_summary_jobs.total_payload(_attempts.load_tail(user_id), stats), user_id=user_id)
+
+
+# ---- WSGI ----
+
+_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed",
+            409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+def _read_body(environ) -> dict:
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length > MAX_BODY:
+        raise ApiError(413, "request body too large")
+    if not length:
+        return {}
+    try:
+        body = json.loads(environ["wsgi.input"].read(length).decode("utf-8"))
+    except (UnicodeDecodeError, ValueError):
+        raise ApiError(400, "invalid JSON")
+    if not isinstance(body, dict):
+        raise ApiError(400, "JSON body must be an object")
+    return body
+
+
+def _dispatch(environ) -> Tuple[int, object, str]:
+    method, path = environ.get("REQUEST_METHOD", "GET"), environ.get("PATH_INFO", "") or "/"
+    entry = _routes.get((method, path))
+    if entry is None:
+        if any(p == path for _, p in _routes):
+            raise ApiError(405, "method not allowed")
+        raise ApiError(404, "not found")
+    fn, needs_auth = entry
+    user_id = None
+    if needs_auth:
+        header = environ.get("HTTP_AUTHORIZATION", "")
+        user_id = verify_token(header[7:]) if header.startswith("Bearer ") else None
+        if user_id is None:
+            raise ApiError(401, "missing or invalid token")
+    query = {k: v[-1] for k, v in parse_qs(environ.get("QUERY_STRING", "")).items()}
+    return 200, fn(_read_body(environ), query, user_id), path
+
+
+def application(environ, start_response):
+    t = time.perf_counter()
+    path = "unmatched"
+    try:
+        status, payload, path = _dispatch(environ)
+    except ApiError as e:
+        status, payload = e.status, {"error": str(e)}
+    except Exception as e:
+        print(f"[WARN] api {environ.get('PATH_INFO')} failed: {e}")
+        status, payload = 500, {"error": "internal error"}
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    start_response(f"{status} {_REASONS.get(status, '')}",
+                   [("Content-Type", "application/json; charset=utf-8"), ("Content-Length", str(len(data)))])
+    API_DURATION.observe(time.perf_counter() - t, route=path, status=str(status))
+    return [data]
+
+
+def serve(host: str = "127.0.0.1", port: int = 8600):
+    """標準ライブラリの WSGI サーバー（リクエストごとにスレッド）。本番は gunicorn などで application を動かす"""
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+    class _Server(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+    class _Handler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    if not API_SECRET:
+        print("[WARN] CQ_API_SECRET is not set; tokens are valid only for this process")
+    start_exporters()
+    httpd = make_server(host, port, application, server_class=_Server, handler_class=_Handler)
+    print(f"CQ API listening on http://{host}:{port}")
+    httpd.serve_forever()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="CQ の JSON API（WSGI）")
+    ap.add_argument("--host", default=os.getenv("CQ_API_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("CQ_API_PORT", "8600")))
+    args = ap.parse_args(argv)
+    try:
+        serve(args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
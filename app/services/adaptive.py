@@ -0,0 +1,103 @@
+# app/services/adaptive.py
+# ユーザー×スキルの能力推定（Rasch / Elo 型のオンライン更新）と、出題難易度の目標値。
+#   - difficulty (0..1) はロジット尺度の項目困難度 b に写す（0.5 → 0）
+#   - 正答確率 p = 1 / (1 + exp(-(θ - b)))、採点ごとに θ += K(n) * (x - p)
+#   - K は回答数 n とともに小さくなる（序盤は大きく動き、早く安定する）
+#   - θ はプロセス内キャッシュに持ち、attempts の書き込みで user_skill_stats.ability に永続化する
+import math
+import os
+import threading
+from typing import Dict, Iterable, Tuple
+
+from app.services import attempts
+
+K_START = float(os.getenv("CQ_ADAPTIVE_K_START", "1.2"))
+K_MIN = float(os.getenv("CQ_ADAPTIVE_K_MIN", "0.25"))
+K_DECAY = float(os.getenv("CQ_ADAPTIVE_K_DECAY", "0.15"))
+TARGET_P = float(os.getenv("CQ_ADAPTIVE_TARGET_P", "0.5"))  # この正答確率になる難易度を狙う（0.5 = 情報量最大）
+
+_lock = threading.Lock()
+_abilities: Dict[Tuple[int, str], Tuple[float, int]] = {}  # (user_id, skill) -> (θ, 更新回数)
+
+
+def _clip01(x: float, eps: float = 0.02) -> float:
+    return min(1.0 - eps, max(eps, x))
+
+
+def to_logit(difficulty) -> float:
+    d = 0.5 if difficulty is None else float(difficulty)
+    d = _clip01(d)
+    return math.log(d / (1.0 - d))
+
+
+def from_logit(b: float) -> float:
+    return 1.0 / (1.0 + math.exp(-b))
+
+
+def p_correct(theta: float, difficulty) -> float:
+    return 1.0 / (1.0 + math.exp(-(theta - to_logit(difficulty))))
+
+
+def k_factor(n: int) -> float:
+    return max(K_MIN, K_START / (1.0 + K_DECAY * n))
+
+
+def _load(user_id: int, skill: str) -> Tuple[float, int]:
+    """キャッシュに無ければ user_skill_stats から読む（無ければ θ=0）"""
+    key = (int(user_id), skill)
+    with _lock:
+        if key in _abilities:
+            return _abilities[key]
+    theta, n = 0.0, 0
+    try:
+        row = attempts.get_skill_stats(user_id).get(skill)
+        if row and row.get("ability") is not None:
+            theta, n = float(row["ability"]), int(row.get("ability_n") or 0)
+    except Exception as e:
+        print(f"[WARN] ability load failed: {e}")
+    with _lock:
+        return _abilities.setdefault(key, (theta, n))
+
+
+def get_ability(user_id: int, skill: str) -> Tuple[float, int]:
+    return _load(user_id, skill)
+
+
+def target_difficulty(user_id: int, skill: str) -> float:
+    """次に出す問題の目標 difficulty（0..1）"""
+    theta, _ = _load(user_id, skill)
+    return from_logit(theta - math.log(TARGET_P / (1.0 - TARGET_P)))
+
+
+def observe(user_id: int, skill: str, difficulty, correct: bool) -> Tuple[float, float]:
+    """1問の正誤で θ を更新し、(更新前θ, 更新後θ) を返す"""
+    _load(user_id, skill)
+    key = (int(user_id), skill)
+    with _lock:
+        theta, n = _abilities[key]
+        x = 1.0 if correct else 0.0
+        new = theta + k_factor(n) * (x - p_correct(theta, difficulty))
+        _abilities[key] = (new, n + 1)
+    return theta, new
+
+
+def record(user_id: int, session_items: Iterable[dict]) -> None:
+    """
+    採点済みの session_items（MCQ）で θ を順に更新し、各 item に
+    ability（回答時点のθ）/ ability_after（更新後θ）を書き込む（attempts に永続化される）。
+    """
+    for it in session_items:
+        c = it.get("correct")
+        if it.get("type") != "mcq" or not isinstance(c, bool):
+            continue
+        before, after = observe(user_id, it.get("skill") or "", it.get("difficulty"), c)
+        it["ability"] = round(before, 4)
+        it["ability_after"] = round(after, 4)
+
+
+def forget(user_id: int) -> None:
+    """キャッシュから除く（通算リセット時など）"""
+    uid = int(user_id)
+    with _lock:
+        for key in [k for k in _abilities if k[0] == uid]:
+            del _abilities[key]
@@ -1,16 +1,61 @@
-import os, json, re
-from typing import Dict, Any
-from app.services.config import OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL
+import os, json, re, threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+from app.services import llm_providers as _llm_providers
+from app.services import llm_record as _llm_record
+from app.services import llm_sched as _llm_sched
+from app.services import spec_eval as _spec_eval
+from app.services.config import OPENAI_MODEL
+from app.services.metrics import EVAL_RESULTS, LLM_DURATION, LLM_PARSE_FAILURES, count_usage, timed
+from app.services.profiler import profiled
 
-# --- OpenAI クライアント（無ければ None → ルールベースにフォールバック） ---
+# --- LLM クライアント（無ければ None → ルールベースにフォールバック） ---
+# SDK の import とクライアント生成は重いため、初回の評価呼び出しまで遅延する
 _openai_client = None
-try:
-    from openai import OpenAI
-    if OPENAI_API_KEY:
-        # base_url は空文字なら None を渡して公式エンドポイントを利用
-        _openai_client = OpenAI(api_key=OPENAI_API_KEY, base_url=(OPENAI_BASE_URL or None))
-except Exception:
-    _openai_client = None
+_openai_client_ready = False
+_openai_client_lock = threading.Lock()
+
+def _get_openai_client():
+    global _openai_client, _openai_client_ready
+    if _openai_client_ready:
+        return _openai_client
+    with _openai_client_lock:
+        if not _openai_client_ready:
+            try:
+                # CQ_LLM_REPLAY なら記録から返すクライアント（API キー不要）
+                _openai_client = _llm_record.replay_client()
+                if _openai_client is None:
+                    # CQ_LLM_PROVIDERS の順（OpenAI / Anthropic、ヘッジあり）で呼ぶ OpenAI 互換の入口
+                    # CQ_LLM_RECORD なら呼び出しを記録するラッパーで包む
+                    _openai_client = _llm_record.wrap(_llm_providers.build_client())
+            except Exception as e:
+                if _llm_record.REPLAY_PATH or _llm_record.RECORD_PATH:
+                    print(f"[WARN] LLM record/replay client unavailable: {e}")
+                _openai_client = None
+            _openai_client_ready = True
+    return _openai_client
+
+# 混雑でLLMを呼ばずにルールベースで返した結果の印（画面に表示する）
+SIMPLIFIED_LABEL = "簡易評価"
+
+def _simplified(result: Dict[str, Any]) -> Dict[str, Any]:
+    result["mode"] = SIMPLIFIED_LABEL
+    return result
+
+# 締め切りモード：CQ_EVAL_DEADLINE_S 秒以内に LLM が返らなければ、ルールベースの結果を「暫定評価」として先に返す。
+# LLM の呼び出しは裏で続け、返ったら呼び出し側が差し替える（0 で無効＝これまで通り待つ）
+EVAL_DEADLINE_S = float(os.getenv("CQ_EVAL_DEADLINE_S", "5"))
+EVAL_WORKERS = int(os.getenv("CQ_EVAL_WORKERS", "16"))
+EVAL_POLL_S = float(os.getenv("CQ_EVAL_POLL_S", "1"))                 # 画面が本評価の到着を見に行く間隔
+EVAL_UPGRADE_MAX_S = float(os.getenv("CQ_EVAL_UPGRADE_MAX_S", "120"))  # これを過ぎたら画面は暫定のまま（記録は本評価）
+PROVISIONAL_LABEL = "暫定評価"
+
+def _provisional(result: Dict[str, Any]) -> Dict[str, Any]:
+    result["mode"] = PROVISIONAL_LABEL
+    return result
+
+def _total_tokens(resp):
+    return getattr(getattr(resp, "usage", None), "total_tokens", None)
 
 SYSTEM_PROMPT = """あなたはビジネスコミュニケーションの講師です。
 回答を以下の観点で評価し、必ず次のJSON形式のみを返してください（日本語）:
@@ -72,11 +117,32 @@ def _fallback_rule_based(prompt_text: str, user_text: str) -> Dict[str, Any]:
             "clarity": clip(clarity)
         },
         "short_feedback": "感情的な反応はリスク。まず事情確認と代替案提示で建設的に進めましょう。",
-        "next_drill": "事情確認→前進合意→次の連絡時刻、の3点を1文で述べてください。"
+        "next_drill": "事情確認→前進合意→次の連絡時刻、の3点を1文で述べてください。",
+        "fallback": True,  # LLM の評価ではない（先回り評価の結果として使い回さない）
     }
 
-def eval_free_response(prompt_text: str, user_text: str) -> Dict[str, Any]:
+def _extract_json(fn_name: str, resp):
+    """応答本文から JSON を取り出す（最初の { から最後の } まで）。取れなければ理由を数えて None"""
+    try:
+        content = (resp.choices[0].message.content or "").strip()
+    except Exception:
+        content = ""
+    m = re.search(r"\{.*\}", content, flags=re.S)
+    try:
+        return json.loads(m.group(0) if m else content)
+    except ValueError:
+        LLM_PARSE_FAILURES.inc(fn=fn_name, reason="invalid_json" if m else "no_json")
+        return None
+
+@profiled("eval_free_response")
+@timed("eval_free_response")
+def eval_free_response(prompt_text: str, user_text: str, user_id=None, priority: Optional[int] = None) -> Dict[str, Any]:
+    """
+    自由記述の評価。user_id は LLM 呼び出しの公平な割り当て（ユーザーごとの待ち行列）に使う。
+    priority は llm_sched の優先度（既定は INTERACTIVE。入力中の先回り評価は SPECULATIVE）
+    """
     if not user_text or len(user_text.strip()) < 3:
+        EVAL_RESULTS.inc(fn="eval_free_response", path="skipped")
         return {
             "score_total": 0,
             "subscores": {"context_fit": 0, "interpersonal_sensitivity": 0, "clarity": 0},
@@ -84,7 +150,9 @@ def eval_free_response(prompt_text: str, user_text: str) -> Dict[str, Any]:
             "next_drill": "相手の事情確認と代替案提示を1文で書いてみましょう。"
         }
 
-    if _openai_client is None:
+    client = _get_openai_client()
+    if client is None:
+        EVAL_RESULTS.inc(fn="eval_free_response", path="fallback_no_client")
         return _fallback_rule_based(prompt_text, user_text)
 
     user_prompt = (
@@ -94,22 +162,131 @@ def eval_free_response(prompt_text: str, user_text: str) -> Dict[str, Any]:
         "必ず上記のJSON形式だけを返してください。"
     )
 
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
     try:
-        resp = _openai_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.2
-        )
-        content = (resp.choices[0].message.content or "").strip()
-        m = re.search(r"\{.*\}", content, flags=re.S)
-        json_str = m.group(0) if m else content
-        data = json.loads(json_str)
-        return _to_ui_schema(data)
+        # 採点は講評より優先して枠を取る（混雑時は Shed → 簡易評価）
+        priority = _llm_sched.INTERACTIVE if priority is None else priority
+        with _llm_sched.slot(user_id, priority, messages, fn="eval_free_response") as ticket:
+            with LLM_DURATION.time(fn="eval_free_response"):
+                resp = client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=messages,
+                    temperature=0.2
+                )
+            ticket.used_tokens = _total_tokens(resp)
+    except _llm_sched.Shed:
+        EVAL_RESULTS.inc(fn="eval_free_response", path="shed")
+        return _simplified(_fallback_rule_based(prompt_text, user_text))
+    except Exception:
+        EVAL_RESULTS.inc(fn="eval_free_response", path="fallback_error")
+        return _fallback_rule_based(prompt_text, user_text)
+    count_usage("eval_free_response", resp)
+    data = _extract_json("eval_free_response", resp)
+    try:
+        out = _to_ui_schema(data) if isinstance(data, dict) else None
     except Exception:
+        out = None
+    if out is None:
+        if data is not None:  # JSON は取れたが形が違う
+            LLM_PARSE_FAILURES.inc(fn="eval_free_response", reason="schema")
+        EVAL_RESULTS.inc(fn="eval_free_response", path="fallback_parse")
         return _fallback_rule_based(prompt_text, user_text)
+    EVAL_RESULTS.inc(fn="eval_free_response", path="llm")
+    return out
+
+# 締め切りモードの評価は専用のプールで走らせる（background の先読み用プールを LLM 待ちで埋めない）
+_eval_executor = None
+_eval_executor_lock = threading.Lock()
+
+def _get_eval_executor() -> ThreadPoolExecutor:
+    global _eval_executor
+    if _eval_executor is None:
+        with _eval_executor_lock:
+            if _eval_executor is None:
+                _eval_executor = ThreadPoolExecutor(max_workers=EVAL_WORKERS, thread_name_prefix="cq-eval")
+    return _eval_executor
+
+def when_all_done(futures: Dict[Any, Future], fn: Callable[[Dict[Any, Dict[str, Any]]], None]):
+    """全部終わったら fn({key: 本評価}) を1回だけ呼ぶ（最後に終わったスレッドから。既に終わっていればその場で）"""
+    left = [len(futures)]
+    lock = threading.Lock()
+
+    def _one(_):
+        with lock:
+            left[0] -= 1
+            if left[0]:
+                return
+        try:
+            fn({k: f.result() for k, f in futures.items()})
+        except Exception as e:
+            print(f"[WARN] deferred eval callback failed: {e}")
+
+    for f in futures.values():
+        f.add_done_callback(_one)
+
+def _is_llm_result(result: Dict[str, Any]) -> bool:
+    """LLM が返した評価か（簡易評価・暫定評価・ルールベースでない）"""
+    return not result.get("mode") and not result.get("fallback")
+
+def _from_spec(spec: Future, prompt_text: str, user_text: str, user_id=None) -> Future:
+    """
+    先回り評価（SPECULATIVE）の Future → 採点に使う Future。
+    LLM の評価ならそのまま、混雑で簡易評価になった・ルールベースに落ちたなら INTERACTIVE で評価し直す
+    """
+    if spec.done() and spec.exception() is None and _is_llm_result(spec.result()):
+        return spec
+    out: Future = Future()
+
+    def _relay(f: Future):
+        if f.exception() is not None:
+            out.set_exception(f.exception())
+        else:
+            out.set_result(f.result())
+
+    def _check(f: Future):
+        if f.exception() is None and _is_llm_result(f.result()):
+            out.set_result(f.result())
+        else:
+            _get_eval_executor().submit(eval_free_response, prompt_text, user_text, user_id).add_done_callback(_relay)
+
+    spec.add_done_callback(_check)
+    return out
+
+def eval_free_responses(items: Dict[Any, Tuple[str, str]], user_id=None, deadline_s: Optional[float] = None):
+    """
+    items = {key: (prompt_text, user_text)} をまとめて（並行して）評価する。
+    deadline_s 秒（既定 CQ_EVAL_DEADLINE_S）以内に返らなかったものはルールベースの結果に mode="暫定評価" を付けて返す。
+    戻り値：(results, pending)
+      results：{key: 表示用の評価}（暫定を含む）
+      pending：{key: Future}（暫定にしたものの本評価。呼び出し側が done() を見て差し替える。
+               画面を離れても記録を本評価にしたいときは when_all_done で受け取る）
+    """
+    deadline_s = EVAL_DEADLINE_S if deadline_s is None else deadline_s
+    if not items:
+        return {}, {}
+    # 入力中に先回りで始めた同じ内容の評価（spec_eval）があればそれを使う
+    # （LLM の評価でなかったら、採点の優先度で評価し直す）
+    spec = {k: _spec_eval.lookup(user_id, k, p, t) for k, (p, t) in items.items()}
+    spec = {k: _from_spec(f, *items[k], user_id) for k, f in spec.items() if f is not None}
+    if deadline_s <= 0 or _get_openai_client() is None:
+        return {k: spec[k].result() if k in spec else eval_free_response(p, t, user_id=user_id)
+                for k, (p, t) in items.items()}, {}
+
+    ex = _get_eval_executor()
+    futures = {k: spec.get(k) or ex.submit(eval_free_response, p, t, user_id) for k, (p, t) in items.items()}
+    wait(list(futures.values()), timeout=deadline_s)
+    results, pending = {}, {}
+    for k, f in futures.items():
+        if f.done():
+            results[k] = f.result()
+        else:
+            EVAL_RESULTS.inc(fn="eval_free_response", path="provisional")
+            results[k] = _provisional(_fallback_rule_based(*items[k]))
+            pending[k] = f
+    return results, pending
 # === セッション講評（複数問の結果をまとめて評価） =====================
 
 SESSION_SYSTEM_PROMPT = """あなたはビジネスコミュニケーションのコーチです。
@@ -127,9 +304,10 @@ SESSION_SYSTEM_PROMPT = """あなたはビジネスコミュニケーション
 出力はJSON以外の文字・前置き・解説を一切含めないこと。
 """
 
-def _fallback_session_profile(session_items: list[dict]) -> dict:
-    """LLMなしのときの簡易推定（0..1で集計して所感を返す）"""
-    if not session_items:
+def _fallback_session_profile(session_items: list[dict], skill_scores: dict | None = None) -> dict:
+    """LLMなしのときの簡易推定（0..1で集計して所感を返す）
+    skill_scores（永続集計からの事前計算値）があれば、それを items の再集計より優先する。"""
+    if not session_items and not skill_scores:
         return {
             "skill_scores": {},
             "traits": ["データが少ないため推定不能"],
@@ -160,7 +338,8 @@ def _fallback_session_profile(session_items: list[dict]) -> dict:
             val = 0.0
         by_skill.setdefault(sk, []).append(val)
 
-    skill_scores = {k: round(sum(v)/len(v), 2) for k, v in by_skill.items() if v}
+    if not skill_scores:
+        skill_scores = {k: round(sum(v)/len(v), 2) for k, v in by_skill.items() if v}
     avg = round(sum(skill_scores.values())/len(skill_scores), 2) if skill_scores else 0.0
 
     traits, strengths, weaknesses, next_actions = [], [], [], []
@@ -208,7 +387,9 @@ def _fallback_session_profile(session_items: list[dict]) -> dict:
         "recommended_drills": recs[:3],
     }
 
-def gen_session_feedback(session_items: list[dict]) -> dict:
+@profiled("gen_session_feedback")
+@timed("gen_session_feedback")
+def gen_session_feedback(session_items: list[dict], user_id=None) -> dict:
 
 
     """
@@ -217,6 +398,8 @@ def gen_session_feedback(session_items: list[dict]) -> dict:
        {"id":"q2","type":"sjt","skill":"状況判断","chosen":"B","best":"B"},
        {"id":"q3","type":"free","skill":"構成力","free_score01":0.62}]
     出力：画面でそのまま表示できる講評オブジェクト
+      （混雑で LLM の枠が取れなければルールベース版に mode="簡易評価" を付けて返す）
+    user_id：LLM 呼び出しをユーザーごとに公平に割り当てるためのキー
    """
     # --- payload が dict なら展開（meta: 正解数/全問数） ---
     if isinstance(session_items, dict):
@@ -241,10 +424,13 @@ def gen_session_feedback(session_items: list[dict]) -> dict:
         pre_skill_scores = meta.get("pre_skill_scores") or {}
 
     if not session_items:
-        return _fallback_session_profile(session_items)
+        EVAL_RESULTS.inc(fn="gen_session_feedback", path="skipped")
+        return _fallback_session_profile(session_items, pre_skill_scores)
 
-    if _openai_client is None:
-        return _fallback_session_profile(session_items)
+    client = _get_openai_client()
+    if client is None:
+        EVAL_RESULTS.inc(fn="gen_session_feedback", path="fallback_no_client")
+        return _fallback_session_profile(session_items, pre_skill_scores)
 
     user_prompt = (
         "次の複数問の成績サマリから、受検者の傾向を分析してください。\n"
@@ -255,27 +441,37 @@ def gen_session_feedback(session_items: list[dict]) -> dict:
     )
 
 
+    messages = [
+        {"role": "system", "content": SESSION_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
     try:
-        resp = _openai_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": SESSION_SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.0
-        )
-        content = (resp.choices[0].message.content or "").strip()
-        m = re.search(r"\{.*\}", content, flags=re.S)
-        json_str = m.group(0) if m else content
-        data = json.loads(json_str)
-        # LLMが出した skill_scores を、事前計算の値で上書き（厳密にする）
-        if isinstance(data, dict) and pre_skill_scores:
-            data['skill_scores'] = pre_skill_scores
-
-
-        # 期待キーが無ければフォールバック
-        if not isinstance(data, dict) or "skill_scores" not in data:
-            return _fallback_session_profile(session_items)
-        return data
+        with _llm_sched.slot(user_id, _llm_sched.SUMMARY, messages, fn="gen_session_feedback") as ticket:
+            with LLM_DURATION.time(fn="gen_session_feedback"):
+                resp = client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=messages,
+                    temperature=0.0
+                )
+            ticket.used_tokens = _total_tokens(resp)
+    except _llm_sched.Shed:
+        EVAL_RESULTS.inc(fn="gen_session_feedback", path="shed")
+        return _simplified(_fallback_session_profile(session_items, pre_skill_scores))
     except Exception:
-        return _fallback_session_profile(session_items)
+        EVAL_RESULTS.inc(fn="gen_session_feedback", path="fallback_error")
+        return _fallback_session_profile(session_items, pre_skill_scores)
+    count_usage("gen_session_feedback", resp)
+    data = _extract_json("gen_session_feedback", resp)
+    # LLMが出した skill_scores を、事前計算の値で上書き（厳密にする）
+    if isinstance(data, dict) and pre_skill_scores:
+        data['skill_scores'] = pre_skill_scores
+
+
+    # 期待キーが無ければフォールバック
+    if not isinstance(data, dict) or "skill_scores" not in data:
+        if data is not None:
+            LLM_PARSE_FAILURES.inc(fn="gen_session_feedback", reason="schema")
+        EVAL_RESULTS.inc(fn="gen_session_feedback", path="fallback_parse")
+        return _fallback_session_profile(session_items, pre_skill_scores)
+    EVAL_RESULTS.inc(fn="gen_session_feedback", path="llm")
+    return data
@@ -0,0 +1,514 @@
+# app/services/attempts.py
+# 採点結果（session_items）の永続ログ。
+#   - 追記専用の attempts テーブル（users DB / DATABASE_URL 側に置く。cq.db は再生成されるため）
+#   - 採点時は enqueue() でキューに積むだけ。バックグラウンドの書き込みスレッドが
+#     まとめて1トランザクションで INSERT する（write-behind）
+#   - 同じトランザクションで user_skill_stats（ユーザー×スキルの集計）を差分更新する。
+#     通算表示や講評は get_skill_stats() で O(スキル数) で読める
+#   - ログイン時は load_tail() で直近の履歴からセッションを復元する
+from __future__ import annotations
+
+import atexit
+import datetime as dt
+import importlib
+import json
+import os
+import queue
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from app.services import auth
+
+BATCH_SIZE      = int(os.getenv("CQ_ATTEMPT_BATCH_SIZE", "500"))    # 1トランザクションあたりの最大件数
+FLUSH_INTERVAL  = float(os.getenv("CQ_ATTEMPT_FLUSH_SEC", "0.2"))   # バッチを待つ最大秒数
+QUEUE_MAX       = int(os.getenv("CQ_ATTEMPT_QUEUE_MAX", "100000"))  # 超えたら enqueue 側が待つ（背圧）
+HISTORY_TAIL    = int(os.getenv("CQ_HISTORY_TAIL", "200"))          # セッションに保持する直近件数
+WRITE_RETRIES   = 3
+RESET_WAIT_SEC  = float(os.getenv("CQ_ATTEMPT_RESET_WAIT_SEC", "2"))  # リセット時にそのユーザーの書き込み待ちを待つ上限
+
+_tables = None
+_tables_lock = threading.Lock()
+_initialized = False
+_init_lock = threading.Lock()
+
+# 書き込み・リセットのフックを登録するモジュール。どのプロセス（Streamlit / API / バッチ）で attempts を
+# 書いても抜けないように init_db で import する（書き込みスレッドも最初に init_db を呼ぶ）
+_HOOK_MODULES = ("app.services.review", "app.services.percentile", "app.services.summary_jobs")
+
+
+def _get_tables():
+    """attempts テーブル定義（SQLAlchemy は初回利用時に読み込む）"""
+    global _tables
+    if _tables is None:
+        with _tables_lock:
+            if _tables is None:
+                from sqlalchemy import (
+                    MetaData, Table, Column, Integer, String, Float, Boolean, DateTime, Text, Index,
+                )
+                from sqlalchemy import PrimaryKeyConstraint
+
+                md = MetaData()
+                attempts = Table(
+                    "attempts", md,
+                    Column("id", Integer, primary_key=True, autoincrement=True),
+                    Column("user_id", Integer, nullable=False),
+                    Column("question_id", String(64), nullable=False),
+                    Column("type", String(16)),
+                    Column("skill", String(64)),
+                    Column("difficulty", Float),
+                    Column("tags_json", Text),
+                    Column("correct", Boolean),            # MCQ の正誤（未判定は NULL）
+                    Column("chosen", String(4)),
+                    Column("answer_key", String(4)),       # MCQ の正答
+                    Column("best", String(4)),             # SJT の望ましい選択
+                    Column("free_score01", Float),         # 自由記述スコア 0..1
+                    Column("ability", Float),              # 回答時点の能力推定 θ（adaptive、MCQ のみ）
+                    Column("ability_after", Float),        # この回答で更新した後の θ
+                    Column("created_at", DateTime, nullable=False, default=dt.datetime.utcnow),
+                    Index("ix_attempts_user_id_id", "user_id", "id"),
+                )
+                # ユーザー×スキルの集計（attempts と同じトランザクションで差分更新）
+                stats = Table(
+                    "user_skill_stats", md,
+                    Column("user_id", Integer, nullable=False),
+                    Column("skill", String(64), nullable=False),
+                    Column("attempts", Integer, nullable=False, default=0),
+                    Column("graded", Integer, nullable=False, default=0),         # 正誤が付いた件数（MCQ）
+                    Column("correct", Integer, nullable=False, default=0),
+                    Column("free_score_sum", Float, nullable=False, default=0.0),
+                    Column("score_sum", Float, nullable=False, default=0.0),      # 講評と同じ 0..1 換算の合計
+                    Column("score_n", Integer, nullable=False, default=0),
+                    Column("weighted_score", Float, nullable=False, default=0.0), # Σ difficulty × 正解
+                    Column("weighted_total", Float, nullable=False, default=0.0), # Σ difficulty（正誤判定分）
+                    Column("last_seen", DateTime),
+                    Column("ability", Float),                                     # 最新の能力推定 θ
+                    Column("ability_n", Integer, nullable=False, default=0),      # θ の更新回数（K の減衰用）
+                    PrimaryKeyConstraint("user_id", "skill", name="pk_user_skill_stats"),
+                )
+                # 「通算をリセット」の位置（これ以前の attempts は履歴復元に使わない）
+                resets = Table(
+                    "attempt_resets", md,
+                    Column("user_id", Integer, primary_key=True, autoincrement=False),
+                    Column("after_id", Integer, nullable=False),
+                    Column("reset_at", DateTime, nullable=False, default=dt.datetime.utcnow),
+                )
+                _tables = {"metadata": md, "attempts": attempts, "user_skill_stats": stats,
+                           "attempt_resets": resets}
+    return _tables
+
+
+def init_db():
+    global _initialized
+    if _initialized:
+        return
+    auth.init_db()
+    with _init_lock:
+        if not _initialized:
+            engine = auth.get_engine()
+            _get_tables()["metadata"].create_all(engine)
+            _add_missing_columns(engine)
+            for name in _HOOK_MODULES:
+                importlib.import_module(name)
+            # フックが書くテーブルは、書き込みスレッドが書き始める前にここで作る（コミット済み）
+            for fn in _setup_hooks:
+                fn(engine)
+            _initialized = True
+
+
+# 後から追加した列（既存DBには ALTER TABLE で足す）
+_ADDED_COLUMNS = {
+    "attempts": [("ability", "FLOAT"), ("ability_after", "FLOAT")],
+    "user_skill_stats": [("ability", "FLOAT"), ("ability_n", "INTEGER NOT NULL DEFAULT 0")],
+}
+
+def _add_missing_columns(engine):
+    from sqlalchemy import inspect, text
+
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table, cols in _ADDED_COLUMNS.items():
+            have = {c["name"] for c in insp.get_columns(table)}
+            for name, ddl in cols:
+                if name not in have:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+
+def _to_row(user_id: int, item: dict, now: dt.datetime) -> dict:
+    correct = item.get("correct")
+    return {
+        "user_id": int(user_id),
+        "question_id": str(item.get("id") or ""),
+        "type": item.get("type"),
+        "skill": item.get("skill"),
+        "difficulty": item.get("difficulty"),
+        "tags_json": json.dumps(item.get("tags") or [], ensure_ascii=False),
+        "correct": correct if isinstance(correct, bool) else None,
+        "chosen": item.get("chosen"),
+        "answer_key": item.get("answer_key"),
+        "best": item.get("best"),
+        "free_score01": item.get("free_score01"),
+        "ability": item.get("ability"),
+        "ability_after": item.get("ability_after"),
+        "created_at": now,
+    }
+
+
+def _from_row(r) -> dict:
+    """DB行 → アプリの session_items と同じ形の dict（None の項目は省く）"""
+    item = {
+        "id": r.question_id,
+        "type": r.type,
+        "skill": r.skill,
+        "tags": json.loads(r.tags_json) if r.tags_json else [],
+    }
+    if r.type == "mcq":
+        item.update({"difficulty": r.difficulty, "correct": r.correct,
+                     "chosen": r.chosen, "answer_key": r.answer_key})
+    else:
+        item.update({"free_score01": r.free_score01 or 0.0, "chosen": r.chosen, "best": r.best})
+    return item
+
+
+# ---- user_skill_stats の差分 ----
+
+_STAT_FIELDS = ("attempts", "graded", "correct", "free_score_sum", "score_sum", "score_n",
+                "weighted_score", "weighted_total", "ability_n")
+
+def _item_score(row: dict) -> Optional[float]:
+    """講評のフォールバック集計（_fallback_session_profile）と同じ 0..1 換算。None は集計対象外"""
+    t = row.get("type")
+    if t == "mcq":
+        c = row.get("correct")
+        return None if c is None else (1.0 if c else 0.0)
+    if t == "sjt":
+        return 1.0 if row.get("chosen") == row.get("best") else 0.0
+    if t == "free":
+        return float(row.get("free_score01") or 0.0)
+    return 0.0
+
+def _aggregate(rows: Iterable[dict]) -> dict:
+    """行の並び → {(user_id, skill): 差分dict}"""
+    out: dict = {}
+    for r in rows:
+        key = (r["user_id"], r.get("skill") or "その他")
+        d = out.get(key)
+        if d is None:
+            d = out[key] = dict.fromkeys(_STAT_FIELDS, 0)
+            d["last_seen"] = None
+            d["ability"] = None
+        d["attempts"] += 1
+        c = r.get("correct")
+        diff = float(r.get("difficulty") if r.get("difficulty") is not None else 0.5)
+        if c is not None:
+            d["graded"] += 1
+            d["weighted_total"] += diff
+            if c:
+                d["correct"] += 1
+                d["weighted_score"] += diff
+        d["free_score_sum"] += float(r.get("free_score01") or 0.0)
+        sc = _item_score(r)
+        if sc is not None:
+            d["score_sum"] += sc
+            d["score_n"] += 1
+        if d["last_seen"] is None or (r.get("created_at") and r["created_at"] > d["last_seen"]):
+            d["last_seen"] = r.get("created_at")
+        if r.get("ability_after") is not None:
+            d["ability"] = r["ability_after"]  # 行は時系列順なので最後の値が最新
+            d["ability_n"] += 1
+    return out
+
+def _upsert_stats(conn, stats, deltas: dict):
+    """差分を user_skill_stats に加算（SQLite / PostgreSQL は ON CONFLICT、その他は UPDATE→INSERT）"""
+    if not deltas:
+        return
+    dialect = conn.dialect.name
+    rows = [{"user_id": u, "skill": sk, **d} for (u, sk), d in deltas.items()]
+    if dialect in ("sqlite", "postgresql"):
+        from sqlalchemy import func
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        ins = insert(stats)
+        set_ = {f: stats.c[f] + ins.excluded[f] for f in _STAT_FIELDS}
+        set_["last_seen"] = ins.excluded.last_seen
+        set_["ability"] = func.coalesce(ins.excluded.ability, stats.c.ability)
+        conn.execute(ins.on_conflict_do_update(index_elements=["user_id", "skill"], set_=set_), rows)
+        return
+    for row in rows:
+        upd = (
+            stats.update()
+            .where(stats.c.user_id == row["user_id"], stats.c.skill == row["skill"])
+            .values({**{f: stats.c[f] + row[f] for f in _STAT_FIELDS}, "last_seen": row["last_seen"],
+                     **({"ability": row["ability"]} if row["ability"] is not None else {})})
+        )
+        if conn.execute(upd).rowcount == 0:
+            conn.execute(stats.insert(), [row])
+
+# 書き込み待ち（キュー内）の差分。get_skill_stats() で DB 値に重ねて「書いた直後に読める」ようにする。
+# コミット前後の一瞬だけ二重計上／未計上があり得るが、表示用途なので許容する。
+_pending: dict = {}
+_pending_lock = threading.Lock()
+
+def _pending_apply(deltas: dict, sign: int):
+    with _pending_lock:
+        for key, d in deltas.items():
+            cur = _pending.get(key)
+            if cur is None:
+                cur = _pending[key] = dict.fromkeys(_STAT_FIELDS, 0)
+                cur["last_seen"] = None
+                cur["ability"] = None
+            for f in _STAT_FIELDS:
+                cur[f] += sign * d[f]
+            if sign > 0 and d["last_seen"] and (cur["last_seen"] is None or d["last_seen"] > cur["last_seen"]):
+                cur["last_seen"] = d["last_seen"]
+            if sign > 0 and d["ability"] is not None:
+                cur["ability"] = d["ability"]
+            if sign < 0 and cur["attempts"] <= 0:
+                del _pending[key]
+
+
+# ---- 書き込みスレッド（write-behind） ----
+
+class _AttemptWriter:
+    def __init__(self):
+        self._q: "queue.Queue[dict]" = queue.Queue(maxsize=QUEUE_MAX)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="cq-attempt-writer", daemon=True)
+                self._thread.start()
+
+    def put(self, rows: List[dict]):
+        self._ensure_started()
+        for row in rows:
+            self._q.put(row)
+
+    def _drain(self) -> List[dict]:
+        """最初の1件を待ち、その後 FLUSH_INTERVAL 以内に来た分を BATCH_SIZE までまとめる"""
+        batch = [self._q.get()]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._q.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, engine, tables, batch: List[dict], deltas: dict, retries: int = WRITE_RETRIES):
+        """1トランザクションで書く（失敗したら間隔を空けて retries 回まで）。最後の例外を返す（成功なら None）"""
+        err = None
+        for i in range(retries):
+            try:
+                with engine.begin() as conn:
+                    _write_batch(conn, tables, batch, deltas)
+                self.written += len(batch)
+                return None
+            except Exception as e:
+                err = e
+                if i < retries - 1:
+                    time.sleep(0.2 * (2 ** i))
+        return err
+
+    def _run(self):
+        init_db()
+        engine = auth.get_engine()
+        tables = _get_tables()
+        while True:
+            batch = self._drain()
+            deltas = _aggregate(batch)
+            err = self._write(engine, tables, batch, deltas)
+            if err is not None and len(batch) > 1:
+                # まとめて書けない：1件ずつ書き直し、書けない行だけ捨てる（同じバッチの他のユーザーの分は残す）
+                print(f"[WARN] attempts batch write failed, retrying {len(batch)} rows one by one: {err}")
+                for row in batch:
+                    e = self._write(engine, tables, [row], _aggregate([row]), retries=1)
+                    if e is not None:
+                        self.dropped += 1
+                        print(f"[WARN] attempts write failed, dropped row for user {row.get('user_id')}: {e}")
+            elif err is not None:
+                self.dropped += 1
+                print(f"[WARN] attempts write failed, dropped 1 row: {err}")
+            # コミット済み（または破棄）になった分を書き込み待ちの差分から外す
+            _pending_apply(deltas, -1)
+            for _ in batch:
+                self._q.task_done()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """キューが空になるまで待つ（テスト・ベンチ・終了時用）。timeout 到達なら False"""
+        if self._thread is None:
+            return True
+        if timeout is None:
+            self._q.join()
+            return True
+        deadline = time.monotonic() + timeout
+        while self._q.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def pending(self) -> int:
+        return self._q.unfinished_tasks
+
+
+# 同じトランザクションで追加の書き込みをしたいモジュール（復習スケジュールなど）のフック。
+# fn(conn, batch) の形で、attempts / 集計の後に登録順で呼ぶ（例外はバッチ全体のリトライ対象）
+_batch_hooks: list = []
+
+def register_batch_hook(fn):
+    if fn not in _batch_hooks:
+        _batch_hooks.append(fn)
+    return fn
+
+# init_db() の中（attempts のテーブルを作った後、書き込みを始める前）に fn(engine) を呼ぶ。
+# フックが書き込むテーブルはここで作る。書き込み中のトランザクションで作ると、ロールバックされたときに
+# 「作った」印だけ残る
+_setup_hooks: list = []
+
+def register_setup_hook(fn):
+    if fn not in _setup_hooks:
+        _setup_hooks.append(fn)
+        if _initialized:  # init_db の後に import されたモジュール
+            fn(auth.get_engine())
+    return fn
+
+# reset_history() の同じトランザクションで、集計を消す前に fn(conn, user_id) を呼ぶ
+_reset_hooks: list = []
+
+def register_reset_hook(fn):
+    if fn not in _reset_hooks:
+        _reset_hooks.append(fn)
+    return fn
+
+
+def _write_batch(conn, tables: dict, batch: List[dict], deltas: dict):
+    """1トランザクション分の書き込み：attempts への追記（executemany）＋集計の差分更新＋フック"""
+    conn.execute(tables["attempts"].insert(), batch)
+    _upsert_stats(conn, tables["user_skill_stats"], deltas)
+    for hook in _batch_hooks:
+        hook(conn, batch)
+
+
+_writer = _AttemptWriter()
+atexit.register(lambda: _writer.flush(timeout=5.0))
+
+
+# ---- 公開API ----
+
+def enqueue(user_id: int, session_items: Iterable[dict]) -> int:
+    """採点結果をキューに積む（ディスク書き込みは待たない）。積んだ件数を返す"""
+    now = dt.datetime.utcnow()
+    rows = [_to_row(user_id, it, now) for it in session_items if it]
+    if rows:
+        _pending_apply(_aggregate(rows), +1)
+        _writer.put(rows)
+    return len(rows)
+
+
+def flush(timeout: Optional[float] = None) -> bool:
+    return _writer.flush(timeout)
+
+
+def _wait_user_pending(user_id: int, timeout: float) -> bool:
+    """そのユーザーの書き込み待ちが無くなるまで待つ（キュー全体は待たない）。timeout 到達なら False"""
+    deadline = time.monotonic() + timeout
+    while True:
+        with _pending_lock:
+            if not any(u == user_id for u, _ in _pending):
+                return True
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+
+
+def writer_stats() -> dict:
+    return {"written": _writer.written, "dropped": _writer.dropped, "pending": _writer.pending()}
+
+
+def load_tail(user_id: int, n: int = HISTORY_TAIL) -> List[dict]:
+    """ユーザーの直近 n 件（古い順）を session_items 形式で返す"""
+    from sqlalchemy import select
+
+    init_db()
+    t = _get_tables()
+    attempts, resets = t["attempts"], t["attempt_resets"]
+    with auth.get_engine().connect() as conn:
+        after_id = conn.execute(
+            select(resets.c.after_id).where(resets.c.user_id == int(user_id))
+        ).scalar() or 0
+        stmt = (
+            select(attempts)
+            .where(attempts.c.user_id == int(user_id), attempts.c.id > after_id)
+            .order_by(attempts.c.id.desc())
+            .limit(int(n))
+        )
+        rows = conn.execute(stmt).fetchall()
+    return [_from_row(r) for r in reversed(rows)]
+
+
+def get_skill_stats(user_id: int) -> dict:
+    """
+    ユーザーのスキル別集計 {skill: {...}}（DB値＋書き込み待ちの差分）。
+    履歴件数に関係なく O(スキル数) で読める。
+    """
+    from sqlalchemy import select
+
+    init_db()
+    stats = _get_tables()["user_skill_stats"]
+    out: dict = {}
+    with auth.get_engine().connect() as conn:
+        for r in conn.execute(select(stats).where(stats.c.user_id == int(user_id))):
+            m = r._mapping
+            out[r.skill] = {f: m[f] or 0 for f in _STAT_FIELDS}
+            out[r.skill]["last_seen"] = r.last_seen
+            out[r.skill]["ability"] = r.ability
+    with _pending_lock:
+        pend = [(sk, dict(d)) for (u, sk), d in _pending.items() if u == int(user_id)]
+    for sk, d in pend:
+        cur = out.setdefault(sk, {**dict.fromkeys(_STAT_FIELDS, 0), "last_seen": None, "ability": None})
+        for f in _STAT_FIELDS:
+            cur[f] += d[f]
+        if d["last_seen"] and (cur["last_seen"] is None or d["last_seen"] > cur["last_seen"]):
+            cur["last_seen"] = d["last_seen"]
+        if d["ability"] is not None:
+            cur["ability"] = d["ability"]
+    return out
+
+
+def skill_scores(stats: dict) -> dict:
+    """get_skill_stats() の結果 → 講評用のスキル別スコア（0..1）"""
+    return {sk: round(d["score_sum"] / d["score_n"], 2) for sk, d in stats.items() if d.get("score_n")}
+
+
+def reset_history(user_id: int) -> None:
+    """通算をリセット：集計を消し、以降の履歴復元はこの時点より後の attempts だけにする（ログ自体は残す）"""
+    from sqlalchemy import select, func
+
+    init_db()
+    uid = int(user_id)
+    # リセット前に採点した分がリセット後に書かれないよう、このユーザーの分だけ待つ（画面を長く止めない）
+    if not _wait_user_pending(uid, RESET_WAIT_SEC):
+        print(f"[WARN] attempts for user {uid} still queued at reset; they may count after the reset")
+    t = _get_tables()
+    attempts, stats, resets = t["attempts"], t["user_skill_stats"], t["attempt_resets"]
+    with auth.get_engine().begin() as conn:
+        after_id = conn.execute(
+            select(func.max(attempts.c.id)).where(attempts.c.user_id == uid)
+        ).scalar() or 0
+        for hook in _reset_hooks:
+            hook(conn, uid)
+        conn.execute(stats.delete().where(stats.c.user_id == uid))
+        conn.execute(resets.delete().where(resets.c.user_id == uid))
+        conn.execute(resets.insert(), [{"user_id": uid, "after_id": after_id, "reset_at": dt.datetime.utcnow()}])
@@ -1,74 +1,176 @@
 # services/auth.py (PII-free: account_id only)
 from __future__ import annotations
 import os
+import threading
 import datetime as dt
 from pathlib import Path
 from typing import Optional
 
-import bcrypt
-from sqlalchemy import create_engine, String, Integer, DateTime, UniqueConstraint
-from sqlalchemy.orm import declarative_base, Mapped, mapped_column, sessionmaker, Session
+from typing import TYPE_CHECKING
+
+from app.services.metrics import AUTH_ATTEMPTS, timed
+
+# SQLAlchemy / bcrypt は import が重いので、初回のDB操作・ハッシュ計算時に読み込む
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Session
 
 DEFAULT_SQLITE_PATH = Path("data/users.db")
 DEFAULT_SQLITE_URL = f"sqlite:///{DEFAULT_SQLITE_PATH.as_posix()}"
 DATABASE_URL = os.getenv("DATABASE_URL", DEFAULT_SQLITE_URL)
 
-Base = declarative_base()
+# --- 接続プール／SQLite PRAGMA（環境変数で上書き可） ---
+DB_POOL_SIZE     = int(os.getenv("CQ_DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW  = int(os.getenv("CQ_DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT  = float(os.getenv("CQ_DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE  = int(os.getenv("CQ_DB_POOL_RECYCLE", "1800"))   # 秒（サーバDBのアイドル切断対策）
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("CQ_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE       = int(os.getenv("CQ_SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+BCRYPT_ROUNDS          = int(os.getenv("CQ_BCRYPT_ROUNDS", "12"))
+
+_Base = None
+_User = None
 _engine = None
 _SessionLocal = None
+_db_initialized = False
+_init_lock = threading.Lock()
+
+def _models():
+    """ORM モデル (Base, User) を初回だけ構築して返す"""
+    global _Base, _User
+    if _User is None:
+        from sqlalchemy import String, Integer, DateTime, UniqueConstraint
+        from sqlalchemy.orm import declarative_base, Mapped, mapped_column
+
+        # 注釈は文字列（from __future__ import annotations）で、SQLAlchemy はモジュールの名前空間で解決する
+        globals()["Mapped"] = Mapped
+        Base = declarative_base()
+
+        class User(Base):
+            __tablename__ = "users"
+            id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+            account_id: Mapped[str] = mapped_column(String(64), nullable=False)  # ユーザーが決めるID（英数/記号可）
+            display_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+            password_hash: Mapped[str] = mapped_column(String(255), nullable=False)
+            created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
+
+            __table_args__ = (UniqueConstraint("account_id", name="uq_users_account_id"),)
+
+            def to_public_dict(self):
+                return {
+                    "id": self.id,
+                    "account_id": self.account_id,
+                    "display_name": self.display_name,
+                    "created_at": self.created_at.isoformat() if self.created_at else None,
+                }
+
+        _Base, _User = Base, User
+    return _Base, _User
+
+def __getattr__(name: str):
+    # 互換: auth.Base / auth.User はアクセス時にモデルを構築して返す
+    if name == "Base":
+        return _models()[0]
+    if name == "User":
+        return _models()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-class User(Base):
-    __tablename__ = "users"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    account_id: Mapped[str] = mapped_column(String(64), nullable=False)  # ユーザーが決めるID（英数/記号可）
-    display_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
-    password_hash: Mapped[str] = mapped_column(String(255), nullable=False)
-    created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
+def _ensure_sqlite_dir():
+    if DATABASE_URL.startswith("sqlite:///"):
+        DEFAULT_SQLITE_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-    __table_args__ = (UniqueConstraint("account_id", name="uq_users_account_id"),)
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
 
-    def to_public_dict(self):
+def _is_sqlite_memory(url: str) -> bool:
+    return url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url
+
+def _engine_kwargs(url: str) -> dict:
+    """バックエンドごとの create_engine 引数（プール設定）"""
+    from sqlalchemy.pool import StaticPool
+
+    if _is_sqlite(url):
+        connect_args = {
+            "check_same_thread": False,
+            # sqlite3 側のロック待ち（秒）。PRAGMA busy_timeout と揃える
+            "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+        }
+        if _is_sqlite_memory(url):
+            # インメモリDBは接続ごとに別DBになるため1接続を共有する
+            return {"connect_args": connect_args, "poolclass": StaticPool}
         return {
-            "id": self.id,
-            "account_id": self.account_id,
-            "display_name": self.display_name,
-            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "connect_args": connect_args,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
         }
-
-def _ensure_sqlite_dir():
-    if DATABASE_URL.startswith("sqlite:///"):
-        DEFAULT_SQLITE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    # PostgreSQL / MySQL などサーバDB
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    """接続確立ごとに PRAGMA を適用（WAL で読み書きの同時実行を許可）"""
+    cur = dbapi_conn.cursor()
+    try:
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cur.execute("PRAGMA foreign_keys=ON")
+    finally:
+        cur.close()
 
 def get_engine():
     global _engine
     if _engine is None:
+        from sqlalchemy import create_engine, event
+
         _ensure_sqlite_dir()
-        connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-        _engine = create_engine(DATABASE_URL, echo=False, future=True, connect_args=connect_args)
+        _engine = create_engine(DATABASE_URL, echo=False, future=True, **_engine_kwargs(DATABASE_URL))
+        if _is_sqlite(DATABASE_URL):
+            event.listen(_engine, "connect", _set_sqlite_pragmas)
     return _engine
 
 def get_session() -> Session:
     global _SessionLocal
     if _SessionLocal is None:
+        from sqlalchemy.orm import sessionmaker
+
         _SessionLocal = sessionmaker(bind=get_engine(), autoflush=False, autocommit=False, future=True)
     return _SessionLocal()
 
 def init_db():
-    engine = get_engine()
-    Base.metadata.create_all(engine)
+    # create_all は毎回メタデータ照会が走るため、プロセス内で一度だけ実行
+    global _db_initialized
+    if _db_initialized:
+        return
+    with _init_lock:
+        if not _db_initialized:
+            engine = get_engine()
+            Base, _ = _models()
+            Base.metadata.create_all(engine)
+            _db_initialized = True
 
 def hash_password(plain: str) -> str:
     if not isinstance(plain, str) or not plain:
         raise ValueError("Password must be non-empty string")
-    return bcrypt.hashpw(plain.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    import bcrypt
+    return bcrypt.hashpw(plain.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode("utf-8")
 
 def verify_password(plain: str, hashed: str) -> bool:
+    import bcrypt
     try:
         return bcrypt.checkpw(plain.encode("utf-8"), hashed.encode("utf-8"))
     except Exception:
         return False
 
 def create_user(account_id: str, password: str, display_name: Optional[str] = None) -> User:
+    from sqlalchemy.exc import IntegrityError
+
     aid = (account_id or "").strip()
     if not aid:
         raise ValueError("account_id required")
@@ -76,6 +178,9 @@ def create_user(account_id: str, password: str, display_name: Optional[str] = No
         raise ValueError("password required")
 
     init_db()
+    _, User = _models()
+    # bcrypt は重いので、プール接続を握る前に計算しておく
+    pw_hash = hash_password(password)
     with get_session() as db:
         exists = db.query(User).filter(User.account_id == aid).first()
         if exists:
@@ -84,24 +189,35 @@ def create_user(account_id: str, password: str, display_name: Optional[str] = No
         user = User(
             account_id=aid,
             display_name=(display_name or "").strip() or None,
-            password_hash=hash_password(password),
+            password_hash=pw_hash,
         )
         db.add(user)
-        db.commit()
+        try:
+            db.commit()
+        except IntegrityError:
+            # 同一IDの同時登録（exists チェック後に先を越された）
+            db.rollback()
+            raise ValueError("account_id already registered")
         db.refresh(user)
         return user
 
+@timed("authenticate")
 def authenticate(account_id: str, password: str) -> Optional[User]:
     aid = (account_id or "").strip()
     init_db()
+    _, User = _models()
     with get_session() as db:
         user = db.query(User).filter(User.account_id == aid).first()
-        if user and verify_password(password, user.password_hash):
-            return user
-        return None
+    # 照合（bcrypt）は接続をプールへ返してから行う
+    if user and verify_password(password, user.password_hash):
+        AUTH_ATTEMPTS.inc(result="ok")
+        return user
+    AUTH_ATTEMPTS.inc(result="fail")
+    return None
 
 def get_user_by_id(user_id: int) -> Optional[User]:
     init_db()
+    _, User = _models()
     with get_session() as db:
         return db.query(User).filter(User.id == user_id).first()
 
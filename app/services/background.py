@@ -0,0 +1,24 @@
+# app/services/background.py
+# プロセス共有のバックグラウンド実行プール（先読みなど、UI スレッドを待たせたくない処理用）。
+# Streamlit はセッションごとにスクリプトを再実行するため、プールはモジュールに1つだけ持つ。
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+MAX_WORKERS = int(os.getenv("CQ_BACKGROUND_WORKERS", "4"))
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="cq-bg")
+    return _executor
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    return _get_executor().submit(fn, *args, **kwargs)
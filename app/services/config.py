@@ -1,11 +1,13 @@
 import os
+import sys
 from pathlib import Path
-import streamlit as st
 
 def _get(key: str, default: str | None = None) -> str | None:
     # Streamlit Cloud の secrets > 環境変数 > 既定値 の優先
+    # streamlit は import が重いので、既に読み込まれている（＝アプリ実行中）ときだけ secrets を見る
+    st = sys.modules.get("streamlit")
     try:
-        if hasattr(st, "secrets") and key in st.secrets:
+        if st is not None and hasattr(st, "secrets") and key in st.secrets:
             return st.secrets[key]
     except Exception:
         pass
@@ -19,6 +21,14 @@ OPENAI_API_KEY  = _get("OPENAI_API_KEY", "")
 OPENAI_BASE_URL = _get("OPENAI_BASE_URL", "")  # 例: https://api.openai.com/v1 や 互換APIのURL
 OPENAI_MODEL    = _get("OPENAI_MODEL", "gpt-4o-mini")
 
+# Anthropic（CQ_LLM_PROVIDERS に anthropic を入れたときだけ使う）
+ANTHROPIC_API_KEY  = _get("ANTHROPIC_API_KEY", "")
+ANTHROPIC_BASE_URL = _get("ANTHROPIC_BASE_URL", "")  # 例: http://127.0.0.1:8766（/v1 は付けない）
+ANTHROPIC_MODEL    = _get("ANTHROPIC_MODEL", "claude-3-5-haiku-latest")
+
+# 使うプロバイダの順（先頭が主、2番目がヘッジ／フェイルオーバー先）
+LLM_PROVIDERS = _get("CQ_LLM_PROVIDERS", "openai")
+
 # DB パス：ローカルは data/cq.db、Cloud は /tmp/cq.db
 if RUN_ENV == "cloud":
     DB_PATH = Path("/tmp/cq.db")
@@ -58,21 +68,37 @@ else:
 
 JSONL_PATH = _DEFAULT_JSONL_PATH
 
-# 必要なディレクトリを作成
-try:
-    _DEFAULT_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-except Exception:
-    pass
-try:
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-except Exception:
-    pass
-
-# POSIX環境かつ /tmp 側が未作成で、ローカルdata側にDBが既にあるならコピー（静かに失敗許容）
-if _IS_POSIX_TMP and (not DB_PATH.exists()) and _DEFAULT_DB_PATH.exists():
+# 明示指定（ベンチマークや検証用に別の問題バンクを使うとき）
+if _get("CQ_DB_PATH"):
+    DB_PATH = Path(_get("CQ_DB_PATH"))
+
+_runtime_paths_ready = False
+
+def ensure_runtime_paths() -> None:
+    """
+    DB 用ディレクトリの作成と、/tmp 側 DB の初回コピーを行う（import 時には実行しない）。
+    2回目以降は何もしない。
+    """
+    global _runtime_paths_ready
+    if _runtime_paths_ready:
+        return
+    _runtime_paths_ready = True
+
+    # 必要なディレクトリを作成
     try:
-        shutil.copy(_DEFAULT_DB_PATH, DB_PATH)
-        print("✅ Copied DB to temporary directory for Cloud runtime")
-    except Exception as e:
-        # Cloud初回などで data 側が無いこともあるため、警告だけに留める
-        print(f"⚠️ Temp DB copy skipped: {e}")
+        _DEFAULT_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    except Exception:
+        pass
+    try:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    except Exception:
+        pass
+
+    # POSIX環境かつ /tmp 側が未作成で、ローカルdata側にDBが既にあるならコピー（静かに失敗許容）
+    if _IS_POSIX_TMP and (not DB_PATH.exists()) and _DEFAULT_DB_PATH.exists():
+        try:
+            shutil.copy(_DEFAULT_DB_PATH, DB_PATH)
+            print("✅ Copied DB to temporary directory for Cloud runtime")
+        except Exception as e:
+            # Cloud初回などで data 側が無いこともあるため、警告だけに留める
+            print(f"⚠️ Temp DB copy skipped: {e}")
@@ -3,7 +3,9 @@ import json
 import sqlite3
 from typing import List, Optional, Set
 from app.domain.models import Question
-from app.services.config import DB_PATH
+from app.services.config import DB_PATH, ensure_runtime_paths
+from app.services.metrics import timed
+from app.services.profiler import profiled
 
 # ---- 内部ヘルパ ----
 
@@ -86,7 +88,10 @@ def _build_select(cols: Set[str]) -> str:
 
 # ---- 公開API ----
 
+@profiled("load_questions")
+@timed("load_questions")
 def load_questions(skill_filter: Optional[str] = None, limit: int = 5) -> List[Question]:
+    ensure_runtime_paths()
     with sqlite3.connect(DB_PATH) as conn:
         cols = _get_columns(conn)
         cur = conn.cursor()
@@ -112,3 +117,20 @@ def load_questions(skill_filter: Optional[str] = None, limit: int = 5) -> List[Q
         rows = cur.fetchall()
 
     return _rows_to_questions(rows)
+
+@profiled("load_all_questions")
+@timed("load_all_questions")
+def load_all_questions() -> List[Question]:
+    """
+    問題バンク全件を登録順（ord、無い DB では rowid）で返す。選定用インデックスの構築に使う。
+    登録順は問題が増えても既存分が変わらない（walk モードの位置の基準）
+    """
+    ensure_runtime_paths()
+    with sqlite3.connect(DB_PATH) as conn:
+        cols = _get_columns(conn)
+        if not cols:
+            return []
+        order = "ORDER BY ord, rowid" if "ord" in cols else "ORDER BY rowid"
+        base_sql = _build_select(cols).replace("ORDER BY RANDOM() LIMIT ?", order)
+        rows = conn.execute(base_sql).fetchall()
+    return _rows_to_questions(rows)
@@ -19,7 +19,8 @@ def init_db():
             explanations_json TEXT,
             difficulty REAL,
             tags_json TEXT,
-            feedbacks_json TEXT   -- ★ 追加
+            feedbacks_json TEXT,  -- ★ 追加
+            ord INTEGER           -- 登録順の通し番号（import_jsonl が振る）
         );
         """)
         # 既存DBに feedbacks_json が無い場合は追加
@@ -27,6 +28,9 @@ def init_db():
         cols = [r[1] for r in cur.fetchall()]
         if "feedbacks_json" not in cols:
             cur.execute("ALTER TABLE questions ADD COLUMN feedbacks_json TEXT")
+        if "ord" not in cols:
+            cur.execute("ALTER TABLE questions ADD COLUMN ord INTEGER")
+            cur.execute("UPDATE questions SET ord = rowid WHERE ord IS NULL")
         conn.commit()
 
 if __name__ == "__main__":
@@ -0,0 +1,223 @@
+# app/services/export.py
+# 分析用の列指向エクスポート（問題バンクと採点済み attempts → Parquet）。
+#   python -m app.services.export                  # 前回の続き（ウォーターマーク以降の attempts）だけ
+#   python -m app.services.export --full           # attempts を最初から書き出し直す
+#   python -m app.services.export --out /path/dir  # 出力先（既定 data/export）
+#
+# 出力（Hive 形式のパーティション。pandas.read_parquet(dir) / DuckDB read_parquet(..., hive_partitioning=1)
+# でそのまま読める）:
+#   <out>/questions/questions.parquet                        問題バンクのスナップショット（毎回置き換え）
+#   <out>/attempts/date=YYYY-MM-DD/part-<先頭id>-<末尾id>.parquet
+#
+# - attempts は id 順に CHUNK_ROWS 件ずつ読み（キーセットページング）、チャンクごとに日付で分けて書く。
+#   メモリはチャンク1つ分
+# - ウォーターマーク（書き出し済み attempts.id）は item_analysis と同じ job_watermarks に、
+#   チャンクのファイルを書き終えてから進める。途中で落ちたら同じチャンクを同じファイル名で書き直す
+# - 列は session_items と同じ項目（question_id, type, skill, difficulty, tags, correct, chosen,
+#   free_score01）に attempt_id / user_id / answer_key / best / ability / created_at を足したもの
+import argparse
+import datetime as dt
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from app.services import attempts, auth, item_analysis
+from app.services.config import DB_PATH, ensure_runtime_paths
+
+JOB_NAME = "export_parquet"
+CHUNK_ROWS = int(os.getenv("CQ_EXPORT_CHUNK", "100000"))
+DEFAULT_OUT = Path(__file__).resolve().parents[2] / "data" / "export"
+COMPRESSION = os.getenv("CQ_EXPORT_COMPRESSION", "zstd")
+
+ATTEMPT_SCHEMA = pa.schema([
+    ("attempt_id", pa.int64()),
+    ("user_id", pa.int64()),
+    ("question_id", pa.string()),
+    ("type", pa.string()),
+    ("skill", pa.string()),
+    ("difficulty", pa.float64()),
+    ("tags", pa.list_(pa.string())),
+    ("correct", pa.bool_()),
+    ("chosen", pa.string()),
+    ("answer_key", pa.string()),
+    ("best", pa.string()),
+    ("free_score01", pa.float64()),
+    ("ability", pa.float64()),
+    ("created_at", pa.timestamp("us")),
+])
+
+QUESTION_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("skill", pa.string()),
+    ("level", pa.string()),
+    ("type", pa.string()),
+    ("prompt", pa.string()),
+    ("choices", pa.list_(pa.string())),
+    ("answer_key", pa.string()),
+    ("explanations_json", pa.string()),
+    ("difficulty", pa.float64()),
+    ("tags", pa.list_(pa.string())),
+    ("feedbacks_json", pa.string()),
+    ("ord", pa.int64()),
+])
+
+
+def _json_list(s) -> Optional[list]:
+    if not s:
+        return None
+    try:
+        v = json.loads(s)
+    except ValueError:
+        return None
+    return [str(x) for x in v] if isinstance(v, list) else None
+
+
+def _created(v):
+    # SQLite からは文字列で返ることがある
+    return dt.datetime.fromisoformat(v) if isinstance(v, str) else v
+
+
+# ---- 問題バンク ----
+
+def export_questions(out: Path, bank_path=None) -> int:
+    """cq.db の questions を1ファイルに書き出す（一時ファイルに書いてから置き換え）"""
+    if bank_path is None:
+        ensure_runtime_paths()
+        bank_path = DB_PATH
+    with sqlite3.connect(bank_path) as conn:
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(questions)")}
+        order = "ord, rowid" if "ord" in cols else "rowid"
+        ord_col = "ord" if "ord" in cols else "rowid"
+        rows = conn.execute(
+            "SELECT id, skill, level, type, prompt, choices_json, answer_key, explanations_json, "
+            f"difficulty, tags_json, {'feedbacks_json' if 'feedbacks_json' in cols else 'NULL'}, {ord_col} "
+            f"FROM questions ORDER BY {order}"
+        ).fetchall()
+    data = {f.name: [] for f in QUESTION_SCHEMA}
+    for (qid, skill, level, typ, prompt, choices, key, expl, diff, tags, fbs, ordv) in rows:
+        for name, v in (("id", qid), ("skill", skill), ("level", level), ("type", typ), ("prompt", prompt),
+                        ("choices", _json_list(choices)), ("answer_key", key), ("explanations_json", expl),
+                        ("difficulty", diff), ("tags", _json_list(tags)), ("feedbacks_json", fbs),
+                        ("ord", ordv)):
+            data[name].append(v)
+    dest = out / "questions"
+    dest.mkdir(parents=True, exist_ok=True)
+    tmp = dest / ".questions.parquet.tmp"
+    pq.write_table(pa.Table.from_pydict(data, schema=QUESTION_SCHEMA), tmp, compression=COMPRESSION)
+    os.replace(tmp, dest / "questions.parquet")
+    return len(rows)
+
+
+# ---- attempts ----
+
+def _chunk_table(rows) -> pa.Table:
+    (ids, users, qids, types, skills, diffs, tags, correct, chosen, keys, best, free, ability,
+     created) = zip(*rows)
+    return pa.Table.from_pydict({
+        "attempt_id": ids, "user_id": users, "question_id": qids, "type": types, "skill": skills,
+        "difficulty": diffs, "tags": [_json_list(t) for t in tags], "correct": correct, "chosen": chosen,
+        "answer_key": keys, "best": best, "free_score01": free, "ability": ability,
+        "created_at": [_created(c) for c in created],
+    }, schema=ATTEMPT_SCHEMA)
+
+
+def _write_partitions(table: pa.Table, dest: Path) -> int:
+    """チャンクを日付ごとのファイルに分けて書く。書いたファイル数を返す"""
+    days = pc.strftime(table["created_at"], format="%Y-%m-%d")
+    files = 0
+    for day in pc.unique(days).to_pylist():
+        part = table.filter(pc.equal(days, day))
+        ids = part["attempt_id"]
+        d = dest / f"date={day}"
+        d.mkdir(parents=True, exist_ok=True)
+        name = f"part-{pc.min(ids).as_py():012d}-{pc.max(ids).as_py():012d}.parquet"
+        tmp = d / f".{name}.tmp"
+        pq.write_table(part, tmp, compression=COMPRESSION)
+        os.replace(tmp, d / name)
+        files += 1
+    return files
+
+
+def _set_watermark(conn, last_id: int):
+    wm = item_analysis._get_tables()["job_watermarks"]
+    now = dt.datetime.utcnow()
+    if conn.execute(wm.update().where(wm.c.job == JOB_NAME)
+                    .values(last_id=last_id, updated_at=now)).rowcount == 0:
+        conn.execute(wm.insert(), [{"job": JOB_NAME, "last_id": last_id, "updated_at": now}])
+
+
+def get_watermark() -> int:
+    from sqlalchemy import select
+
+    item_analysis.init_db()
+    wm = item_analysis._get_tables()["job_watermarks"]
+    with auth.get_engine().connect() as conn:
+        return int(conn.execute(select(wm.c.last_id).where(wm.c.job == JOB_NAME)).scalar() or 0)
+
+
+def run(out: Path = DEFAULT_OUT, full: bool = False, chunk_rows: int = CHUNK_ROWS,
+        bank_path=None, log=print) -> dict:
+    """問題バンクのスナップショットと、ウォーターマーク以降の attempts を書き出す。処理結果の要約を返す"""
+    from sqlalchemy import select
+
+    out = Path(out)
+    item_analysis.init_db()  # attempts と job_watermarks
+    attempts.flush()
+    at = attempts._get_tables()["attempts"]
+    engine = auth.get_engine()
+    dest = out / "attempts"
+
+    n_questions = export_questions(out, bank_path)
+
+    if full:
+        shutil.rmtree(dest, ignore_errors=True)
+        with engine.begin() as conn:
+            _set_watermark(conn, 0)
+    last_id = get_watermark()
+    start_id = last_id
+    rows_done, files = 0, 0
+    t0 = time.perf_counter()
+    cols = [at.c[c] for c in ("id", "user_id", "question_id", "type", "skill", "difficulty", "tags_json",
+                              "correct", "chosen", "answer_key", "best", "free_score01", "ability",
+                              "created_at")]
+    while True:
+        stmt = select(*cols).where(at.c.id > last_id).order_by(at.c.id).limit(int(chunk_rows))
+        with engine.connect() as conn:
+            rows = conn.execute(stmt).fetchall()
+        if not rows:
+            break
+        files += _write_partitions(_chunk_table(rows), dest)
+        last_id = int(rows[-1][0])
+        with engine.begin() as conn:
+            _set_watermark(conn, last_id)
+        rows_done += len(rows)
+        log(f"  chunk: {len(rows)} rows (up to id {last_id}), {rows_done / (time.perf_counter() - t0):.0f} rows/s")
+
+    return {"out": str(out), "questions": n_questions, "from_id": start_id, "to_id": last_id,
+            "rows": rows_done, "files": files, "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="問題バンクと attempts を Parquet に書き出す")
+    ap.add_argument("--out", type=Path, default=DEFAULT_OUT)
+    ap.add_argument("--full", action="store_true", help="attempts を最初から書き出し直す")
+    ap.add_argument("--chunk", type=int, default=CHUNK_ROWS)
+    args = ap.parse_args(argv)
+
+    res = run(out=args.out, full=args.full, chunk_rows=args.chunk)
+    print(f"{res['questions']} questions, attempts id {res['from_id']} -> {res['to_id']}: "
+          f"{res['rows']} rows in {res['files']} files ({res['seconds']}s) -> {res['out']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
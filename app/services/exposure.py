@@ -0,0 +1,173 @@
+# app/services/exposure.py
+# 出題回数（露出）の集計と、露出の少ない問題を優先する選定。
+#   - record() は表示した問題IDをメモリ上のカウンタに足すだけ（DB へは書かない）
+#   - 書き込みスレッドが FLUSH_SEC ごとに差分をまとめて item_exposure に加算（1トランザクション）
+#   - 他プロセスの分は REFRESH_SEC ごとに DB の合計を読み直して取り込む
+#   - least_exposed() は候補の中から露出の少ない順（同数はランダム）に選ぶ
+import atexit
+import datetime as dt
+import heapq
+import os
+import random
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from app.services import auth
+
+ENABLED = os.getenv("CQ_EXPOSURE_CONTROL", "1").strip().lower() not in ("0", "false", "off")
+FLUSH_SEC = float(os.getenv("CQ_EXPOSURE_FLUSH_SEC", "5"))
+REFRESH_SEC = float(os.getenv("CQ_EXPOSURE_REFRESH_SEC", "30"))
+
+_tables = None
+_initialized = False
+_init_lock = threading.Lock()
+_lock = threading.Lock()
+_base: Dict[str, int] = {}       # DB 上の合計（最後に読んだ時点＋自分が書いた分）
+_unflushed: Dict[str, int] = {}  # まだ DB に書いていない差分
+_thread: Optional[threading.Thread] = None
+_start_lock = threading.Lock()
+_flushes = 0
+
+
+def _get_tables():
+    global _tables
+    if _tables is None:
+        from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime
+
+        md = MetaData()
+        exposure = Table(
+            "item_exposure", md,
+            Column("question_id", String(64), primary_key=True),
+            Column("shown", Integer, nullable=False, default=0),
+            Column("last_shown", DateTime),
+        )
+        _tables = {"metadata": md, "item_exposure": exposure}
+    return _tables
+
+
+def init_db():
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            _get_tables()["metadata"].create_all(auth.get_engine())
+            _initialized = True
+
+
+def _ensure_started():
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    with _start_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name="cq-exposure-flusher", daemon=True)
+            _thread.start()
+
+
+def _run():
+    next_refresh = 0.0
+    while True:
+        if time.monotonic() >= next_refresh:
+            try:
+                _refresh()
+            except Exception as e:
+                print(f"[WARN] exposure refresh failed: {e}")
+            next_refresh = time.monotonic() + REFRESH_SEC
+        time.sleep(FLUSH_SEC)
+        flush()
+
+
+def _refresh():
+    from sqlalchemy import select
+
+    init_db()
+    t = _get_tables()["item_exposure"]
+    with auth.get_engine().connect() as conn:
+        totals = {qid: n for qid, n in conn.execute(select(t.c.question_id, t.c.shown))}
+    with _lock:
+        _base.clear()
+        _base.update(totals)
+
+
+def flush() -> int:
+    """未書き込みの差分を1トランザクションで加算する。書いた問題数を返す"""
+    global _flushes
+    with _lock:
+        if not _unflushed:
+            return 0
+        batch = dict(_unflushed)
+        _unflushed.clear()
+    rows = [{"question_id": q, "shown": n, "last_shown": dt.datetime.utcnow()} for q, n in batch.items()]
+    try:
+        init_db()
+        engine = auth.get_engine()
+        t = _get_tables()["item_exposure"]
+        with engine.begin() as conn:
+            dialect = conn.dialect.name
+            if dialect in ("sqlite", "postgresql"):
+                if dialect == "sqlite":
+                    from sqlalchemy.dialects.sqlite import insert
+                else:
+                    from sqlalchemy.dialects.postgresql import insert
+                ins = insert(t)
+                conn.execute(ins.on_conflict_do_update(
+                    index_elements=["question_id"],
+                    set_={"shown": t.c.shown + ins.excluded.shown, "last_shown": ins.excluded.last_shown},
+                ), rows)
+            else:
+                for row in rows:
+                    upd = (t.update().where(t.c.question_id == row["question_id"])
+                           .values(shown=t.c.shown + row["shown"], last_shown=row["last_shown"]))
+                    if conn.execute(upd).rowcount == 0:
+                        conn.execute(t.insert(), [row])
+    except Exception as e:
+        # 書けなかった分は戻して次回に回す
+        print(f"[WARN] exposure flush failed: {e}")
+        with _lock:
+            for q, n in batch.items():
+                _unflushed[q] = _unflushed.get(q, 0) + n
+        return 0
+    with _lock:
+        for q, n in batch.items():
+            _base[q] = _base.get(q, 0) + n
+        _flushes += 1
+    return len(rows)
+
+atexit.register(flush)
+
+
+# ---- 公開API ----
+
+def record(question_ids: Iterable[str]) -> None:
+    """表示した問題を数える（メモリだけ。DB へはまとめて書く）"""
+    ids = [q for q in question_ids if q]
+    if not ids:
+        return
+    with _lock:
+        for q in ids:
+            _unflushed[q] = _unflushed.get(q, 0) + 1
+    _ensure_started()
+
+
+def counts(question_ids: Iterable[str]) -> Dict[str, int]:
+    with _lock:
+        return {q: _base.get(q, 0) + _unflushed.get(q, 0) for q in question_ids}
+
+
+def least_exposed(candidates: List, want: int, rnd: Optional[random.Random] = None) -> List:
+    """候補（id 属性を持つもの）から露出の少ない順に want 件。無効時・同数はランダム"""
+    r = rnd or random
+    if len(candidates) <= want:
+        return list(candidates)
+    if not ENABLED:
+        return r.sample(candidates, want)
+    c = counts(q.id for q in candidates)
+    return heapq.nsmallest(want, candidates, key=lambda q: (c[q.id], r.random()))
+
+
+def stats() -> dict:
+    with _lock:
+        return {"items": len(set(_base) | set(_unflushed)), "unflushed": sum(_unflushed.values()),
+                "flushes": _flushes}
@@ -41,3 +41,90 @@ def grade_sjt(questions: List[Question], chosen_keys: List[str]) -> List[dict]:
             "feedback_desc": fb.get("desc", "—")
         })
     return out
+
+
+# ▼ 列指向の一括採点（履歴の再採点など、件数が多いとき用）
+#   問題ID・選択の配列を受け取り、正答コードのベクトルを引くだけで正誤を出す。
+#   行ごとの AttemptResult は作らない。numpy はここでだけ読む（起動時の import を重くしない）
+
+def encode_choices(chosen):
+    """選択（"a", " B", None ...）の列 → 0..3（A..D）、それ以外は -1"""
+    import numpy as np
+
+    arr = np.asarray([c or "" for c in chosen], dtype=str)
+    codes = np.full(len(arr), -1, dtype=np.int8)
+    for i, k in enumerate(KEYS):
+        codes[arr == k] = i
+    # 大文字1文字以外（"a" / " B" など）だけ正規化して引き直す
+    rest = np.flatnonzero((codes < 0) & (arr != ""))
+    if len(rest):
+        norm = np.char.upper(np.char.strip(arr[rest]))
+        for i, k in enumerate(KEYS):
+            codes[rest[norm == k]] = i
+    return codes
+
+
+class AnswerKeys:
+    """問題ID → 正答コードの引き当て表（ID はソート済み配列で二分探索）"""
+
+    def __init__(self, ids, answer_keys):
+        import numpy as np
+
+        ids = np.asarray(list(ids), dtype=str)
+        order = np.argsort(ids, kind="stable")
+        self.ids = ids[order]
+        self.codes = encode_choices(list(answer_keys))[order]
+
+    @classmethod
+    def from_questions(cls, questions: List[Question]) -> "AnswerKeys":
+        return cls([q.id for q in questions], [q.answer_key for q in questions])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, question_ids):
+        """問題IDの列 → 正答コード（表に無い問題は -2）"""
+        import numpy as np
+
+        q = np.asarray(question_ids, dtype=str)
+        if len(self.ids) == 0:
+            return np.full(len(q), -2, dtype=np.int8)
+        pos = np.minimum(np.searchsorted(self.ids, q), len(self.ids) - 1)
+        return np.where(self.ids[pos] == q, self.codes[pos], -2).astype(np.int8)
+
+
+def grade_columns(key_codes, chosen_codes):
+    """
+    正答コード列と選択コード列 → 正誤（1=正解, 0=不正解, -1=判定なし）。
+    grade_mcq と同じく、正答が無い・選択が A〜D 以外なら判定なし
+    """
+    import numpy as np
+
+    key_codes = np.asarray(key_codes)
+    chosen_codes = np.asarray(chosen_codes)
+    out = (key_codes == chosen_codes).astype(np.int8)
+    out[(key_codes < 0) | (chosen_codes < 0)] = -1
+    return out
+
+
+def summarize_columns(skills, correct, difficulty=None) -> dict:
+    """
+    スキル列と正誤列（grade_columns の結果）→ {skill: {graded, correct, weighted_score, weighted_total}}。
+    weighted_* は user_skill_stats と同じ Σdifficulty（欠損は 0.5）
+    """
+    import numpy as np
+
+    names, inv = np.unique(np.asarray(skills, dtype=str), return_inverse=True)
+    m = len(names)
+    correct = np.asarray(correct)
+    graded = correct >= 0
+    ok = (correct == 1).astype(np.float64)
+    d = np.full(len(correct), 0.5) if difficulty is None else np.nan_to_num(
+        np.asarray(difficulty, dtype=np.float64), nan=0.5)
+    g = np.bincount(inv, weights=graded.astype(np.float64), minlength=m)
+    c = np.bincount(inv, weights=ok, minlength=m)
+    ws = np.bincount(inv, weights=d * ok, minlength=m)
+    wt = np.bincount(inv, weights=d * graded, minlength=m)
+    return {str(names[i]): {"graded": int(g[i]), "correct": int(c[i]),
+                            "weighted_score": float(ws[i]), "weighted_total": float(wt[i])}
+            for i in range(m)}
@@ -1,6 +1,11 @@
 import json, sqlite3
 from pathlib import Path
 
+try:
+    from app.services.metrics import IMPORT_ROWS, timed
+except ImportError:  # python app/services/import_jsonl.py で直接実行したとき
+    from metrics import IMPORT_ROWS, timed
+
 DB_PATH = Path("data/cq.db")
 SRC = Path("data/questions.jsonl")
 
@@ -18,21 +23,48 @@ def ensure_schema(conn):
         explanations_json TEXT,
         difficulty REAL,
         tags_json TEXT,
-        feedbacks_json TEXT
+        feedbacks_json TEXT,
+        ord INTEGER
     );
     """)
     cur.execute("PRAGMA table_info(questions)")
     cols = [r[1] for r in cur.fetchall()]
     if "feedbacks_json" not in cols:
         cur.execute("ALTER TABLE questions ADD COLUMN feedbacks_json TEXT")
+    if "ord" not in cols:
+        # 既存行は登録順（rowid）をそのまま通し番号にする
+        cur.execute("ALTER TABLE questions ADD COLUMN ord INTEGER")
+        cur.execute("UPDATE questions SET ord = rowid WHERE ord IS NULL")
     conn.commit()
 
-def import_jsonl(src=SRC):
-    if not SRC.exists():
-        raise FileNotFoundError(SRC)
-    with sqlite3.connect(DB_PATH) as conn, SRC.open("r", encoding="utf-8") as f:
+# 既存の問題は ord を残して本文・difficulty などを JSONL の値に差し替える
+# （item_analysis が再推定した difficulty は、import の後に item_analysis.reapply() で書き戻す）
+_UPSERT_SQL = """
+INSERT INTO questions
+(id, skill, level, type, prompt, choices_json, answer_key,
+ explanations_json, difficulty, tags_json, feedbacks_json, ord)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    skill = excluded.skill, level = excluded.level, type = excluded.type, prompt = excluded.prompt,
+    choices_json = excluded.choices_json, answer_key = excluded.answer_key,
+    explanations_json = excluded.explanations_json, tags_json = excluded.tags_json,
+    feedbacks_json = excluded.feedbacks_json,
+    difficulty = excluded.difficulty,
+    ord = COALESCE(questions.ord, excluded.ord)
+"""
+
+@timed("import_jsonl")
+def import_jsonl(src=SRC, db_path=DB_PATH):
+    src = Path(src)
+    if not src.exists():
+        raise FileNotFoundError(src)
+    with sqlite3.connect(db_path) as conn, src.open("r", encoding="utf-8") as f:
         ensure_schema(conn)
         cur = conn.cursor()
+        # ord は一度振ったら変えない（再 import でも既存値、新規は末尾）。出題順の置換（walk）が使う
+        known = dict(cur.execute("SELECT id, ord FROM questions WHERE ord IS NOT NULL"))
+        next_ord = max(known.values(), default=0) + 1
+        written = 0
         for line in f:
             line = line.strip()
             if not line:
@@ -40,12 +72,11 @@ def import_jsonl(src=SRC):
             q = json.loads(line)
             if q.get("skill") in ("構成", "structure"):
                 continue
-            cur.execute("""
-            INSERT OR REPLACE INTO questions
-            (id, skill, level, type, prompt, choices_json, answer_key,
-             explanations_json, difficulty, tags_json, feedbacks_json)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
+            ord_ = known.get(q["id"])
+            if ord_ is None:
+                ord_ = known[q["id"]] = next_ord
+                next_ord += 1
+            cur.execute(_UPSERT_SQL, (
                 q["id"],
                 q.get("skill"),
                 q.get("level"),
@@ -57,9 +88,17 @@ def import_jsonl(src=SRC):
                 float(q.get("difficulty", 0.5)),
                 json.dumps(q.get("tags"), ensure_ascii=False),
                 json.dumps(q.get("feedbacks"), ensure_ascii=False),   # ★ 追加
+                ord_,
             ))
+            written += 1
         conn.commit()
+    IMPORT_ROWS.inc(written)
 
 if __name__ == "__main__":
     import_jsonl()
     print("imported into:", DB_PATH)
+    try:
+        from app.services.item_analysis import reapply
+        print("recalibrated:", reapply(DB_PATH))
+    except Exception as e:  # 直接実行（app が import できない）・users DB が無いとき
+        print(f"[WARN] item_analysis.reapply skipped: {e}")
@@ -0,0 +1,359 @@
+# app/services/item_analysis.py
+# 採点済み attempts（MCQ）からの項目分析と difficulty の再推定（オフラインのバッチジョブ）。
+#   python -m app.services.item_analysis            # 前回の続き（ウォーターマーク以降）だけ集計
+#   python -m app.services.item_analysis --full     # 集計を作り直す
+#   python -m app.services.item_analysis --dry-run  # cq.db へは書き戻さない
+#
+# - attempts は id 順に CHUNK_ROWS 件ずつ読み（キーセットページング）、NumPy の bincount で
+#   問題ごとの十分統計量（件数・正答数・選択肢別件数・能力θとの積和）に畳み込む。
+#   メモリは「チャンク1つ＋問題数」分しかいらない
+# - 十分統計量とウォーターマーク（処理済み attempts.id）は users DB の item_stats /
+#   job_watermarks に同じトランザクションで書く（途中で落ちてもチャンク単位で再開できる）
+# - 指標:
+#     p_value        正答率（補正 (c+0.5)/(n+1)）
+#     discrimination 点双列相関。基準は回答時点の能力推定 θ（attempts.ability。無い行は対象外）
+#     choice_rates   A〜D の選択率（誤答選択肢の働きを見る）
+#     difficulty     PROX 法で θ 分布を考慮したロジット困難度を、作問時の difficulty へ
+#                    件数に応じて縮約し 0..1 に戻した値
+# - difficulty は cq.db の questions.difficulty を UPDATE するだけ（JSONL の再 import は不要）。
+#   作問時の値は item_stats.difficulty_authored に最初に見た時点で控えておく
+import argparse
+import datetime as dt
+import math
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.services import attempts, auth
+from app.services.config import DB_PATH, ensure_runtime_paths
+
+JOB_NAME = "item_analysis"
+CHUNK_ROWS = int(os.getenv("CQ_ITEM_ANALYSIS_CHUNK", "200000"))
+PRIOR_N = float(os.getenv("CQ_ITEM_ANALYSIS_PRIOR_N", "30"))  # 作問時 difficulty の重み（擬似回答数）
+MIN_N = int(os.getenv("CQ_ITEM_ANALYSIS_MIN_N", "5"))         # これ未満の問題は書き戻さない
+CHOICES = ("A", "B", "C", "D")
+
+# 問題ごとに足し込む十分統計量
+_SUMS = ("n", "n_correct", "n_theta", "n_correct_theta", "sum_theta", "sum_theta_sq",
+         "sum_theta_correct", "n_a", "n_b", "n_c", "n_d")
+
+_tables = None
+
+
+def _get_tables():
+    global _tables
+    if _tables is None:
+        from sqlalchemy import MetaData, Table, Column, Integer, String, Float, DateTime
+
+        md = MetaData()
+        item_stats = Table(
+            "item_stats", md,
+            Column("question_id", String(64), primary_key=True),
+            Column("n", Integer, nullable=False, default=0),
+            Column("n_correct", Integer, nullable=False, default=0),
+            Column("n_theta", Integer, nullable=False, default=0),        # θ 付きの回答数
+            Column("n_correct_theta", Integer, nullable=False, default=0),
+            Column("sum_theta", Float, nullable=False, default=0.0),
+            Column("sum_theta_sq", Float, nullable=False, default=0.0),
+            Column("sum_theta_correct", Float, nullable=False, default=0.0),
+            Column("n_a", Integer, nullable=False, default=0),
+            Column("n_b", Integer, nullable=False, default=0),
+            Column("n_c", Integer, nullable=False, default=0),
+            Column("n_d", Integer, nullable=False, default=0),
+            Column("difficulty_authored", Float),
+            Column("p_value", Float),
+            Column("discrimination", Float),
+            Column("difficulty", Float),                                  # 再推定値（cq.db へ書き戻す値）
+            Column("updated_at", DateTime),
+        )
+        watermarks = Table(
+            "job_watermarks", md,
+            Column("job", String(64), primary_key=True),
+            Column("last_id", Integer, nullable=False, default=0),
+            Column("updated_at", DateTime),
+        )
+        _tables = {"metadata": md, "item_stats": item_stats, "job_watermarks": watermarks}
+    return _tables
+
+
+def init_db():
+    attempts.init_db()
+    _get_tables()["metadata"].create_all(auth.get_engine())
+
+
+# ---- チャンク集計（NumPy） ----
+
+def aggregate_chunk(qids: np.ndarray, correct: np.ndarray, chosen: np.ndarray,
+                    theta: np.ndarray) -> Dict[str, Dict[str, float]]:
+    """
+    1チャンク分の列 → {question_id: {十分統計量}}。
+      qids: 文字列配列 / correct: 0,1 / chosen: 0..3（A..D）、それ以外は -1 / theta: float（欠損は NaN）
+    """
+    keys, inv = np.unique(qids, return_inverse=True)
+    m = len(keys)
+    has_t = ~np.isnan(theta)
+    t = np.where(has_t, theta, 0.0)
+    x = correct.astype(np.float64)
+
+    sums = {
+        "n": np.bincount(inv, minlength=m),
+        "n_correct": np.bincount(inv, weights=x, minlength=m),
+        "n_theta": np.bincount(inv, weights=has_t.astype(np.float64), minlength=m),
+        "n_correct_theta": np.bincount(inv, weights=x * has_t, minlength=m),
+        "sum_theta": np.bincount(inv, weights=t, minlength=m),
+        "sum_theta_sq": np.bincount(inv, weights=t * t, minlength=m),
+        "sum_theta_correct": np.bincount(inv, weights=t * x, minlength=m),
+    }
+    ok = chosen >= 0
+    counts = np.bincount(inv[ok] * 4 + chosen[ok], minlength=m * 4).reshape(m, 4)
+    for j, f in enumerate(("n_a", "n_b", "n_c", "n_d")):
+        sums[f] = counts[:, j]
+
+    return {str(k): {f: (float(sums[f][i]) if f.startswith("sum_") else int(sums[f][i])) for f in _SUMS}
+            for i, k in enumerate(keys)}
+
+
+# ---- 指標 ----
+
+def _logit(p: float) -> float:
+    return math.log(p / (1.0 - p))
+
+
+def compute_metrics(s: dict, authored: Optional[float]) -> dict:
+    """十分統計量 → p_value / discrimination / difficulty（0..1）"""
+    n, c = s["n"], s["n_correct"]
+    if n <= 0:
+        return {"p_value": None, "discrimination": None, "difficulty": authored}
+    p = (c + 0.5) / (n + 1.0)
+
+    # θ の分布（θ 付きの回答だけ）
+    nt = s["n_theta"]
+    mu = s["sum_theta"] / nt if nt else 0.0
+    var = max(0.0, s["sum_theta_sq"] / nt - mu * mu) if nt else 0.0
+
+    disc = None
+    if nt >= 2 and var > 1e-12:
+        # 点双列相関 = cov(θ, x) / (σθ σx)。x の平均も θ 付きの回答に限って求める
+        px = s["n_correct_theta"] / nt
+        if 0.0 < px < 1.0:
+            cov = s["sum_theta_correct"] / nt - mu * px
+            disc = cov / math.sqrt(var * px * (1.0 - px))
+            disc = max(-1.0, min(1.0, disc))
+
+    # PROX: b = μθ + sqrt(1 + σθ²/2.89) * ln((1-p)/p)
+    b_obs = mu + math.sqrt(1.0 + var / 2.89) * _logit(1.0 - p)
+    d0 = 0.5 if authored is None else min(0.98, max(0.02, float(authored)))
+    w = n / (n + PRIOR_N)
+    b = w * b_obs + (1.0 - w) * _logit(d0)
+    return {"p_value": p, "discrimination": disc, "difficulty": 1.0 / (1.0 + math.exp(-b))}
+
+
+# ---- 永続化 ----
+
+def _upsert_sums(conn, item_stats, part: dict, authored: dict, now: dt.datetime):
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+    rows = [{"question_id": q, **{f: d[f] for f in _SUMS},
+             "difficulty_authored": authored.get(q), "updated_at": now} for q, d in part.items()]
+    if not rows:
+        return
+    dialect = conn.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        ins = (sqlite_insert if dialect == "sqlite" else pg_insert)(item_stats)
+        set_ = {f: item_stats.c[f] + ins.excluded[f] for f in _SUMS}
+        set_["updated_at"] = ins.excluded.updated_at
+        conn.execute(ins.on_conflict_do_update(index_elements=["question_id"], set_=set_), rows)
+        return
+    for row in rows:
+        upd = (item_stats.update().where(item_stats.c.question_id == row["question_id"])
+               .values({**{f: item_stats.c[f] + row[f] for f in _SUMS}, "updated_at": now}))
+        if conn.execute(upd).rowcount == 0:
+            conn.execute(item_stats.insert(), [row])
+
+
+def _set_watermark(conn, wm, last_id: int, now: dt.datetime):
+    if conn.execute(wm.update().where(wm.c.job == JOB_NAME)
+                    .values(last_id=last_id, updated_at=now)).rowcount == 0:
+        conn.execute(wm.insert(), [{"job": JOB_NAME, "last_id": last_id, "updated_at": now}])
+
+
+def get_watermark() -> int:
+    from sqlalchemy import select
+
+    init_db()
+    wm = _get_tables()["job_watermarks"]
+    with auth.get_engine().connect() as conn:
+        return int(conn.execute(select(wm.c.last_id).where(wm.c.job == JOB_NAME)).scalar() or 0)
+
+
+def _bank_difficulties(bank_path) -> Dict[str, float]:
+    try:
+        with sqlite3.connect(bank_path) as conn:
+            return {qid: d for qid, d in conn.execute("SELECT id, difficulty FROM questions")}
+    except sqlite3.Error as e:
+        print(f"[WARN] question bank not readable: {e}")
+        return {}
+
+
+def _write_back(bank_path, updates: List[tuple]) -> int:
+    """cq.db の questions.difficulty を更新（[(difficulty, id), ...]）"""
+    if not updates:
+        return 0
+    with sqlite3.connect(bank_path) as conn:
+        cur = conn.executemany("UPDATE questions SET difficulty=? WHERE id=?", updates)
+        conn.commit()
+        return cur.rowcount
+
+
+def reapply(bank_path=None) -> int:
+    """
+    item_stats の再推定 difficulty を cq.db にもう一度書き戻す（集計はしない）。
+    cq.db を JSONL から作り直した直後（Cloud の /tmp など）に呼ぶ。書いた件数を返す
+    """
+    from sqlalchemy import select
+
+    init_db()
+    s = _get_tables()["item_stats"]
+    with auth.get_engine().connect() as conn:
+        updates = [(round(d, 3), qid) for qid, d in conn.execute(
+            select(s.c.question_id, s.c.difficulty).where(s.c.n >= MIN_N, s.c.difficulty.is_not(None)))]
+    if bank_path is None:
+        ensure_runtime_paths()
+        bank_path = DB_PATH
+    return _write_back(bank_path, updates)
+
+
+# ---- ジョブ本体 ----
+
+def run(full: bool = False, chunk_rows: int = CHUNK_ROWS, write_back: bool = True,
+        bank_path=None, log=print) -> dict:
+    """
+    ウォーターマーク以降の attempts を集計して item_stats を更新し、
+    difficulty を再計算して cq.db（bank_path、既定は DB_PATH）に書き戻す。処理結果の要約を返す。
+    """
+    from sqlalchemy import select, bindparam
+
+    init_db()
+    attempts.flush()
+    t = _get_tables()
+    item_stats, wm = t["item_stats"], t["job_watermarks"]
+    at = attempts._get_tables()["attempts"]
+    engine = auth.get_engine()
+    if bank_path is None:
+        ensure_runtime_paths()
+        bank_path = DB_PATH
+    bank = _bank_difficulties(bank_path)
+
+    if full:
+        # 集計だけ 0 に戻す（difficulty_authored は残す。cq.db 側はもう再推定値のことがある）
+        with engine.begin() as conn:
+            conn.execute(item_stats.update().values(**dict.fromkeys(_SUMS, 0),
+                                                    p_value=None, discrimination=None, difficulty=None))
+            conn.execute(wm.delete().where(wm.c.job == JOB_NAME))
+
+    last_id = get_watermark()
+    start_id = last_id
+    rows_done = 0
+    touched = set()
+    t0 = time.perf_counter()
+    choice_code = {c: i for i, c in enumerate(CHOICES)}
+
+    while True:
+        stmt = (
+            select(at.c.id, at.c.question_id, at.c.correct, at.c.chosen, at.c.ability)
+            .where(at.c.id > last_id, at.c.type == "mcq", at.c.correct.is_not(None))
+            .order_by(at.c.id)
+            .limit(int(chunk_rows))
+        )
+        with engine.connect() as conn:
+            rows = conn.execute(stmt).fetchall()
+        if not rows:
+            break
+
+        ids, qids, correct, chosen, theta = zip(*rows)
+        part = aggregate_chunk(
+            np.asarray(qids, dtype=object).astype(str),
+            np.fromiter((1 if c else 0 for c in correct), dtype=np.int8, count=len(rows)),
+            np.fromiter((choice_code.get(c, -1) for c in chosen), dtype=np.int64, count=len(rows)),
+            np.fromiter((np.nan if a is None else a for a in theta), dtype=np.float64, count=len(rows)),
+        )
+        last_id = int(ids[-1])
+        now = dt.datetime.utcnow()
+        with engine.begin() as conn:
+            _upsert_sums(conn, item_stats, part, bank, now)
+            _set_watermark(conn, wm, last_id, now)
+        touched.update(part)
+        rows_done += len(rows)
+        log(f"  chunk: {len(rows)} rows (up to id {last_id}), {rows_done / (time.perf_counter() - t0):.0f} rows/s")
+
+    # 指標の再計算は集計済みの全問題ぶん（件数は問題数なので軽い）。
+    # cq.db が再生成されていても、ここで再推定値が戻る
+    updates, metrics = [], []
+    with engine.begin() as conn:
+        for r in conn.execute(select(item_stats)).fetchall():
+            s = r._mapping
+            met = compute_metrics(s, s["difficulty_authored"])
+            metrics.append({"qid": r.question_id, **met})
+            if s["n"] >= MIN_N and met["difficulty"] is not None and r.question_id in bank:
+                updates.append((round(met["difficulty"], 3), r.question_id))
+        if metrics:
+            conn.execute(
+                item_stats.update().where(item_stats.c.question_id == bindparam("qid"))
+                .values(p_value=bindparam("p_value"), discrimination=bindparam("discrimination"),
+                        difficulty=bindparam("difficulty")),
+                metrics,
+            )
+    written = _write_back(bank_path, updates) if write_back else 0
+
+    return {"from_id": start_id, "to_id": last_id, "rows": rows_done, "items_touched": len(touched),
+            "items_written": written, "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def report(limit: int = 20) -> List[dict]:
+    """件数の多い順に指標を返す（確認用）"""
+    from sqlalchemy import select
+
+    init_db()
+    s = _get_tables()["item_stats"]
+    with auth.get_engine().connect() as conn:
+        rows = conn.execute(select(s).order_by(s.c.n.desc()).limit(int(limit))).fetchall()
+    out = []
+    for r in rows:
+        m = r._mapping
+        n = m["n"] or 1
+        out.append({
+            "question_id": m["question_id"], "n": m["n"],
+            "p_value": m["p_value"], "discrimination": m["discrimination"],
+            "difficulty_authored": m["difficulty_authored"], "difficulty": m["difficulty"],
+            "choice_rates": {c: round(m[f"n_{c.lower()}"] / n, 3) for c in CHOICES},
+        })
+    return out
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="attempts からの項目分析と difficulty 再推定")
+    ap.add_argument("--full", action="store_true", help="集計を作り直す（ウォーターマークを0に戻す）")
+    ap.add_argument("--chunk", type=int, default=CHUNK_ROWS)
+    ap.add_argument("--dry-run", action="store_true", help="cq.db へ書き戻さない")
+    ap.add_argument("--report", type=int, default=10, help="件数上位の指標を表示する件数")
+    args = ap.parse_args(argv)
+
+    res = run(full=args.full, chunk_rows=args.chunk, write_back=not args.dry_run)
+    print(f"attempts id {res['from_id']} -> {res['to_id']}: {res['rows']} rows, "
+          f"{res['items_touched']} items touched, {res['items_written']} difficulties written "
+          f"({res['seconds']}s)")
+    for r in report(args.report):
+        disc = "—" if r["discrimination"] is None else f"{r['discrimination']:+.2f}"
+        print(f"  {r['question_id']:<16} n={r['n']:<7} p={r['p_value'] or 0:.2f} r_pb={disc} "
+              f"d {r['difficulty_authored']} -> {r['difficulty'] and round(r['difficulty'], 3)} "
+              f"{r['choice_rates']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
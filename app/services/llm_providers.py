@@ -0,0 +1,217 @@
+# app/services/llm_providers.py
+# LLM プロバイダの抽象（OpenAI 互換 / Anthropic）と、遅い応答への保険（ヘッジ）。
+#   CQ_LLM_PROVIDERS=openai,anthropic   使う順（config.LLM_PROVIDERS）。先頭が主、2番目がヘッジ／フェイルオーバー先。
+#                                       API キーの無いプロバイダは飛ばす
+#   CQ_LLM_HEDGE=1                      主が p90 を過ぎても返らなければ、同じリクエストを2番目にも送り
+#                                       先に返った方を使う（既定は無効）。主がエラーならすぐ2番目に送る
+#   CQ_LLM_HEDGE_QUANTILE=0.9           待つ目安にする分位（主の直近の成功応答から計算）
+#   CQ_LLM_HEDGE_MIN_SAMPLES=20         これより観測が少ない間は CQ_LLM_HEDGE_DEFAULT_MS を使う
+#   CQ_LLM_HEDGE_DEFAULT_MS=2000
+#   CQ_LLM_POOL_SIZE=16                 プロバイダごとの keep-alive 接続数（クライアントはプロセスで1つを使い回す）
+#   CQ_LLM_KEEPALIVE_S=30
+#   CQ_LLM_MAX_TOKENS=1024              Anthropic の max_tokens（必須項目）
+# build_client() は chat.completions.create(...) を持つ OpenAI 互換の入口を返す。
+# 応答も OpenAI 形（choices[0].message.content / usage.*_tokens）に揃えるので、ai_eval・llm_record はそのまま使える。
+# model 引数は無視して各プロバイダの設定（OPENAI_MODEL / ANTHROPIC_MODEL）を使う。
+# ヘッジで負けた方は止められない（同期 HTTP）ので裏で最後まで走らせ、所要時間だけ記録する。
+# llm_sched の枠は1件として数える（ヘッジ分は p90 を超えた1割程度の上乗せ）。
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from app.services.config import (ANTHROPIC_API_KEY, ANTHROPIC_BASE_URL, ANTHROPIC_MODEL, LLM_PROVIDERS,
+                                 OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL)
+from app.services.metrics import LLM_HEDGES, LLM_PROVIDER_DURATION
+
+HEDGE = os.getenv("CQ_LLM_HEDGE", "0") not in ("", "0", "false", "False")
+HEDGE_QUANTILE = float(os.getenv("CQ_LLM_HEDGE_QUANTILE", "0.9"))
+HEDGE_MIN_SAMPLES = int(os.getenv("CQ_LLM_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_MS = float(os.getenv("CQ_LLM_HEDGE_DEFAULT_MS", "2000"))
+POOL_SIZE = int(os.getenv("CQ_LLM_POOL_SIZE", "16"))
+KEEPALIVE_S = float(os.getenv("CQ_LLM_KEEPALIVE_S", "30"))
+MAX_TOKENS = int(os.getenv("CQ_LLM_MAX_TOKENS", "1024"))
+WINDOW = 200  # 分位の計算に使う直近の件数
+
+
+class LatencyWindow:
+    """直近 WINDOW 件の成功応答の所要時間（秒）"""
+
+    def __init__(self, size: int = WINDOW):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, sec: float):
+        with self._lock:
+            self._values.append(sec)
+
+    def quantile(self, q: float, min_samples: int = HEDGE_MIN_SAMPLES) -> Optional[float]:
+        with self._lock:
+            if len(self._values) < max(1, min_samples):
+                return None
+            xs = sorted(self._values)
+        return xs[min(len(xs) - 1, int(q * (len(xs) - 1)))]
+
+
+def _http_client(sdk):
+    """keep-alive 接続を使い回す HTTP クライアント（SDK の既定設定＋接続数の上限）"""
+    try:
+        try:
+            import httpx
+        except ImportError:  # SDK によっては httpx2
+            import httpx2 as httpx
+        limits = httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE,
+                              keepalive_expiry=KEEPALIVE_S)
+        return sdk.DefaultHttpxClient(limits=limits)
+    except Exception as e:
+        print(f"[WARN] pooled HTTP client unavailable, using SDK default: {e}")
+        return None
+
+
+def _completion(content: str, model: str, prompt_tokens: int, completion_tokens: int, rid: str):
+    """OpenAI の chat.completion と同じ形のオブジェクト"""
+    return SimpleNamespace(
+        id=rid, object="chat.completion", model=model,
+        choices=[SimpleNamespace(index=0, message=SimpleNamespace(role="assistant", content=content),
+                                 finish_reason="stop")],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                              total_tokens=prompt_tokens + completion_tokens))
+
+
+class Provider:
+    name = ""
+
+    def __init__(self, api_key: str, base_url: str = "", model: str = ""):
+        self.model = model
+        self.latency = LatencyWindow()
+        self.client = self._make_client(api_key, base_url or None)
+
+    def _make_client(self, api_key: str, base_url: Optional[str]):
+        raise NotImplementedError
+
+    def _create(self, messages: List[Dict], temperature: Optional[float]):
+        raise NotImplementedError
+
+    def create(self, messages: List[Dict], temperature: Optional[float] = None):
+        t = time.perf_counter()
+        resp = self._create(messages, temperature)
+        sec = time.perf_counter() - t
+        self.latency.observe(sec)
+        LLM_PROVIDER_DURATION.observe(sec, provider=self.name)
+        return resp
+
+    def hedge_delay(self) -> float:
+        """この秒数を過ぎても返らなければヘッジする"""
+        q = self.latency.quantile(HEDGE_QUANTILE)
+        return q if q is not None else HEDGE_DEFAULT_MS / 1e3
+
+
+class OpenAIProvider(Provider):
+    name = "openai"
+
+    def _make_client(self, api_key, base_url):
+        import openai
+        return openai.OpenAI(api_key=api_key, base_url=base_url, http_client=_http_client(openai))
+
+    def _create(self, messages, temperature):
+        kwargs = {} if temperature is None else {"temperature": temperature}
+        return self.client.chat.completions.create(model=self.model, messages=messages, **kwargs)
+
+
+class AnthropicProvider(Provider):
+    name = "anthropic"
+
+    def _make_client(self, api_key, base_url):
+        import anthropic
+        return anthropic.Anthropic(api_key=api_key, base_url=base_url, http_client=_http_client(anthropic))
+
+    def _create(self, messages, temperature):
+        # system は別引数。残りは user / assistant の並び
+        system = "\n\n".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+        rest = [{"role": m["role"], "content": m.get("content") or ""} for m in messages if m.get("role") != "system"]
+        kwargs = {"system": system} if system else {}
+        if temperature is not None:
+            # SDK の版によっては temperature 引数が無いので本文に直接入れる
+            kwargs["extra_body"] = {"temperature": temperature}
+        resp = self.client.messages.create(model=self.model, max_tokens=MAX_TOKENS, messages=rest, **kwargs)
+        text = "".join(getattr(b, "text", "") or "" for b in resp.content if getattr(b, "type", "text") == "text")
+        usage = getattr(resp, "usage", None)
+        return _completion(text, getattr(resp, "model", self.model), getattr(usage, "input_tokens", 0) or 0,
+                           getattr(usage, "output_tokens", 0) or 0, getattr(resp, "id", "") or uuid.uuid4().hex)
+
+
+PROVIDERS = {"openai": OpenAIProvider, "anthropic": AnthropicProvider}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=POOL_SIZE * 2, thread_name_prefix="cq-llm")
+    return _executor
+
+
+class Router:
+    """OpenAI クライアントと同じ呼び方（client.chat.completions.create）で、主 → （ヘッジ）→ 2番目 に振り分ける"""
+
+    def __init__(self, providers: List[Provider], hedge: bool = HEDGE):
+        if not providers:
+            raise ValueError("no providers")
+        self.providers = providers
+        self.hedge = hedge and len(providers) > 1
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, *, messages: List[Dict], temperature: Optional[float] = None, model=None, **_ignored):
+        primary = self.providers[0]
+        if not self.hedge:
+            return primary.create(messages, temperature)
+
+        first = _pool().submit(primary.create, messages, temperature)
+        try:
+            return first.result(timeout=primary.hedge_delay())
+        except FutureTimeout:
+            reason = "slow"
+        except Exception:
+            reason = "error"
+
+        secondary = self.providers[1]
+        second = _pool().submit(secondary.create, messages, temperature)
+        pending = {second} if reason == "error" else {first, second}
+        names = {first: primary.name, second: secondary.name}
+        error: Optional[BaseException] = first.exception() if reason == "error" else None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    LLM_HEDGES.inc(reason=reason, winner=names[f])
+                    return f.result()
+                error = f.exception()
+        LLM_HEDGES.inc(reason=reason, winner="none")
+        raise error
+
+
+def build_client() -> Optional[Router]:
+    """CQ_LLM_PROVIDERS の順にキーのあるプロバイダを並べる（1つも無ければ None）"""
+    settings = {"openai": (OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL),
+                "anthropic": (ANTHROPIC_API_KEY, ANTHROPIC_BASE_URL, ANTHROPIC_MODEL)}
+    providers = []
+    for name in [p.strip().lower() for p in (LLM_PROVIDERS or "").split(",") if p.strip()]:
+        if name not in PROVIDERS:
+            print(f"[WARN] unknown LLM provider: {name}")
+            continue
+        api_key, base_url, model = settings[name]
+        if not api_key:
+            continue
+        try:
+            providers.append(PROVIDERS[name](api_key, base_url, model))
+        except Exception as e:
+            print(f"[WARN] LLM provider {name} unavailable: {e}")
+    return Router(providers) if providers else None
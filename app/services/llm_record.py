@@ -0,0 +1,246 @@
+# app/services/llm_record.py
+# LLM 呼び出しのフライトレコーダーと、記録からの決定的なリプレイ（オプトイン）。
+#   CQ_LLM_RECORD=/path/llm.db        実クライアントを包み、chat.completions.create の
+#                                     リクエスト（model / messages / パラメータ）・生レスポンス・所要時間・
+#                                     トークン数・エラーを SQLite に記録する
+#   CQ_LLM_REPLAY=/path/llm.db        OpenAI に繋がず、記録からレスポンスを返す（openai パッケージも不要）
+#   CQ_LLM_REPLAY_LATENCY=1.0         記録時の所要時間 × この倍率だけ待ってから返す（既定 0 = 待たない）
+#   CQ_LLM_REPLAY_MATCH=exact|loose   exact: model・messages・パラメータが一致する記録だけ
+#                                     loose: 最後の user メッセージだけで引く（system プロンプトを変えたときの比較用）
+#   python -m app.services.llm_record /path/llm.db       記録の件数・所要時間・トークン数の要約
+#
+# - 同じリクエストの記録が複数あれば記録順に順番に返す（一巡したら先頭から）
+# - 記録時にエラーだった呼び出しはリプレイでも ReplayedError を投げる（フォールバック経路も再現される）
+# - 見つからないときは ReplayMiss（ai_eval 側はルールベースにフォールバックする）
+# - 本文は JSON を zlib で圧縮して保存する
+import argparse
+import datetime as dt
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+RECORD_PATH = os.getenv("CQ_LLM_RECORD", "")
+REPLAY_PATH = os.getenv("CQ_LLM_REPLAY", "")
+REPLAY_LATENCY = float(os.getenv("CQ_LLM_REPLAY_LATENCY", "0") or 0)
+REPLAY_MATCH = os.getenv("CQ_LLM_REPLAY_MATCH", "exact")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    loose_key TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    model TEXT,
+    request_z BLOB NOT NULL,
+    response_z BLOB,
+    error TEXT,
+    latency_ms REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_llm_calls_key ON llm_calls (key, id);
+CREATE INDEX IF NOT EXISTS ix_llm_calls_loose ON llm_calls (loose_key, id);
+"""
+
+
+class ReplayMiss(Exception):
+    pass
+
+
+class ReplayedError(Exception):
+    pass
+
+
+def _pack(obj) -> bytes:
+    return zlib.compress(json.dumps(obj, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+
+
+def _unpack(blob: Optional[bytes]):
+    return None if blob is None else json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def request_key(request: Dict) -> str:
+    """model・messages・パラメータ（キーの順序は問わない）から決まるキー"""
+    canon = json.dumps(request, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+
+def loose_key(request: Dict) -> str:
+    users = [m.get("content") or "" for m in request.get("messages") or [] if m.get("role") == "user"]
+    return hashlib.sha256((users[-1] if users else "").encode("utf-8")).hexdigest()
+
+
+def _open(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _to_dict(resp) -> Dict:
+    # openai v1 のレスポンスは pydantic モデル
+    if hasattr(resp, "model_dump"):
+        return resp.model_dump(mode="json")
+    if isinstance(resp, dict):
+        return resp
+    return json.loads(json.dumps(resp, default=lambda o: getattr(o, "__dict__", str(o))))
+
+
+def _ns(obj):
+    """dict → 属性でたどれるオブジェクト（resp.choices[0].message.content / resp.usage.prompt_tokens）"""
+    if isinstance(obj, dict):
+        return SimpleNamespace(**{k: _ns(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return [_ns(v) for v in obj]
+    return obj
+
+
+# ---- 記録 ----
+
+class _Store:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def add(self, request: Dict, response: Optional[Dict], error: Optional[str], latency_ms: float):
+        usage = (response or {}).get("usage") or {}
+        row = (request_key(request), loose_key(request), dt.datetime.utcnow().isoformat(timespec="milliseconds"),
+               request.get("model"), _pack(request), None if response is None else _pack(response), error,
+               round(latency_ms, 3), usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        try:
+            with self._lock:
+                if self._conn is None:
+                    self._conn = _open(self.path)
+                self._conn.execute(
+                    "INSERT INTO llm_calls (key, loose_key, created_at, model, request_z, response_z, error, "
+                    "latency_ms, prompt_tokens, completion_tokens) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                self._conn.commit()
+        except Exception as e:
+            # 記録の失敗で評価を止めない
+            print(f"[WARN] llm record failed: {e}")
+
+
+class _RecordingCompletions:
+    def __init__(self, inner, store: _Store):
+        self._inner = inner
+        self._store = store
+
+    def create(self, **kwargs):
+        t = time.perf_counter()
+        try:
+            resp = self._inner.create(**kwargs)
+        except Exception as e:
+            self._store.add(kwargs, None, f"{type(e).__name__}: {e}", (time.perf_counter() - t) * 1e3)
+            raise
+        self._store.add(kwargs, _to_dict(resp), None, (time.perf_counter() - t) * 1e3)
+        return resp
+
+
+class RecordingClient:
+    """OpenAI クライアントの chat.completions.create だけを差し替えて記録する（他の属性は素通し）"""
+
+    def __init__(self, client, path: str):
+        self._client = client
+        self.chat = SimpleNamespace(completions=_RecordingCompletions(client.chat.completions, _Store(path)))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+# ---- リプレイ ----
+
+class _ReplayCompletions:
+    def __init__(self, path: str, latency_scale: float, match: str):
+        self.path = path
+        self.latency_scale = latency_scale
+        self.match = match
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._served: Dict[str, int] = {}
+
+    def _rows(self, conn, request: Dict) -> List[tuple]:
+        sql = "SELECT response_z, error, latency_ms FROM llm_calls WHERE {} = ? ORDER BY id"
+        rows = conn.execute(sql.format("key"), (request_key(request),)).fetchall()
+        if not rows and self.match == "loose":
+            rows = conn.execute(sql.format("loose_key"), (loose_key(request),)).fetchall()
+        return rows
+
+    def create(self, **kwargs):
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            rows = self._rows(self._conn, kwargs)
+            if not rows:
+                raise ReplayMiss(f"no recording for request {request_key(kwargs)[:12]}")
+            k = request_key(kwargs)
+            n = self._served.get(k, 0)
+            self._served[k] = n + 1
+        response_z, error, latency_ms = rows[n % len(rows)]
+        if self.latency_scale > 0 and latency_ms:
+            time.sleep(latency_ms * self.latency_scale / 1e3)
+        if error:
+            raise ReplayedError(error)
+        return _ns(_unpack(response_z))
+
+
+class ReplayClient:
+    def __init__(self, path: str, latency_scale: float = REPLAY_LATENCY, match: str = REPLAY_MATCH):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.chat = SimpleNamespace(completions=_ReplayCompletions(path, latency_scale, match))
+
+
+def replay_client() -> Optional[ReplayClient]:
+    """CQ_LLM_REPLAY が指定されていればリプレイ用クライアント"""
+    return ReplayClient(REPLAY_PATH) if REPLAY_PATH else None
+
+
+def wrap(client):
+    """CQ_LLM_RECORD が指定されていれば記録付きのクライアントにする"""
+    if client is None or not RECORD_PATH:
+        return client
+    return RecordingClient(client, RECORD_PATH)
+
+
+# ---- 要約（CLI） ----
+
+def summarize(path: str) -> Dict:
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+        rows = conn.execute(
+            "SELECT model, error IS NOT NULL, latency_ms, COALESCE(prompt_tokens, 0), "
+            "COALESCE(completion_tokens, 0), key FROM llm_calls").fetchall()
+    by_model: Dict[str, Dict] = {}
+    for model, err, lat, pt, ct, _ in rows:
+        d = by_model.setdefault(model or "?", {"calls": 0, "errors": 0, "prompt_tokens": 0,
+                                               "completion_tokens": 0, "_lat": []})
+        d["calls"] += 1
+        d["errors"] += int(err)
+        d["prompt_tokens"] += pt
+        d["completion_tokens"] += ct
+        if lat is not None:
+            d["_lat"].append(lat)
+    for d in by_model.values():
+        lat = sorted(d.pop("_lat"))
+        d["p50_ms"] = round(lat[len(lat) // 2], 1) if lat else None
+        d["p95_ms"] = round(lat[min(len(lat) - 1, int(0.95 * (len(lat) - 1)))], 1) if lat else None
+    return {"calls": len(rows), "distinct_requests": len({r[5] for r in rows}), "models": by_model}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="LLM 呼び出し記録の要約")
+    ap.add_argument("path")
+    args = ap.parse_args(argv)
+    print(json.dumps(summarize(args.path), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
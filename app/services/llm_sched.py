@@ -0,0 +1,224 @@
+# app/services/llm_sched.py
+# LLM 呼び出しのプロセス全体のスケジューラ（全セッション共通）。
+#   - 同時実行数の上限（CQ_LLM_CONCURRENCY）と、トークン毎分の予算（CQ_LLM_TPM、0 なら無制限）
+#   - 空きが無いときはユーザーごとの待ち行列に入り、空いたら優先度順 → 同じ優先度はユーザーの順番
+#     （ラウンドロビン）で割り当てる。1人が連打しても他のユーザーの順番は後ろにならない
+#   - 優先度は採点（自由記述の評価：INTERACTIVE）＞ 講評の生成（SUMMARY）＞ 入力中の先回り評価（SPECULATIVE）
+#   - 待てる時間（優先度ごと）・ユーザーごとの待ち件数・全体の待ち件数を超えたら（トークン予算が
+#     待てる時間内に貯まらない見込みなら並ばずに）Shed を投げる。
+#     ai_eval はルールベースの評価に切り替え、結果に「簡易評価」の印を付ける（いつまでも待たせない）
+# トークン予算は「プロンプト文字数 / 2 + 出力の見込み」で先に確保し、応答の usage で差分を精算する。
+#   CQ_LLM_SCHED=0 で無効（そのまま呼ぶ）
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from app.services.metrics import LLM_QUEUE_WAIT, LLM_SHED
+
+INTERACTIVE, SUMMARY, SPECULATIVE = 0, 1, 2
+_PRIORITY_NAMES = {INTERACTIVE: "interactive", SUMMARY: "summary", SPECULATIVE: "speculative"}
+
+ENABLED = os.getenv("CQ_LLM_SCHED", "1") not in ("0", "false", "False")
+CONCURRENCY = int(os.getenv("CQ_LLM_CONCURRENCY", "8"))
+TPM = int(os.getenv("CQ_LLM_TPM", "0"))
+MAX_WAIT_S = {
+    INTERACTIVE: float(os.getenv("CQ_LLM_MAX_WAIT_S", "10")),
+    SUMMARY: float(os.getenv("CQ_LLM_SUMMARY_MAX_WAIT_S", "5")),
+    SPECULATIVE: float(os.getenv("CQ_LLM_SPECULATIVE_MAX_WAIT_S", "2")),
+}
+MAX_QUEUED_PER_USER = int(os.getenv("CQ_LLM_MAX_QUEUED_PER_USER", "2"))
+MAX_QUEUED = int(os.getenv("CQ_LLM_MAX_QUEUED", "64"))
+EST_COMPLETION_TOKENS = int(os.getenv("CQ_LLM_EST_COMPLETION_TOKENS", "400"))
+
+
+class Shed(Exception):
+    """混雑のため LLM を呼ばずにフォールバックする（reason: user_queue / queue_full / budget / timeout）"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Ticket:
+    """割り当て済みの1回分。呼び出し側が応答のトークン数を used_tokens に入れると精算される"""
+
+    __slots__ = ("user", "priority", "tokens", "used_tokens", "granted", "enqueued_at")
+
+    def __init__(self, user, priority: int, tokens: int):
+        self.user = user
+        self.priority = priority
+        self.tokens = tokens
+        self.used_tokens: Optional[int] = None
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+def estimate_tokens(messages, completion: int = EST_COMPLETION_TOKENS) -> int:
+    return sum(len(m.get("content") or "") for m in messages) // 2 + completion
+
+
+class Scheduler:
+    def __init__(self, concurrency: int = CONCURRENCY, tpm: int = TPM, max_wait_s: Optional[Dict] = None,
+                 max_queued_per_user: int = MAX_QUEUED_PER_USER, max_queued: int = MAX_QUEUED):
+        self.concurrency = max(1, concurrency)
+        self.tpm = tpm
+        self.max_wait_s = {**MAX_WAIT_S, **(max_wait_s or {})}
+        self.max_queued_per_user = max_queued_per_user
+        self.max_queued = max_queued
+        self._cond = threading.Condition()
+        self._running = 0
+        self._queued = 0
+        # 優先度 → {ユーザー: そのユーザーの待ち（到着順）}。先頭のユーザーから順に割り当てて末尾に回す
+        self._queues: Dict[int, "OrderedDict[object, deque]"] = {p: OrderedDict() for p in _PRIORITY_NAMES}
+        self._bucket = float(tpm)
+        self._refilled_at = time.monotonic()
+
+    # ---- 内部（_cond を持って呼ぶ） ----
+
+    def _refill(self):
+        if not self.tpm:
+            return
+        now = time.monotonic()
+        self._bucket = min(float(self.tpm), self._bucket + (now - self._refilled_at) * self.tpm / 60.0)
+        self._refilled_at = now
+
+    def _fits(self, tokens: int) -> bool:
+        # 予算より大きい1件は、満タンなら通す（永久に待たせない）
+        return not self.tpm or self._bucket >= min(tokens, self.tpm)
+
+    def _grant(self, t: Ticket):
+        t.granted = True
+        self._running += 1
+        if self.tpm:
+            self._bucket -= t.tokens
+
+    def _dispatch(self):
+        self._refill()
+        while self._running < self.concurrency:
+            nxt = None
+            for p in sorted(self._queues):
+                users = self._queues[p]
+                if users:
+                    user, dq = next(iter(users.items()))
+                    nxt = dq[0]
+                    break
+            if nxt is None or not self._fits(nxt.tokens):
+                return  # 先頭が予算待ちなら、後ろ（低優先度）も追い越さない
+            dq.popleft()
+            if dq:
+                users.move_to_end(user)
+            else:
+                del users[user]
+            self._queued -= 1
+            self._grant(nxt)
+
+    def _remove(self, t: Ticket):
+        users = self._queues[t.priority]
+        dq = users.get(t.user)
+        if dq is not None and t in dq:
+            dq.remove(t)
+            self._queued -= 1
+            if not dq:
+                del users[t.user]
+
+    def _next_refill_wait(self) -> float:
+        # 予算待ちのときは、先頭の1件が入る頃に起きて見直す
+        if not self.tpm:
+            return 1.0
+        for p in sorted(self._queues):
+            if self._queues[p]:
+                need = next(iter(self._queues[p].values()))[0].tokens - self._bucket
+                return max(0.01, min(1.0, need * 60.0 / self.tpm))
+        return 1.0
+
+    # ---- 公開 ----
+
+    def acquire(self, user, priority: int, tokens: int) -> Ticket:
+        t = Ticket(user, priority, tokens)
+        with self._cond:
+            self._refill()
+            if self._queued == 0 and self._running < self.concurrency and self._fits(tokens):
+                self._grant(t)
+                return t
+            users = self._queues[priority]
+            if len(users.get(user, ())) >= self.max_queued_per_user:
+                raise Shed("user_queue")
+            if self._queued >= self.max_queued:
+                raise Shed("queue_full")
+            max_wait = self.max_wait_s.get(priority, 10.0)
+            if self.tpm:
+                # 前に並んでいる分（同じか高い優先度）と合わせて、待てる時間内に予算が貯まらないなら今すぐ諦める
+                ahead = sum(x.tokens for p in self._queues if p <= priority
+                            for dq in self._queues[p].values() for x in dq)
+                if (ahead + min(tokens, self.tpm) - self._bucket) * 60.0 / self.tpm > max_wait:
+                    raise Shed("budget")
+            users.setdefault(user, deque()).append(t)
+            self._queued += 1
+            deadline = t.enqueued_at + max_wait
+            self._dispatch()
+            while not t.granted:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    self._remove(t)
+                    self._cond.notify_all()
+                    raise Shed("timeout")
+                self._cond.wait(min(left, self._next_refill_wait()))
+                if not t.granted:
+                    self._dispatch()
+            self._cond.notify_all()
+        return t
+
+    def release(self, t: Ticket):
+        with self._cond:
+            self._running -= 1
+            if self.tpm and t.used_tokens is not None:
+                self._bucket -= t.used_tokens - t.tokens  # 見込みとの差を精算（マイナスなら返す）
+            self._dispatch()
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, user, priority: int, tokens: int, fn: str = ""):
+        """with の間だけ1枠を使う。混雑時は Shed"""
+        t0 = time.monotonic()
+        try:
+            t = self.acquire(user, priority, tokens)
+        except Shed as e:
+            LLM_SHED.inc(fn=fn, reason=e.reason)
+            raise
+        LLM_QUEUE_WAIT.observe(time.monotonic() - t0, priority=_PRIORITY_NAMES.get(priority, str(priority)))
+        try:
+            yield t
+        finally:
+            self.release(t)
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            self._refill()
+            return {"running": self._running, "queued": self._queued,
+                    "tokens_available": round(self._bucket, 1) if self.tpm else None}
+
+
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = Scheduler()
+    return _scheduler
+
+
+@contextmanager
+def slot(user, priority: int, messages, fn: str = ""):
+    """ai_eval から使う入口。無効なら何もしない"""
+    if not ENABLED:
+        yield Ticket(user, priority, 0)
+        return
+    with get_scheduler().slot(user, priority, estimate_tokens(messages), fn=fn) as t:
+        yield t
@@ -0,0 +1,281 @@
+# app/services/metrics.py
+# サービス層のメトリクス（カウンタ／ヒストグラム）と Prometheus テキスト形式での出力。
+#   CQ_METRICS=1               計測を有効にする（既定は無効。無効時は @timed が元の関数をそのまま返し、
+#                              inc/observe は先頭の if で戻るだけ）
+#   CQ_METRICS_PORT=9108       http://<host>:9108/metrics で公開（指定すると計測も有効になる）
+#   CQ_METRICS_FILE=/path.prom 定期的にファイルへ書き出す（node_exporter の textfile collector 向け）
+#   CQ_METRICS_INTERVAL=15     ファイル書き出しの間隔（秒）
+# 出力先の起動は start_exporters()（アプリ起動時に呼ぶ。2回目以降は何もしない）。
+# profiler.py は rerun 内の区間表示用、こちらはプロセス全体の累積値（スクレイプして外で集計する）。
+import atexit
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Tuple
+
+METRICS_PORT = int(os.getenv("CQ_METRICS_PORT", "0") or 0)
+METRICS_FILE = os.getenv("CQ_METRICS_FILE", "")
+METRICS_INTERVAL = float(os.getenv("CQ_METRICS_INTERVAL", "15"))
+ENABLED = os.getenv("CQ_METRICS", "0") not in ("", "0", "false", "False") or bool(METRICS_PORT or METRICS_FILE)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_registry: List["_Metric"] = []
+
+
+def _labels_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in tuple(key) + extra]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        _registry.append(self)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if not ENABLED:
+            return
+        key = _labels_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with _lock:
+            return self._values.get(_labels_key(labels), 0)
+
+    def _render(self) -> List[str]:
+        with _lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_fmt_labels(k)} {_fmt_num(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[tuple, list] = {}  # key → [バケットごとの件数（非累積、末尾は +Inf）, sum, count]
+
+    def observe(self, value: float, **labels):
+        if not ENABLED:
+            return
+        key = _labels_key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            v[0][i] += 1
+            v[1] += value
+            v[2] += 1
+
+    def time(self, **labels):
+        """with で囲んだ区間の秒数を observe する（無効時は何もしない）"""
+        if not ENABLED:
+            return nullcontext()
+        return self._timer(labels)
+
+    @contextmanager
+    def _timer(self, labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, **labels)
+
+    def count(self, **labels) -> int:
+        with _lock:
+            v = self._values.get(_labels_key(labels))
+            return v[2] if v else 0
+
+    def _render(self) -> List[str]:
+        with _lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        out = []
+        for key, (counts, total, n) in items:
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                out.append(f"{self.name}_bucket{_fmt_labels(key, (('le', _fmt_num(le)),))} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_num(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(key)} {n}")
+        return out
+
+
+# ---- メトリクス定義 ----
+
+CALL_DURATION = Histogram("cq_call_duration_seconds", "Duration of instrumented service calls.")
+AUTH_ATTEMPTS = Counter("cq_auth_attempts_total", "authenticate() calls by result (ok / fail).")
+IMPORT_ROWS = Counter("cq_import_rows_total", "Questions written by import_jsonl.")
+CACHE_REQUESTS = Counter("cq_cache_requests_total", "In-process cache lookups by cache and result (hit / miss).")
+EVAL_RESULTS = Counter(
+    "cq_eval_results_total",
+    "AI evaluation results by function and path (llm / shed / provisional / fallback_no_client / "
+    "fallback_error / fallback_parse / skipped).")
+LLM_DURATION = Histogram("cq_llm_request_duration_seconds", "Duration of LLM API requests.", LLM_BUCKETS)
+LLM_PARSE_FAILURES = Counter(
+    "cq_llm_parse_failures_total",
+    "LLM responses that did not yield the expected JSON (no_json / invalid_json / schema).")
+LLM_TOKENS = Counter("cq_llm_tokens_total", "LLM token usage reported by the API (kind = prompt / completion).")
+LLM_QUEUE_WAIT = Histogram("cq_llm_queue_wait_seconds", "Time spent waiting for an LLM slot, by priority.",
+                           LATENCY_BUCKETS)
+LLM_SHED = Counter("cq_llm_shed_total",
+                   "LLM calls shed to the rule-based fallback (user_queue / queue_full / budget / timeout).")
+LLM_PROVIDER_DURATION = Histogram("cq_llm_provider_duration_seconds",
+                                  "Duration of successful requests per provider (hedge losers included).",
+                                  LLM_BUCKETS)
+LLM_HEDGES = Counter("cq_llm_hedges_total",
+                     "Requests also sent to the secondary provider, by reason (slow / error) and winner.")
+API_DURATION = Histogram("cq_api_request_duration_seconds", "Headless API requests by route and status.")
+SPEC_EVALS = Counter(
+    "cq_spec_evals_total",
+    "Speculative free-text evaluations by event (started / superseded / capped / used_ready / used_running / miss).")
+
+
+def timed(fn_name: str):
+    """関数全体の所要時間を cq_call_duration_seconds{fn=...} に記録するデコレータ（無効時は何もしない）"""
+    def deco(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                CALL_DURATION.observe(time.perf_counter() - t, fn=fn_name)
+        return wrapper
+    return deco
+
+
+def cache_lookup(cache: str, hit: bool):
+    if ENABLED:
+        CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def count_usage(fn_name: str, resp):
+    """OpenAI 互換レスポンスの usage をトークン数として数える（無ければ何もしない）"""
+    if not ENABLED:
+        return
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return
+    for kind in ("prompt", "completion"):
+        n = getattr(usage, f"{kind}_tokens", None)
+        if n:
+            LLM_TOKENS.inc(int(n), fn=fn_name, kind=kind)
+
+
+# ---- 出力 ----
+
+def render() -> str:
+    """全メトリクスを Prometheus テキスト形式（0.0.4）で返す"""
+    lines = []
+    for m in list(_registry):
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines.extend(m._render())
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path: str = METRICS_FILE):
+    """一時ファイルに書いてから置き換える（読み手が書きかけを見ない）"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+def reset():
+    with _lock:
+        for m in _registry:
+            m._values.clear()
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def _serve(port: int):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            data = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="cq-metrics-http", daemon=True).start()
+
+
+def _file_loop(path: str, interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            write_file(path)
+        except Exception as e:
+            print(f"[WARN] metrics file write failed: {e}")
+
+
+def start_exporters():
+    """CQ_METRICS_PORT / CQ_METRICS_FILE に応じて出力を始める（プロセスで1回だけ）"""
+    global _exporters_started
+    if _exporters_started or not ENABLED:
+        return
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+        if METRICS_PORT:
+            try:
+                _serve(METRICS_PORT)
+            except OSError as e:
+                print(f"[WARN] metrics endpoint on port {METRICS_PORT} unavailable: {e}")
+        if METRICS_FILE:
+            threading.Thread(target=_file_loop, args=(METRICS_FILE, METRICS_INTERVAL),
+                             name="cq-metrics-file", daemon=True).start()
+            atexit.register(lambda: write_file(METRICS_FILE))
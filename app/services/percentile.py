@@ -0,0 +1,349 @@
+# app/services/percentile.py
+# ユーザー全体（コホート別）の中での位置「要約で上位 23%」を出すためのスコア分布スケッチ。
+#   - (コホート, スキル) ごとに、ユーザーのスキル別スコア（0..1、講評と同じ score_sum/score_n）の
+#     固定幅ヒストグラム（BUCKETS 分割）を持つ。スキル "全体" は全スキル合算のスコア
+#   - ユーザーのスコアは回答のたびに動くので「旧スコアを -1、新スコアを +1」で更新する。
+#     t-digest / KLL は削除ができないため、削除もマージ（バケットごとの加算）もできるヒストグラムにした。
+#     誤差はスコア幅 1/BUCKETS
+#   - 差分は attempts の書き込みスレッドと同じトランザクションで score_sketch に加算する
+#     （複数プロセスの分もそのまま足し合わさる）
+#   - 読み出しはプロセス内キャッシュ（REFRESH_SEC ごとに DB から読み直す）上の Fenwick 木で O(log BUCKETS)。
+#     ユーザー数には依存しない
+#   - コホートは "all" と、ユーザーのテナントがあれば "tenant:<値>"。テナントはそのユーザーの回答を
+#     最初に記録したプロセスの CQ_TENANT で、user_cohort に残して以後はそれを使う（作り直しも同じ）。
+#     user_cohort を入れる前からいたユーザーはテナントなし（"all" だけ）
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.services import attempts, auth, metrics
+
+BUCKETS = 1000
+OVERALL = "全体"
+TENANT = (os.getenv("CQ_TENANT") or "").strip()
+REFRESH_SEC = float(os.getenv("CQ_PERCENTILE_REFRESH_SEC", "10"))
+MIN_USERS = int(os.getenv("CQ_PERCENTILE_MIN_USERS", "5"))  # これ未満の母集団では順位を出さない
+
+_tables = None
+_tables_lock = threading.Lock()
+_initialized = False
+
+
+def cohorts(tenant: str = TENANT) -> List[str]:
+    return ["all"] + ([f"tenant:{tenant}"] if tenant else [])
+
+
+def bucket_of(score: float) -> int:
+    return min(BUCKETS - 1, max(0, int(float(score) * BUCKETS)))
+
+
+class ScoreHistogram:
+    """0..1 スコアの固定幅ヒストグラム（Fenwick 木で累積件数を O(log B)）"""
+
+    def __init__(self, counts: Optional[Dict[int, int]] = None):
+        self.tree = [0] * (BUCKETS + 1)
+        self.n = 0
+        for b, c in (counts or {}).items():
+            self.add(b, c)
+
+    def add(self, bucket: int, count: int = 1):
+        self.n += count
+        i = bucket + 1
+        while i <= BUCKETS:
+            self.tree[i] += count
+            i += i & -i
+
+    def count_below(self, bucket: int) -> int:
+        """bucket より小さいバケットの件数"""
+        s, i = 0, bucket
+        while i > 0:
+            s += self.tree[i]
+            i -= i & -i
+        return s
+
+    def top_percent(self, score: float) -> Optional[int]:
+        """score 以上のユーザーが全体の何 %（自分を含む。最良なら小さい値）"""
+        if self.n <= 0:
+            return None
+        ge = self.n - self.count_below(bucket_of(score))
+        return max(1, min(100, round(100.0 * ge / self.n)))
+
+
+def _get_tables():
+    global _tables
+    if _tables is None:
+        with _tables_lock:
+            if _tables is None:
+                from sqlalchemy import MetaData, Table, Column, Integer, String, PrimaryKeyConstraint
+
+                md = MetaData()
+                sketch = Table(
+                    "score_sketch", md,
+                    Column("cohort", String(64), nullable=False),
+                    Column("skill", String(64), nullable=False),
+                    Column("bucket", Integer, nullable=False),
+                    Column("count", Integer, nullable=False, default=0),
+                    PrimaryKeyConstraint("cohort", "skill", "bucket", name="pk_score_sketch"),
+                )
+                user_cohort = Table(
+                    "user_cohort", md,
+                    Column("user_id", Integer, primary_key=True, autoincrement=False),
+                    Column("tenant", String(64), nullable=False, default=""),  # "" ならテナントなし
+                )
+                _tables = {"metadata": md, "score_sketch": sketch, "user_cohort": user_cohort}
+    return _tables
+
+
+def _ensure(conn):
+    """テーブルを作る。空なら既存の user_skill_stats から組み立てる"""
+    from sqlalchemy import select, func
+
+    _get_tables()["metadata"].create_all(conn)
+    sketch = _get_tables()["score_sketch"]
+    legacy = not conn.execute(select(func.count()).select_from(_get_tables()["user_cohort"])).scalar()
+    if legacy or not conn.execute(select(func.count()).select_from(sketch)).scalar():
+        if legacy:
+            # user_cohort を入れる前のユーザーはテナントが分からないので "all" だけに入れ直す
+            stats = attempts._get_tables()["user_skill_stats"]
+            _tenants(conn, [u for (u,) in conn.execute(select(stats.c.user_id).distinct())], assign="")
+        _rebuild(conn)
+
+
+@attempts.register_setup_hook
+def _setup(engine):
+    """attempts.init_db から（書き込みスレッドが書き始める前に）呼ばれる"""
+    global _initialized
+    with engine.begin() as conn:
+        _ensure(conn)
+    _initialized = True
+
+
+def init_db():
+    if not _initialized:
+        attempts.init_db()
+
+
+# ---- 差分 ----
+
+def _tenants(conn, user_ids, assign: Optional[str] = None) -> Dict[int, str]:
+    """
+    {user_id: テナント}（user_ids=None なら全員）。assign を渡すと、まだ無いユーザーをそのテナントで登録する。
+    登録が無いユーザーは ""（"all" だけ）
+    """
+    from sqlalchemy import select
+
+    uc = _get_tables()["user_cohort"]
+    ids = None if user_ids is None else {int(u) for u in user_ids}
+    if ids is not None and not ids:
+        return {}
+    stmt = select(uc.c.user_id, uc.c.tenant)
+    if ids is not None:
+        stmt = stmt.where(uc.c.user_id.in_(list(ids)))
+    out = {int(u): t or "" for u, t in conn.execute(stmt)}
+    missing = [u for u in (ids or ()) if u not in out]
+    if assign is not None and missing:
+        rows = [{"user_id": u, "tenant": assign} for u in missing]
+        dialect = conn.dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            conn.execute(insert(uc).on_conflict_do_nothing(index_elements=["user_id"]), rows)
+            out.update({int(u): t or "" for u, t in conn.execute(
+                select(uc.c.user_id, uc.c.tenant).where(uc.c.user_id.in_(missing)))})
+        else:
+            conn.execute(uc.insert(), rows)
+            out.update({u: assign for u in missing})
+    return out
+
+
+def _user_scores(rows) -> Dict[int, Dict[str, Tuple[float, int]]]:
+    """stats 行 → {user_id: {skill: (score_sum, score_n)}}（"全体" も含む）"""
+    out: Dict[int, Dict[str, Tuple[float, int]]] = {}
+    for u, sk, s, n in rows:
+        d = out.setdefault(u, {})
+        d[sk] = (float(s or 0.0), int(n or 0))
+        ts, tn = d.get(OVERALL, (0.0, 0))
+        d[OVERALL] = (ts + float(s or 0.0), tn + int(n or 0))
+    return out
+
+
+def _bucket_deltas(changes) -> Dict[Tuple[str, str, int], int]:
+    """[(テナント, skill, (旧sum, 旧n), (新sum, 新n)), ...] → {(cohort, skill, bucket): 増減}"""
+    out: Dict[Tuple[str, str, int], int] = {}
+    for tenant, skill, (os_, on), (ns, nn) in changes:
+        old_b = bucket_of(os_ / on) if on > 0 else None
+        new_b = bucket_of(ns / nn) if nn > 0 else None
+        if old_b == new_b:
+            continue
+        for c in cohorts(tenant):
+            if old_b is not None:
+                out[(c, skill, old_b)] = out.get((c, skill, old_b), 0) - 1
+            if new_b is not None:
+                out[(c, skill, new_b)] = out.get((c, skill, new_b), 0) + 1
+    return {k: v for k, v in out.items() if v}
+
+
+def _apply(conn, deltas: Dict[Tuple[str, str, int], int]):
+    if not deltas:
+        return
+    sketch = _get_tables()["score_sketch"]
+    rows = [{"cohort": c, "skill": sk, "bucket": b, "count": d} for (c, sk, b), d in deltas.items()]
+    dialect = conn.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        ins = insert(sketch)
+        conn.execute(ins.on_conflict_do_update(index_elements=["cohort", "skill", "bucket"],
+                                               set_={"count": sketch.c["count"] + ins.excluded["count"]}), rows)
+        return
+    for row in rows:
+        upd = (sketch.update()
+               .where(sketch.c.cohort == row["cohort"], sketch.c.skill == row["skill"],
+                      sketch.c.bucket == row["bucket"])
+               .values(count=sketch.c["count"] + row["count"]))
+        if conn.execute(upd).rowcount == 0:
+            conn.execute(sketch.insert(), [row])
+
+
+def _stats_rows(conn, user_ids):
+    from sqlalchemy import select
+
+    stats = attempts._get_tables()["user_skill_stats"]
+    stmt = select(stats.c.user_id, stats.c.skill, stats.c.score_sum, stats.c.score_n)
+    if user_ids is not None:
+        stmt = stmt.where(stats.c.user_id.in_(list(user_ids)))
+    return conn.execute(stmt).fetchall()
+
+
+def _on_batch(conn, batch: List[dict]):
+    """attempts の書き込みフック（user_skill_stats 更新後に呼ばれる）：旧スコア→新スコアの移動を加算"""
+    by_user: Dict[int, Dict[str, dict]] = {}
+    for (u, sk), d in attempts._aggregate(batch).items():
+        by_user.setdefault(u, {})[sk] = d
+    tenants = _tenants(conn, by_user, assign=TENANT)
+    now = _user_scores(_stats_rows(conn, by_user))
+    changes = []
+    for u, deltas in by_user.items():
+        cur = now.get(u)
+        if not cur:
+            continue
+        t = tenants.get(u, "")
+        for sk, d in deltas.items():
+            s, n = cur.get(sk, (0.0, 0))
+            changes.append((t, sk, (s - d["score_sum"], n - d["score_n"]), (s, n)))
+        s, n = cur[OVERALL]
+        changes.append((t, OVERALL, (s - sum(d["score_sum"] for d in deltas.values()),
+                                     n - sum(d["score_n"] for d in deltas.values())), (s, n)))
+    _apply(conn, _bucket_deltas(changes))
+
+
+def _on_reset(conn, user_id: int):
+    """通算リセットのフック（user_skill_stats 削除前に呼ばれる）：このユーザーの分を分布から外す"""
+    cur = _user_scores(_stats_rows(conn, {int(user_id)})).get(int(user_id), {})
+    t = _tenants(conn, {int(user_id)}).get(int(user_id), "")
+    _apply(conn, _bucket_deltas([(t, sk, v, (0.0, 0)) for sk, v in cur.items()]))
+
+
+def _rebuild(conn):
+    """score_sketch を user_skill_stats から作り直す（コホートは user_cohort の各ユーザーのテナント）"""
+    sketch = _get_tables()["score_sketch"]
+    conn.execute(sketch.delete())
+    tenants = _tenants(conn, None)
+    changes = []
+    for u, cur in _user_scores(_stats_rows(conn, None)).items():
+        t = tenants.get(int(u), "")
+        changes.extend((t, sk, (0.0, 0), v) for sk, v in cur.items())
+    _apply(conn, _bucket_deltas(changes))
+
+attempts.register_batch_hook(_on_batch)
+attempts.register_reset_hook(_on_reset)
+
+
+# ---- 読み出し ----
+
+_cache: Dict[Tuple[str, str], ScoreHistogram] = {}
+_cache_at = 0.0
+_cache_lock = threading.Lock()
+
+
+def _histograms() -> Dict[Tuple[str, str], ScoreHistogram]:
+    global _cache, _cache_at
+    if time.monotonic() - _cache_at < REFRESH_SEC:
+        metrics.cache_lookup("percentile", True)
+        return _cache
+    from sqlalchemy import select
+
+    init_db()
+    with _cache_lock:
+        if time.monotonic() - _cache_at < REFRESH_SEC:
+            metrics.cache_lookup("percentile", True)
+            return _cache
+        metrics.cache_lookup("percentile", False)
+        sketch = _get_tables()["score_sketch"]
+        counts: Dict[Tuple[str, str], Dict[int, int]] = {}
+        with auth.get_engine().connect() as conn:
+            for c, sk, b, n in conn.execute(select(sketch).where(sketch.c["count"] > 0)):
+                counts.setdefault((c, sk), {})[b] = n
+        _cache = {k: ScoreHistogram(v) for k, v in counts.items()}
+        _cache_at = time.monotonic()
+    return _cache
+
+
+def placement(stats: dict, cohort: str = "all") -> Dict[str, int]:
+    """
+    get_skill_stats() の結果（自分のスキル別集計）→ {skill: 上位何%}（"全体" を含む）。
+    母集団が MIN_USERS 未満のスキルは含めない。
+    """
+    hists = _histograms()
+    mine = {sk: (d.get("score_sum") or 0.0, d.get("score_n") or 0) for sk, d in stats.items()}
+    ts = sum(s for s, _ in mine.values())
+    tn = sum(n for _, n in mine.values())
+    mine[OVERALL] = (ts, tn)
+    out = {}
+    for sk, (s, n) in mine.items():
+        h = hists.get((cohort, sk))
+        if n <= 0 or h is None or h.n < MIN_USERS:
+            continue
+        top = h.top_percent(s / n)
+        if top is not None:
+            out[sk] = top
+    return out
+
+
+_tenant_of: Dict[int, str] = {}  # user_id → テナント（一度決まったら変わらないのでプロセス内に持つ）
+
+
+def user_tenant(user_id: int) -> str:
+    """そのユーザーのテナント（user_cohort。無い・まだ回答が記録されていなければ ""）"""
+    uid = int(user_id)
+    if uid not in _tenant_of:
+        init_db()
+        with auth.get_engine().connect() as conn:
+            t = _tenants(conn, {uid}).get(uid)
+        if t is None:
+            return ""  # 未登録はまだ決まっていないので覚えない
+        _tenant_of[uid] = t
+    return _tenant_of[uid]
+
+
+def invalidate():
+    global _cache_at
+    _cache_at = 0.0
+
+
+if __name__ == "__main__":
+    # python -m app.services.percentile --rebuild
+    if "--rebuild" in sys.argv:
+        attempts.init_db()
+        with auth.get_engine().begin() as conn:
+            _get_tables()["metadata"].create_all(conn)
+            _rebuild(conn)
+        _initialized = True
+    for (c, sk), h in sorted(_histograms().items()):
+        print(f"{c:<16} {sk:<12} users={h.n}")
@@ -0,0 +1,102 @@
+# app/services/profiler.py
+# 再実行（rerun）単位の軽量スパン計測。
+#   - span("name") / @profiled("name") で区間を計測
+#   - begin_run() 以降のスパンはスレッドローカルに積まれ、current_run() で取得（ウォーターフォール用）
+#   - 全スパンはプロセス内のローリング窓に入り、stats() で p50/p95 を返す
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List
+
+WINDOW = 200  # スパン名ごとに保持する直近サンプル数
+
+_local = threading.local()
+_lock = threading.Lock()
+_windows: Dict[str, deque] = {}
+
+
+def begin_run() -> None:
+    """スクリプト先頭で呼ぶ。今回の rerun のスパン記録をリセットする。"""
+    _local.t0 = time.perf_counter()
+    _local.spans = []
+    _local.depth = 0
+
+
+def _record(name: str, start: float, dur: float, depth: int) -> None:
+    with _lock:
+        win = _windows.get(name)
+        if win is None:
+            win = _windows[name] = deque(maxlen=WINDOW)
+        win.append(dur)
+    spans = getattr(_local, "spans", None)
+    if spans is not None:
+        spans.append({
+            "name": name,
+            "start_ms": (start - _local.t0) * 1000.0,
+            "dur_ms": dur * 1000.0,
+            "depth": depth,
+        })
+
+
+@contextmanager
+def span(name: str):
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        dur = time.perf_counter() - t
+        _local.depth = depth
+        _record(name, t, dur, depth)
+
+
+def add_span(name: str, start: float) -> None:
+    """with で囲みにくいトップレベル区間用: start（perf_counter 値）から現在までを記録"""
+    _record(name, start, time.perf_counter() - start, getattr(_local, "depth", 0))
+
+
+def profiled(name: str):
+    """関数全体を span で囲むデコレータ"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def current_run() -> List[dict]:
+    """今回の rerun で記録されたスパン（開始順）"""
+    spans = getattr(_local, "spans", None) or []
+    return sorted(spans, key=lambda s: s["start_ms"])
+
+
+def run_elapsed_ms() -> float:
+    t0 = getattr(_local, "t0", None)
+    return 0.0 if t0 is None else (time.perf_counter() - t0) * 1000.0
+
+
+def _pct(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    i = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+
+def stats() -> Dict[str, dict]:
+    """スパン名ごとの直近窓の件数と p50/p95（ミリ秒）"""
+    with _lock:
+        snap = {k: sorted(v) for k, v in _windows.items()}
+    return {
+        k: {"n": len(v), "p50_ms": _pct(v, 0.50) * 1000.0, "p95_ms": _pct(v, 0.95) * 1000.0}
+        for k, v in snap.items()
+    }
+
+
+def reset() -> None:
+    with _lock:
+        _windows.clear()
@@ -0,0 +1,216 @@
+# app/services/regrade.py
+# 正答キーの修正後に、保存済み attempts（MCQ）を現在の cq.db の answer_key で採点し直す（オフラインのバッチジョブ）。
+#   python -m app.services.regrade            # 影響の確認だけ（スキル別の正答数・正答率の前後）
+#   python -m app.services.regrade --apply    # attempts と user_skill_stats を更新する
+#
+# - attempts は id 順に CHUNK_ROWS 件ずつ読み（キーセットページング）、grader の列指向 API
+#   （AnswerKeys.lookup → grade_columns）で正誤を出す。行ごとのオブジェクトは作らない
+# - 集計はスキル別（bincount）。--apply では変わった行だけ attempts.correct / answer_key を UPDATE し、
+#   ユーザー×スキルの差分を user_skill_stats に加算する（チャンクごとに1トランザクション）。
+#   「通算をリセット」より前の attempts は集計に入っていないので差分には含めない
+# - 適用済みの行は保存キー＝現在のキーになるので、途中で落ちても最初から流し直せばよい（冪等）
+# - 能力推定 θ（ability）は回答順に依存するため再計算しない。項目分析は item_analysis --full で作り直す
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.services import attempts, auth
+from app.services.config import DB_PATH, ensure_runtime_paths
+from app.services.grader import AnswerKeys, encode_choices, grade_columns, summarize_columns
+
+CHUNK_ROWS = int(os.getenv("CQ_REGRADE_CHUNK", "200000"))
+_SUMMARY = ("graded", "correct", "weighted_score", "weighted_total")
+
+
+def load_answer_keys(bank_path=None) -> AnswerKeys:
+    """cq.db の MCQ の正答キー"""
+    if bank_path is None:
+        ensure_runtime_paths()
+        bank_path = DB_PATH
+    with sqlite3.connect(bank_path) as conn:
+        rows = conn.execute("SELECT id, answer_key FROM questions WHERE type = 'mcq'").fetchall()
+    return AnswerKeys([r[0] for r in rows], [r[1] for r in rows])
+
+
+def regrade_chunk(keys: AnswerKeys, qids, chosen, stored_keys, stored_correct):
+    """
+    1チャンク分の列 → (新しい正答コード, 新しい正誤, 変わった行のマスク)。
+      stored_correct: 1/0、未判定は -1。バンクに無い問題の行は保存値のまま（変更なし）
+    """
+    key = keys.lookup(qids)
+    known = key != -2
+    old_key = encode_choices(stored_keys)
+    new_key = np.where(known, key, old_key).astype(np.int8)
+    new_correct = np.where(known, grade_columns(new_key, encode_choices(chosen)), stored_correct).astype(np.int8)
+    changed = known & ((new_correct != stored_correct) | (new_key != old_key))
+    return new_key, new_correct, changed
+
+
+def _merge(acc: dict, part: dict):
+    for sk, d in part.items():
+        cur = acc.setdefault(sk, dict.fromkeys(_SUMMARY, 0))
+        for f in _SUMMARY:
+            cur[f] += d[f]
+
+
+def _stat_deltas(users, names, inv, diff, old_c, new_c, mask) -> Dict[tuple, dict]:
+    """変わった行 → {(user_id, skill): user_skill_stats への差分}（names/inv はチャンク内のスキル符号）"""
+    if not mask.any():
+        return {}
+    combo = users[mask] * len(names) + inv[mask]
+    pairs, pinv = np.unique(combo, return_inverse=True)
+    d, o, n = diff[mask], old_c[mask], new_c[mask]
+    m = len(pairs)
+
+    def delta(w):
+        return np.bincount(pinv, weights=w, minlength=m)
+
+    dg = (n >= 0).astype(np.float64) - (o >= 0)
+    dc = (n == 1).astype(np.float64) - (o == 1)
+    cols = {
+        "graded": delta(dg), "correct": delta(dc),
+        "score_sum": delta(dc), "score_n": delta(dg),  # MCQ の 0..1 スコアは正誤そのもの
+        "weighted_score": delta(d * dc), "weighted_total": delta(d * dg),
+    }
+    out = {}
+    for i in range(m):
+        row = {f: (float(v[i]) if f.startswith("weighted") or f == "score_sum" else int(v[i]))
+               for f, v in cols.items()}
+        if any(row.values()):
+            out[(int(pairs[i] // len(names)), str(names[pairs[i] % len(names)]))] = row
+    return out
+
+
+def _apply(conn, changed_rows: list, deltas: Dict[tuple, dict]):
+    from sqlalchemy import bindparam
+
+    t = attempts._get_tables()
+    at, stats = t["attempts"], t["user_skill_stats"]
+    if changed_rows:
+        conn.execute(
+            at.update().where(at.c.id == bindparam("rid"))
+            .values(correct=bindparam("new_correct"), answer_key=bindparam("new_key")),
+            changed_rows,
+        )
+    if deltas:
+        fields = ("graded", "correct", "score_sum", "score_n", "weighted_score", "weighted_total")
+        conn.execute(
+            stats.update()
+            .where(stats.c.user_id == bindparam("uid"), stats.c.skill == bindparam("sk"))
+            .values({f: stats.c[f] + bindparam(f"d_{f}") for f in fields}),
+            [{"uid": u, "sk": sk, **{f"d_{f}": d[f] for f in fields}} for (u, sk), d in deltas.items()],
+        )
+
+
+def run(apply: bool = False, chunk_rows: int = CHUNK_ROWS, bank_path=None, log=print) -> dict:
+    """
+    全 MCQ attempts を現在の正答キーで採点し直す。スキル別の前後集計と変更件数を返す。
+    apply=False なら DB は変更しない。
+    """
+    from sqlalchemy import select
+
+    attempts.init_db()
+    attempts.flush()
+    keys = load_answer_keys(bank_path)
+    t = attempts._get_tables()
+    at, resets = t["attempts"], t["attempt_resets"]
+    engine = auth.get_engine()
+    with engine.connect() as conn:
+        reset_after = {u: a for u, a in conn.execute(select(resets.c.user_id, resets.c.after_id))}
+
+    before: dict = {}
+    after: dict = {}
+    last_id, rows_done, changed_total, stats_rows = 0, 0, 0, 0
+    t0 = time.perf_counter()
+    while True:
+        stmt = (
+            select(at.c.id, at.c.user_id, at.c.question_id, at.c.skill, at.c.difficulty,
+                   at.c.chosen, at.c.answer_key, at.c.correct)
+            .where(at.c.id > last_id, at.c.type == "mcq")
+            .order_by(at.c.id)
+            .limit(int(chunk_rows))
+        )
+        with engine.connect() as conn:
+            rows = conn.execute(stmt).fetchall()
+        if not rows:
+            break
+        ids, users, qids, skills, diff, chosen, stored_keys, correct = zip(*rows)
+        n = len(rows)
+        ids = np.fromiter(ids, dtype=np.int64, count=n)
+        users = np.fromiter(users, dtype=np.int64, count=n)
+        skills = np.asarray([s or "その他" for s in skills], dtype=str)
+        diff = np.fromiter((0.5 if d is None else d for d in diff), dtype=np.float64, count=n)
+        old_c = np.fromiter((-1 if c is None else int(bool(c)) for c in correct), dtype=np.int8, count=n)
+
+        new_key, new_c, changed = regrade_chunk(keys, qids, chosen, stored_keys, old_c)
+
+        _merge(before, summarize_columns(skills, old_c, diff))
+        _merge(after, summarize_columns(skills, new_c, diff))
+
+        nch = int(changed.sum())
+        changed_total += nch
+        if apply and nch:
+            uniq, uinv = np.unique(users, return_inverse=True)
+            in_stats = ids > np.asarray([reset_after.get(int(u), 0) for u in uniq], dtype=np.int64)[uinv]
+            names, inv = np.unique(skills, return_inverse=True)
+            deltas = _stat_deltas(users, names, inv, diff, old_c, new_c, changed & in_stats)
+            idx = np.flatnonzero(changed)
+            changed_rows = [{"rid": int(ids[i]),
+                             "new_correct": None if new_c[i] < 0 else bool(new_c[i]),
+                             "new_key": None if new_key[i] < 0 else "ABCD"[new_key[i]]} for i in idx]
+            with engine.begin() as conn:
+                _apply(conn, changed_rows, deltas)
+            stats_rows += len(deltas)
+        last_id = int(ids[-1])
+        rows_done += n
+        log(f"  chunk: {n} rows (up to id {last_id}), {nch} changed, "
+            f"{rows_done / (time.perf_counter() - t0):.0f} rows/s")
+
+    if apply and changed_total:
+        _refresh_derived(log)
+    return {"rows": rows_done, "changed": changed_total, "stats_rows": stats_rows, "applied": apply,
+            "before": before, "after": after, "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def _refresh_derived(log=print):
+    """集計から作っている派生データ（順位スケッチ）を作り直す"""
+    try:
+        from app.services import percentile
+
+        with auth.get_engine().begin() as conn:
+            percentile._get_tables()["metadata"].create_all(conn)
+            percentile._rebuild(conn)
+        percentile.invalidate()
+    except Exception as e:
+        print(f"[WARN] percentile rebuild after regrade failed: {e}")
+    log("  note: run `python -m app.services.item_analysis --full` to rebuild item statistics")
+
+
+def _fmt(d: Optional[dict]) -> str:
+    if not d or not d["graded"]:
+        return "—"
+    return f"{int(d['correct'])}/{int(d['graded'])} ({d['correct'] / d['graded']:.1%})"
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="正答キー修正後の attempts 再採点")
+    ap.add_argument("--apply", action="store_true", help="attempts と user_skill_stats を更新する")
+    ap.add_argument("--chunk", type=int, default=CHUNK_ROWS)
+    args = ap.parse_args(argv)
+
+    res = run(apply=args.apply, chunk_rows=args.chunk)
+    print(f"{res['rows']} mcq attempts, {res['changed']} changed"
+          f"{' (applied, ' + str(res['stats_rows']) + ' stats rows)' if res['applied'] else ' (dry run)'}"
+          f" in {res['seconds']}s")
+    for sk in sorted(set(res["before"]) | set(res["after"])):
+        print(f"  {sk:<12} {_fmt(res['before'].get(sk))} -> {_fmt(res['after'].get(sk))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
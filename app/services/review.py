@@ -0,0 +1,204 @@
+# app/services/review.py
+# 間違えた MCQ の復習スケジュール（SM-2）。
+#   - 不正解になった問題をユーザーごとのカードとして review_items に登録し、
+#     以降の正誤で SM-2 の間隔（1日 → 6日 → 間隔×EF …）で次回の due_at を決める
+#   - 不正解直後は RELEARN_MIN 分後に再出題（セッション内の再学習）
+#   - 更新は attempts の書き込みスレッドと同じトランザクション（register_batch_hook）で行う
+#   - 通算リセット（register_reset_hook）ではそのユーザーのカードを消す
+#   - 「今出すべき復習」は (user_id, skill, due_at) の索引を due_at 順に先頭から読むだけ
+#     （= 索引付きテーブルが永続の優先度キュー。履歴の走査はしない）
+#   - 1バッチに混ぜる復習の割合はスキルごとに CQ_REVIEW_MIX で指定（例 "0.5" / "要約=0.5,*=0.3"）
+import datetime as dt
+import os
+import threading
+from typing import Dict, List, Optional
+
+from app.services import attempts, auth
+
+RELEARN_MIN = float(os.getenv("CQ_REVIEW_RELEARN_MIN", "10"))   # 不正解から再出題までの分
+RETIRE_DAYS = float(os.getenv("CQ_REVIEW_RETIRE_DAYS", "60"))   # 間隔がこれを超えたら卒業（カード削除）
+EF_START, EF_MIN = 2.5, 1.3
+Q_CORRECT, Q_WRONG = 4, 2  # 正誤しか無いので SM-2 の回答品質 0..5 はこの2値に写す
+
+_tables = None
+_tables_lock = threading.Lock()
+_initialized = False
+
+
+def _parse_mix(spec: str) -> Dict[str, float]:
+    out = {"*": 0.5}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        key, _, val = part.rpartition("=")
+        try:
+            out[key.strip() or "*"] = min(1.0, max(0.0, float(val)))
+        except ValueError:
+            print(f"[WARN] CQ_REVIEW_MIX: ignored '{part}'")
+    return out
+
+MIX = _parse_mix(os.getenv("CQ_REVIEW_MIX", "0.5"))
+
+
+def mix_ratio(skill: str) -> float:
+    return MIX.get(skill, MIX["*"])
+
+
+def _get_tables():
+    global _tables
+    if _tables is None:
+        with _tables_lock:
+            if _tables is None:
+                from sqlalchemy import MetaData, Table, Column, Integer, String, Float, DateTime, Index
+                from sqlalchemy import PrimaryKeyConstraint
+
+                md = MetaData()
+                items = Table(
+                    "review_items", md,
+                    Column("user_id", Integer, nullable=False),
+                    Column("question_id", String(64), nullable=False),
+                    Column("skill", String(64), nullable=False),
+                    Column("ef", Float, nullable=False, default=EF_START),
+                    Column("reps", Integer, nullable=False, default=0),        # 連続正解回数
+                    Column("interval_days", Float, nullable=False, default=0.0),
+                    Column("lapses", Integer, nullable=False, default=0),      # 不正解回数
+                    Column("due_at", DateTime, nullable=False),
+                    Column("updated_at", DateTime, nullable=False),
+                    PrimaryKeyConstraint("user_id", "question_id", name="pk_review_items"),
+                    Index("ix_review_items_due", "user_id", "skill", "due_at"),
+                )
+                _tables = {"metadata": md, "review_items": items}
+    return _tables
+
+
+@attempts.register_setup_hook
+def _setup(engine):
+    """attempts.init_db から（書き込みスレッドが書き始める前に）呼ばれる"""
+    global _initialized
+    _get_tables()["metadata"].create_all(engine)
+    _initialized = True
+
+
+def init_db():
+    if not _initialized:
+        attempts.init_db()
+
+
+# ---- SM-2 ----
+
+def schedule(card: Optional[dict], correct: bool, now: dt.datetime) -> Optional[dict]:
+    """
+    カード（無ければ None）と今回の正誤 → 更新後のカード。
+    None を返したら「カードを作らない／削除する」（未登録で正解、または卒業）。
+    """
+    if card is None:
+        if correct:
+            return None
+        card = {"ef": EF_START, "reps": 0, "interval_days": 0.0, "lapses": 0}
+    else:
+        card = dict(card)
+    q = Q_CORRECT if correct else Q_WRONG
+    card["ef"] = max(EF_MIN, card["ef"] + (0.1 - (5 - q) * (0.08 + (5 - q) * 0.02)))
+    if not correct:
+        card["reps"] = 0
+        card["lapses"] += 1
+        card["interval_days"] = 0.0
+        card["due_at"] = now + dt.timedelta(minutes=RELEARN_MIN)
+    else:
+        card["reps"] += 1
+        if card["reps"] == 1:
+            card["interval_days"] = 1.0
+        elif card["reps"] == 2:
+            card["interval_days"] = 6.0
+        else:
+            card["interval_days"] = card["interval_days"] * card["ef"]
+        if card["interval_days"] > RETIRE_DAYS:
+            return None
+        card["due_at"] = now + dt.timedelta(days=card["interval_days"])
+    card["updated_at"] = now
+    return card
+
+
+def _on_batch(conn, batch: List[dict]):
+    """attempts の書き込みフック：MCQ の正誤でカードを作成・更新・削除する"""
+    from sqlalchemy import select, tuple_, and_
+
+    graded = [r for r in batch if r.get("type") == "mcq" and r.get("correct") is not None]
+    if not graded:
+        return
+    items = _get_tables()["review_items"]
+    keys = {(r["user_id"], r["question_id"]) for r in graded}
+    cards: Dict[tuple, Optional[dict]] = {}
+    for row in conn.execute(select(items).where(tuple_(items.c.user_id, items.c.question_id).in_(list(keys)))):
+        m = row._mapping
+        cards[(m["user_id"], m["question_id"])] = {k: m[k] for k in ("skill", "ef", "reps", "interval_days", "lapses")}
+    existed = set(cards)
+
+    for r in graded:  # バッチ内は時系列順
+        key = (r["user_id"], r["question_id"])
+        new = schedule(cards.get(key), bool(r["correct"]), r.get("created_at") or dt.datetime.utcnow())
+        if new is not None:
+            new["skill"] = r.get("skill") or (cards.get(key) or {}).get("skill") or ""
+        cards[key] = new
+
+    gone = [k for k in existed if cards.get(k) is None]
+    if gone:
+        conn.execute(items.delete().where(tuple_(items.c.user_id, items.c.question_id).in_(gone)))
+    rows = [{"user_id": u, "question_id": q, **c} for (u, q), c in cards.items() if c is not None]
+    if not rows:
+        return
+    dialect = conn.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        ins = insert(items)
+        cols = ("skill", "ef", "reps", "interval_days", "lapses", "due_at", "updated_at")
+        conn.execute(ins.on_conflict_do_update(index_elements=["user_id", "question_id"],
+                                               set_={c: ins.excluded[c] for c in cols}), rows)
+        return
+    for row in rows:
+        upd = items.update().where(and_(items.c.user_id == row["user_id"],
+                                        items.c.question_id == row["question_id"])).values(**row)
+        if conn.execute(upd).rowcount == 0:
+            conn.execute(items.insert(), [row])
+
+
+
+def _on_reset(conn, user_id: int):
+    """通算リセットのフック：リセット前の間違いから作ったカードを消す（新しい履歴に混ぜない）"""
+    items = _get_tables()["review_items"]
+    conn.execute(items.delete().where(items.c.user_id == int(user_id)))
+
+attempts.register_batch_hook(_on_batch)
+attempts.register_reset_hook(_on_reset)
+
+
+# ---- 公開API ----
+
+def due(user_id: int, skill: str, limit: int = 8, now: Optional[dt.datetime] = None) -> List[str]:
+    """期限が来た復習カードの question_id（期限の古い順、最大 limit 件）。索引の範囲読みだけで済む"""
+    from sqlalchemy import select
+
+    init_db()
+    items = _get_tables()["review_items"]
+    now = now or dt.datetime.utcnow()
+    stmt = (
+        select(items.c.question_id)
+        .where(items.c.user_id == int(user_id), items.c.skill == skill, items.c.due_at <= now)
+        .order_by(items.c.due_at)
+        .limit(int(limit))
+    )
+    with auth.get_engine().connect() as conn:
+        return [r[0] for r in conn.execute(stmt)]
+
+
+def review_slots(skill: str, want: int) -> int:
+    """want 件のバッチに入れてよい復習の最大件数（四捨五入、割合が正なら最低1）"""
+    r = mix_ratio(skill)
+    if r <= 0:
+        return 0
+    return min(want, max(1, int(want * r + 0.5)))
+
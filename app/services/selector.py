@@ -0,0 +1,216 @@
+# app/services/selector.py
+# 出題バッチの選定（Streamlit 非依存）。アプリ本体とバックグラウンド先読みの両方から使う。
+#   - バンクはプロセス内に1回だけ読み、(スキル, ドメイン, SJT) ごとの難易度ソート済み
+#     インデックスにする（cq.db が更新されたら作り直す）。候補は常にこのプール全体から取るので、
+#     未出題が残っているのに「登録問題が不足」になることはない
+#   - random  : プールの未出題から最大 SAMPLE_SIZE 件をランダムに取り、その中で選ぶ（プール全体は並べない）
+#   - adaptive: MCQ はユーザーの能力推定（adaptive.py）に難易度が近い帯から選ぶ
+#   - どちらも最後は露出の少ない順（exposure.py）。人気の問題ばかり出るのを防ぐ
+#   - walk    : ユーザー×スキル×ドメインごとの鍵付き置換（walk.py）を登録順のプール上で歩く。
+#     seen_ids を使わず、セッションをまたいでも1周するまで同じ問題を出さない
+#   - user_id があれば、期限の来た復習（review.py）をスキルごとの割合まで先に入れ、残りを新規で埋める
+import bisect
+import os
+import random
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.domain.models import Question
+from app.services.config import DB_PATH
+from app.services import exposure, metrics
+from app.services.db import load_all_questions
+
+SELECT_MODE = os.getenv("CQ_SELECT_MODE", "adaptive").strip().lower()  # adaptive | random | walk
+NEAREST_FACTOR = 2     # 目標難易度に近い want×この数 を難易度帯とし、その中で露出の少ないものを選ぶ
+SAMPLE_SIZE = int(os.getenv("CQ_SELECT_SAMPLE", "200"))  # random（と SJT）で露出を比べる候補数の上限
+
+
+def domain_tagset(domain_label: str) -> Set[str]:
+    """ドメイン選択に応じた優先タグ集合"""
+    if domain_label == "ビジネス":
+        return {"business", "workplace", "meeting", "team", "office", "review", "deadline", "decision"}
+    else:  # 日常
+        return {"daily", "日常", "friend", "family", "生活", "home", "communication"}
+
+
+def filter_by_domain_strict(qs, domain_label: str) -> List:
+    """タグ一致のみ採用（越境補充なし）"""
+    pref = domain_tagset(domain_label)
+    return [q for q in qs if any(t in pref for t in (q.tags or []))]
+
+
+# ---- 難易度インデックス ----
+
+class DifficultyIndex:
+    """difficulty 昇順に並べた問題列。target に近い順に exclude 以外を取り出す"""
+
+    def __init__(self, questions: Iterable[Question]):
+        self.in_order = list(questions)  # バンク（登録順）のまま。walk モードの位置はこの添字
+        pairs = sorted(((float(q.difficulty), q.id, q) for q in self.in_order), key=lambda p: (p[0], p[1]))
+        self.keys = [p[0] for p in pairs]
+        self.items = [p[2] for p in pairs]
+
+    def __len__(self):
+        return len(self.items)
+
+    def nearest(self, target: float, k: int, exclude: Set[str] = frozenset()) -> List[Question]:
+        """target から両側へ広げながら、近い順に最大 k 件"""
+        out: List[Question] = []
+        hi = bisect.bisect_left(self.keys, target)
+        lo = hi - 1
+        n = len(self.items)
+        while len(out) < k and (lo >= 0 or hi < n):
+            if hi >= n or (lo >= 0 and target - self.keys[lo] <= self.keys[hi] - target):
+                q = self.items[lo]
+                lo -= 1
+            else:
+                q = self.items[hi]
+                hi += 1
+            if q.id not in exclude:
+                out.append(q)
+        return out
+
+
+_bank_lock = threading.Lock()
+_bank_sig: Optional[Tuple[float, int]] = None
+_bank: List[Question] = []
+_bank_by_id: Dict[str, Question] = {}
+_indexes: Dict[Tuple[str, str, bool], DifficultyIndex] = {}
+
+
+def _bank_signature() -> Optional[Tuple[float, int]]:
+    try:
+        st = os.stat(DB_PATH)
+        return (st.st_mtime, st.st_size)
+    except OSError:
+        return None
+
+
+def _refresh_bank():
+    """（_bank_lock 内で呼ぶ）cq.db の mtime/size が変わっていたらバンクを読み直し、インデックスを捨てる"""
+    global _bank_sig, _bank, _bank_by_id, _indexes
+    sig = _bank_signature()
+    metrics.cache_lookup("bank", sig == _bank_sig and sig is not None)
+    if sig != _bank_sig or sig is None:
+        _bank = load_all_questions()
+        _bank_by_id = {q.id: q for q in _bank}
+        _bank_sig = sig
+        _indexes = {}
+
+
+def _index_for(skill: str, domain: str, is_sjt: bool) -> DifficultyIndex:
+    """(スキル, ドメイン, SJT) ごとのインデックス"""
+    key = (skill, domain, is_sjt)
+    with _bank_lock:
+        _refresh_bank()
+        idx = _indexes.get(key)
+        metrics.cache_lookup("difficulty_index", idx is not None)
+        if idx is None:
+            qs = [q for q in _bank if q.skill == skill and ((q.type == "sjt") == is_sjt)]
+            idx = _indexes[key] = DifficultyIndex(filter_by_domain_strict(qs, domain))
+    return idx
+
+
+def _due_reviews(skill: str, domain: str, want: int, user_id: int, avoid: Set[str]) -> List[Question]:
+    """期限が来た復習のうち、このドメインで出せるものを割合の上限まで（期限の古い順）"""
+    from app.services import review
+
+    slots = review.review_slots(skill, want)
+    if slots <= 0:
+        return []
+    ids = [i for i in review.due(user_id, skill, limit=slots * 4) if i not in avoid]
+    if not ids:
+        return []
+    with _bank_lock:
+        _refresh_bank()
+        qs = [_bank_by_id[i] for i in ids if i in _bank_by_id]
+    return filter_by_domain_strict([q for q in qs if q.type != "sjt"], domain)[:slots]
+
+
+def _pick_adaptive(skill: str, domain: str, want: int, exclude: Set[str], user_id: int) -> List[Question]:
+    from app.services import adaptive
+
+    target = adaptive.target_difficulty(user_id, skill)
+    near = _index_for(skill, domain, False).nearest(target, want * NEAREST_FACTOR, exclude)
+    return exposure.least_exposed(near, want)
+
+
+def _pick_walk(skill: str, domain: str, want: int, is_sjt: bool, user_id: int, skip: Set[str]) -> List[Question]:
+    from app.services import walk
+
+    pool = _index_for(skill, domain, is_sjt).in_order
+    return walk.peek(walk.get_state(user_id, skill, domain, len(pool)), pool, want, skip)
+
+
+def _sample(items: List[Question], k: int, exclude: Set[str]) -> List[Question]:
+    """exclude 以外から最大 k 件をランダムに（大きいプールは添字を引くだけで、全件の絞り込みはしない）"""
+    n = len(items)
+    if n > k * 4:
+        out, tried = [], set()
+        for i in random.sample(range(n), min(n, k * 4)):
+            q = items[i]
+            tried.add(i)
+            if q.id not in exclude:
+                out.append(q)
+                if len(out) >= k:
+                    return out
+        # exclude が大半を占める（出題済みが多い）ときだけ残りを全部見る
+        rest = [q for i, q in enumerate(items) if i not in tried and q.id not in exclude]
+        return out + random.sample(rest, min(len(rest), k - len(out)))
+    pool = [q for q in items if q.id not in exclude]
+    return pool if len(pool) <= k else random.sample(pool, k)
+
+
+def pick_batch(skill: str, domain: str, want: int = 2, exclude: Iterable[str] = (),
+               user_id: Optional[int] = None, avoid: Iterable[str] = ()) -> List[Question]:
+    """
+    指定スキル／ドメインから exclude に無い問題を最大 want 件返す。
+    exclude は変更しない（出題済みへの登録は呼び出し側が「表示した時点」で行う）。
+    user_id があれば、期限の来た復習（exclude に入っていても出す。avoid に入っているものは出さない）
+    を先に入れる。adaptive モードなら、残りの MCQ は能力推定に合う難易度から選ぶ。
+    walk モードは exclude を見ず、歩行位置の次から取る（表示後に mark_shown() で進める）。
+    """
+    is_sjt = (skill == "状況判断")
+    exclude = set(exclude)
+
+    reviews: List[Question] = []
+    if user_id is not None and not is_sjt:
+        reviews = _due_reviews(skill, domain, want, user_id, set(avoid))
+        exclude.update(q.id for q in reviews)
+        want -= len(reviews)
+        if want <= 0:
+            return reviews
+
+    if SELECT_MODE == "walk" and user_id is not None:
+        return reviews + _pick_walk(skill, domain, want, is_sjt, user_id, {q.id for q in reviews})
+    if SELECT_MODE == "adaptive" and user_id is not None and not is_sjt:
+        return reviews + _pick_adaptive(skill, domain, want, exclude, user_id)
+
+    pool = _sample(_index_for(skill, domain, is_sjt).items, max(SAMPLE_SIZE, want), exclude)
+    return reviews + exposure.least_exposed(pool, want)
+
+
+def get_questions(ids: Iterable[str]) -> List[Question]:
+    """ID から問題を引く（バンクのキャッシュから。無い ID は飛ばす）"""
+    with _bank_lock:
+        _refresh_bank()
+        return [_bank_by_id[i] for i in ids if i in _bank_by_id]
+
+
+def mark_shown(skill: str, domain: str, ids: Iterable[str], user_id: Optional[int]) -> None:
+    """表示したバッチを選定側に伝える（walk モードで歩行位置を進める。他のモードでは何もしない）"""
+    if SELECT_MODE != "walk" or user_id is None:
+        return
+    from app.services import walk
+
+    pool = _index_for(skill, domain, skill == "状況判断").in_order
+    walk.advance(user_id, skill, domain, pool, ids)
+
+
+def walk_token(skill: str, domain: str, user_id: Optional[int]) -> Optional[tuple]:
+    """walk モードの現在位置（先読みした次バッチがまだ有効かの判定用）"""
+    if SELECT_MODE != "walk" or user_id is None:
+        return None
+    from app.services import walk
+
+    return walk.token(user_id, skill, domain)
@@ -0,0 +1,149 @@
+# app/services/spec_eval.py
+# 自由記述の先回り評価。入力が確定したら（text_area からフォーカスが外れたら on_change で speculate）、
+# 少し待って内容が変わっていなければ裏で eval_free_response を始め、結果を「設問文＋回答」のハッシュで持っておく。
+# 「フィードバックを見る」では eval_free_responses が lookup() で同じ内容の評価を探し、あればそれを使う
+# （終わっていればそのまま、走っていればその Future を締め切り付きで待つ）。
+#   - Streamlit の text_area は入力中の文字を送らず、確定時にだけ値を送る。なのでフォーカスが外れた時点が
+#     「入力が止まった」合図で、CQ_SPEC_DEBOUNCE_S はその後に続けて書き直したときの空振りを減らすためのもの
+#   - LLM の枠は SPECULATIVE（採点・講評より後回し、待てる時間も短い）。混雑で簡易評価になったもの・
+#     API エラーなどでルールベースに落ちたもの（fallback）は残さず、採点側が INTERACTIVE で評価し直す
+#   - 先回りで LLM を呼ぶのはユーザーごとに CQ_SPEC_MAX_PER_USER 回 / CQ_SPEC_WINDOW_S 秒まで（超えたら何もしない）
+#   - 待機・評価中は (ユーザー, 設問) ごとに持つ（書き直しの取り消しや上限は、そのユーザーの分だけに効く）。
+#     評価済みの結果だけ内容のハッシュで引くプロセス内の LRU（CQ_SPEC_CACHE_SIZE 件）に入れ、同じ内容なら別のユーザーの分も使う
+#   CQ_SPEC_EVAL=0 で無効
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+from app.services.metrics import SPEC_EVALS
+
+ENABLED = os.getenv("CQ_SPEC_EVAL", "1") not in ("0", "false", "False")
+DEBOUNCE_S = float(os.getenv("CQ_SPEC_DEBOUNCE_S", "1.0"))
+MAX_PER_USER = int(os.getenv("CQ_SPEC_MAX_PER_USER", "20"))
+WINDOW_S = float(os.getenv("CQ_SPEC_WINDOW_S", "3600"))
+CACHE_SIZE = int(os.getenv("CQ_SPEC_CACHE_SIZE", "1024"))
+MIN_CHARS = 3  # eval_free_response が評価せずに返す長さ未満は先回りしない
+
+_lock = threading.Lock()
+_timers: Dict[tuple, tuple] = {}     # (user_id, 設問) → (内容のハッシュ, Timer)。デバウンス中
+_inflight: Dict[tuple, tuple] = {}   # (user_id, 設問) → (内容のハッシュ, Future)。評価中
+_results: "OrderedDict[str, Future]" = OrderedDict()  # 内容のハッシュ → 評価済み（簡易評価は入れない）
+_calls: Dict[object, deque] = {}     # user_id → 先回りで LLM を呼んだ時刻
+
+
+def content_key(prompt_text: str, user_text: str) -> str:
+    h = hashlib.sha256()
+    h.update((prompt_text or "").encode("utf-8"))
+    h.update(b"\0")
+    h.update((user_text or "").strip().encode("utf-8"))
+    return h.hexdigest()
+
+
+def _allow(user_id) -> bool:
+    """ユーザーごとの上限（直近 WINDOW_S 秒の回数）。_lock を持って呼ぶ"""
+    now = time.monotonic()
+    dq = _calls.setdefault(user_id, deque())
+    while dq and now - dq[0] > WINDOW_S:
+        dq.popleft()
+    if len(dq) >= MAX_PER_USER:
+        return False
+    dq.append(now)
+    return True
+
+
+def speculate(user_id, slot, prompt_text: str, user_text: str) -> None:
+    """入力が確定した（slot＝設問ごと）。DEBOUNCE_S 後も同じ内容なら裏で評価を始める（待たない）"""
+    user_text = (user_text or "").strip()
+    if not ENABLED or user_id is None or len(user_text) < MIN_CHARS:
+        return
+    key = content_key(prompt_text, user_text)
+    sk = (user_id, slot)
+    with _lock:
+        waiting = _timers.get(sk)
+        if waiting is not None:
+            if waiting[0] == key:
+                return
+            del _timers[sk]  # 書き直された：前の内容の待機は取りやめる（このユーザー・設問の分だけ）
+            if waiting[1] is not None:
+                waiting[1].cancel()
+            SPEC_EVALS.inc(event="superseded")
+        running = _inflight.get(sk)
+        if (running is not None and running[0] == key) or key in _results:
+            return
+        if DEBOUNCE_S > 0:
+            t = threading.Timer(DEBOUNCE_S, _start, (user_id, slot, key, prompt_text, user_text))
+            t.daemon = True
+            _timers[sk] = (key, t)
+            t.start()
+            return
+        _timers[sk] = (key, None)
+    _start(user_id, slot, key, prompt_text, user_text)
+
+
+def _start(user_id, slot, key: str, prompt_text: str, user_text: str):
+    from app.services import llm_sched as _llm_sched
+    from app.services.ai_eval import _get_eval_executor, eval_free_response
+
+    sk = (user_id, slot)
+    with _lock:
+        waiting = _timers.get(sk)
+        if waiting is None or waiting[0] != key:
+            return  # 書き直された／採点で先に使われた
+        del _timers[sk]
+        if not _allow(user_id):
+            SPEC_EVALS.inc(event="capped")
+            return
+        f = _get_eval_executor().submit(eval_free_response, prompt_text, user_text, user_id,
+                                        _llm_sched.SPECULATIVE)
+        _inflight[sk] = (key, f)
+    SPEC_EVALS.inc(event="started")
+    f.add_done_callback(lambda f: _finished(sk, key, f))
+
+
+def _finished(sk: tuple, key: str, f: Future):
+    """評価が終わったら内容のハッシュで結果を残す（LLM の評価だけ。簡易評価・ルールベースは残さない）"""
+    ok = f.exception() is None and not f.result().get("mode") and not f.result().get("fallback")
+    with _lock:
+        if _inflight.get(sk, (None, None))[1] is f:
+            del _inflight[sk]
+        if ok:
+            _results[key] = f
+            _results.move_to_end(key)
+            while len(_results) > CACHE_SIZE:
+                _results.popitem(last=False)
+
+
+def lookup(user_id, slot, prompt_text: str, user_text: str) -> Optional[Future]:
+    """
+    その設問の先回り評価（同じ内容のもの）があれば Future（終わっていないこともある）。無ければ None。
+    評価済みの結果は内容のハッシュで引くので、同じ内容なら別のユーザー・設問の分も使う
+    """
+    if not ENABLED:
+        return None
+    key = content_key(prompt_text, user_text)
+    sk = (user_id, slot)
+    with _lock:
+        waiting = _timers.get(sk)
+        if waiting is not None and waiting[0] == key:
+            del _timers[sk]  # まだ待機中：採点側がその場で評価するので、先回りは取りやめる
+            if waiting[1] is not None:
+                waiting[1].cancel()
+        running = _inflight.get(sk)
+        f = running[1] if running is not None and running[0] == key else _results.get(key)
+        if f is not None and key in _results:
+            _results.move_to_end(key)
+    if f is None or (f.done() and (f.exception() is not None or f.result().get("mode")
+                                   or f.result().get("fallback"))):
+        SPEC_EVALS.inc(event="miss")
+        return None
+    SPEC_EVALS.inc(event="used_ready" if f.done() else "used_running")
+    return f
+
+
+def stats() -> dict:
+    with _lock:
+        return {"cached": len(_results), "running": len(_inflight), "waiting": len(_timers)}
@@ -0,0 +1,295 @@
+# app/services/summary_jobs.py
+# 通算講評（AI講評）の先回り生成。採点のたびに enqueue(user_id) し、裏のワーカースレッドが
+# gen_session_feedback を呼んで結果を保存しておく。ボタンは get_ready() で出来上がりを返すだけにする。
+#   - ジョブ・結果は SQLite（CQ_JOBS_DB。既定は users DB と同じ場所の jobs.db、users DB が SQLite でなければ /tmp）
+#   - 同じユーザーのジョブは1行にまとめる（生成中に次の採点が来たら、終わった後にもう1回だけ作る）
+#   - 結果は履歴の版（history_version：スキル別集計の attempts の合計）ごとに保存し、直近 KEEP 版だけ残す。
+#     ボタン側も同じ版で引くので、採点後に履歴が変わっていれば古い講評は出ない
+#   - 混雑で簡易評価（mode あり）になった講評は保存しない（ボタンで改めて生成する）
+#   - 通算リセット時はそのユーザーの講評とジョブを消す
+#   CQ_SUMMARY_JOBS=0 で無効（enqueue は何もしない。ボタンはこれまで通りその場で生成）
+#   CQ_SUMMARY_WORKERS=2  ワーカースレッド数（プロセスごと。複数プロセスでも同じジョブは1つだけが取る）
+#   CQ_SUMMARY_WAIT_S=15  ボタン押下時にそのユーザーのジョブが生成中なら、同じ講評を二重に作らずこの秒数まで待つ
+#                         （順番待ちのジョブは待たない）
+#   CQ_SUMMARY_LEASE_S=300  取り出したジョブの期限。過ぎても終わっていなければ（落ちたプロセスの分など）他のワーカーが取り直す。
+#                           生成（LLM のタイムアウト・リトライ込み）より長くしておく
+import datetime as dt
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.services import attempts as _attempts
+from app.services.auth import DATABASE_URL
+from app.services.metrics import cache_lookup
+
+ENABLED = os.getenv("CQ_SUMMARY_JOBS", "1") not in ("0", "false", "False")
+WORKERS = int(os.getenv("CQ_SUMMARY_WORKERS", "2"))
+WAIT_S = float(os.getenv("CQ_SUMMARY_WAIT_S", "15"))
+LEASE_S = float(os.getenv("CQ_SUMMARY_LEASE_S", "300"))
+KEEP = 3                 # ユーザーごとに残す版の数
+FLUSH_WAIT_S = 5.0       # 生成前に attempts の書き込み待ちを待つ上限
+IDLE_POLL_S = 5.0        # 他プロセスが積んだジョブを拾う間隔
+
+
+def _default_path() -> Path:
+    if DATABASE_URL.startswith("sqlite:///"):
+        return Path(DATABASE_URL[len("sqlite:///"):]).parent / "jobs.db"
+    return Path(tempfile.gettempdir()) / "cq_jobs.db"
+
+
+JOBS_DB = Path(os.getenv("CQ_JOBS_DB") or _default_path())
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS summary_jobs (
+    user_id INTEGER PRIMARY KEY,
+    seq INTEGER NOT NULL,            -- enqueue のたびに +1
+    running_seq INTEGER,             -- 生成中なら取り出した時点の seq
+    enqueued_at REAL NOT NULL,
+    claimed_at REAL,                 -- 取り出した時刻（LEASE_S 過ぎたら取り直せる）
+    owner TEXT                       -- 取り出したワーカー（host:pid:スレッド）
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    user_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    summary_json TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, version)
+);
+"""
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    conn = sqlite3.connect(str(JOBS_DB), timeout=10, isolation_level=None)
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                JOBS_DB.parent.mkdir(parents=True, exist_ok=True)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                cols = {r[1] for r in conn.execute("PRAGMA table_info(summary_jobs)")}
+                for col, typ in (("claimed_at", "REAL"), ("owner", "TEXT")):
+                    if col not in cols:  # 期限を入れる前の jobs.db
+                        conn.execute(f"ALTER TABLE summary_jobs ADD COLUMN {col} {typ}")
+                _schema_ready = True
+    return conn
+
+
+@contextmanager
+def _db():
+    conn = _connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+# ---- 版と入力 ----
+
+def history_version(stats: Optional[dict]) -> int:
+    """get_skill_stats() の結果 → 履歴の版（採点のたびに増える）"""
+    return sum(int(d.get("attempts") or 0) for d in (stats or {}).values())
+
+
+def total_payload(history_items: List[dict], stats: Optional[dict]) -> dict:
+    """通算講評の入力：直近の履歴＋永続集計から求めたスキル別スコア・正解数"""
+    payload = {"session_items": history_items}
+    if stats:
+        payload["meta"] = {
+            "correct": sum(d["correct"] for d in stats.values()),
+            "total": sum(d["graded"] for d in stats.values()),
+            "pre_skill_scores": _attempts.skill_scores(stats),
+        }
+    return payload
+
+
+# ---- 結果 ----
+
+def get_ready(user_id: int, version: int, wait_s: float = 0.0) -> Optional[Dict]:
+    """
+    その版の講評ができていれば返す。wait_s > 0 なら、そのユーザーのジョブが生成中（期限内）の間は出来上がりを待つ。
+    まだ順番待ちのジョブは待たない（他のユーザーの後ろで待つより、呼び出し側がその場で作る方が早い）
+    """
+    deadline = time.monotonic() + wait_s
+    while True:
+        try:
+            with _db() as conn:
+                row = conn.execute("SELECT summary_json FROM summaries WHERE user_id = ? AND version = ?",
+                                   (int(user_id), int(version))).fetchone()
+                running = row is None and conn.execute(
+                    "SELECT 1 FROM summary_jobs WHERE user_id = ? AND running_seq IS NOT NULL AND claimed_at >= ?",
+                    (int(user_id), time.time() - LEASE_S)).fetchone() is not None
+        except sqlite3.Error as e:
+            print(f"[WARN] summary lookup failed: {e}")
+            row, running = None, False
+        if row or not running or time.monotonic() >= deadline:
+            break
+        time.sleep(0.1)
+    cache_lookup("summary", row is not None)
+    return json.loads(row[0]) if row else None
+
+
+def _store(conn: sqlite3.Connection, user_id: int, version: int, summary: Dict):
+    conn.execute("INSERT OR REPLACE INTO summaries (user_id, version, summary_json, created_at) VALUES (?, ?, ?, ?)",
+                 (user_id, version, json.dumps(summary, ensure_ascii=False),
+                  dt.datetime.utcnow().isoformat(timespec="seconds")))
+    conn.execute("DELETE FROM summaries WHERE user_id = ? AND version NOT IN "
+                 "(SELECT version FROM summaries WHERE user_id = ? ORDER BY version DESC LIMIT ?)",
+                 (user_id, user_id, KEEP))
+
+
+# ---- ジョブ ----
+
+def enqueue(user_id: int) -> None:
+    """講評の生成を予約する（待たない）。生成待ちがあれば1件にまとまる"""
+    if not ENABLED or user_id is None:
+        return
+    try:
+        with _db() as conn:
+            conn.execute(
+                "INSERT INTO summary_jobs (user_id, seq, running_seq, enqueued_at) VALUES (?, 1, NULL, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1, "
+                "enqueued_at = CASE WHEN running_seq IS NULL THEN enqueued_at ELSE excluded.enqueued_at END",
+                (int(user_id), time.time()))
+    except sqlite3.Error as e:
+        print(f"[WARN] summary enqueue failed: {e}")
+        return
+    _workers.wake()
+
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+
+def _claim():
+    """
+    生成中でない（か、期限切れの）一番古いジョブを取る（他のワーカー・プロセスと取り合わない）。
+    期限切れは取り出したプロセスが落ちた・固まったもの。生きている他プロセスの生成中ジョブには触らない
+    """
+    now = time.time()
+    with _db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT user_id, seq FROM summary_jobs "
+                           "WHERE running_seq IS NULL OR claimed_at IS NULL OR claimed_at < ? "
+                           "ORDER BY enqueued_at LIMIT 1", (now - LEASE_S,)).fetchone()
+        if row:
+            conn.execute("UPDATE summary_jobs SET running_seq = seq, claimed_at = ?, owner = ? WHERE user_id = ?",
+                         (now, _owner(), row[0]))
+        conn.execute("COMMIT")
+        return row
+
+
+def _finish(user_id: int, seq: int):
+    """
+    取り出した後に enqueue が無ければ消す。あれば生成待ちに戻す。
+    期限切れで他のワーカーが取り直していたら、その分には触らない
+    """
+    owner = _owner()
+    with _db() as conn:
+        conn.execute("DELETE FROM summary_jobs WHERE user_id = ? AND seq = ? AND owner = ?", (user_id, seq, owner))
+        conn.execute("UPDATE summary_jobs SET running_seq = NULL, claimed_at = NULL, owner = NULL "
+                     "WHERE user_id = ? AND owner = ?", (user_id, owner))
+
+
+def _generate(user_id: int):
+    from app.services.ai_eval import gen_session_feedback
+
+    # 直前の採点がまだ書き込み待ちなら待つ（load_tail に載せるため）
+    _attempts.flush(timeout=FLUSH_WAIT_S)
+    stats = _attempts.get_skill_stats(user_id)
+    version = history_version(stats)
+    if not version:
+        return
+    with _db() as conn:
+        if conn.execute("SELECT 1 FROM summaries WHERE user_id = ? AND version = ?",
+                        (user_id, version)).fetchone():
+            return
+    summary = gen_session_feedback(total_payload(_attempts.load_tail(user_id), stats), user_id=user_id)
+    if summary.get("mode"):
+        return  # 簡易評価は保存しない
+    with _db() as conn:
+        # 生成中に通算リセットされていたら（ジョブごと消えている）保存しない
+        if conn.execute("SELECT 1 FROM summary_jobs WHERE user_id = ?", (user_id,)).fetchone():
+            _store(conn, user_id, version, summary)
+
+
+class _SummaryWorkers:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+        self.done = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            # 前回のプロセスが生成中のまま終わったジョブは、期限（LEASE_S）が過ぎてから _claim が取り直す
+            for i in range(max(1, WORKERS)):
+                t = threading.Thread(target=self._run, name=f"cq-summary-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def wake(self):
+        self._ensure_started()
+        with self._cond:
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            try:
+                job = _claim()
+            except sqlite3.Error as e:
+                print(f"[WARN] summary job claim failed: {e}")
+                job = None
+            if job is None:
+                with self._cond:
+                    self._cond.wait(IDLE_POLL_S)
+                continue
+            user_id, seq = job
+            try:
+                _generate(user_id)
+                self.done += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"[WARN] summary job for user {user_id} failed: {e}")
+            try:
+                _finish(user_id, seq)
+            except sqlite3.Error as e:
+                print(f"[WARN] summary job finish failed: {e}")
+
+
+_workers = _SummaryWorkers()
+
+
+def stats() -> dict:
+    try:
+        with _db() as conn:
+            queued = conn.execute("SELECT COUNT(*) FROM summary_jobs").fetchone()[0]
+    except sqlite3.Error:
+        queued = None
+    return {"done": _workers.done, "failed": _workers.failed, "queued": queued}
+
+
+@_attempts.register_reset_hook
+def _on_reset(conn, user_id: int):
+    # 版が 0 から数え直しになるので、古い講評が同じ版で引かれないように消す
+    try:
+        with _db() as jc:
+            jc.execute("DELETE FROM summaries WHERE user_id = ?", (int(user_id),))
+            jc.execute("DELETE FROM summary_jobs WHERE user_id = ?", (int(user_id),))
+    except sqlite3.Error as e:
+        print(f"[WARN] summary reset failed: {e}")
@@ -0,0 +1,246 @@
+# app/services/walk.py
+# seen_ids を持たずに「同じ問題を二度出さない」ための、鍵付き疑似ランダム置換の歩行。
+#   - プール（スキル×ドメインの問題を登録順 ord に並べたもの）の位置 0..n-1 を、
+#     Feistel ネットワーク＋cycle-walking の置換で並べ替えて cursor 番目から順に出す
+#   - 状態はユーザー×スキル×ドメインごとに (seed, epoch, seg_start, seg_len, cursor) だけ（O(1)）。
+#     次の1問も置換を1回（平均4回未満の cycle-walk）計算するだけ
+#   - 1周（epoch）の中では完全に重複なし。プールを出し切ったら epoch を進めて別の置換で2周目
+#   - 問題が増えたとき: 登録順は既存分が変わらず末尾に足されるだけなので、今の区間（segment）を
+#     出し切った後、増えた範囲 [seg_start+seg_len, n) を新しい区間として同じ epoch のまま歩く
+#     （既存の並びは崩さない・新しい問題も周回を待たずに出る）
+#   - peek() は状態を変えない（先読み用）。表示した時点で commit() が cursor を進める
+import hashlib
+import secrets
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.services import auth
+
+ROUNDS = 4
+
+_tables = None
+_tables_lock = threading.Lock()
+_initialized = False
+_init_lock = threading.Lock()
+_lock = threading.Lock()
+_states: Dict[Tuple[int, str, str], dict] = {}
+
+
+# ---- 置換 ----
+
+def _round_keys(seed: int, epoch: int, seg_start: int) -> List[bytes]:
+    base = f"{seed}:{epoch}:{seg_start}".encode()
+    return [hashlib.blake2b(base + bytes([r]), digest_size=16).digest() for r in range(ROUNDS)]
+
+
+def _feistel(x: int, half_bits: int, keys: List[bytes]) -> int:
+    mask = (1 << half_bits) - 1
+    left, right = x >> half_bits, x & mask
+    for k in keys:
+        f = int.from_bytes(hashlib.blake2b(right.to_bytes(8, "little"), key=k, digest_size=8).digest(), "little")
+        left, right = right, left ^ (f & mask)
+    return (left << half_bits) | right
+
+
+def permute(i: int, n: int, keys: List[bytes]) -> int:
+    """[0, n) 上の全単射。2^(2h) >= n の Feistel 置換を、値が n 未満になるまで繰り返す（cycle-walking）"""
+    if n <= 1:
+        return 0
+    half = max(1, ((n - 1).bit_length() + 1) // 2)
+    x = i
+    while True:
+        x = _feistel(x, half, keys)
+        if x < n:
+            return x
+
+
+# ---- 状態遷移 ----
+
+def new_state(n: int, seed: Optional[int] = None) -> dict:
+    return {"seed": secrets.randbits(63) if seed is None else int(seed),
+            "epoch": 0, "seg_start": 0, "seg_len": n, "cursor": 0}
+
+
+def _step(st: dict, n: int, keys_cache: dict) -> Tuple[Optional[int], dict]:
+    """次の位置と、1つ進めた状態。区間の終わりでは新しい区間／epoch に切り替える"""
+    st = dict(st)
+    for _ in range(3):
+        if st["cursor"] < st["seg_len"]:
+            kk = (st["epoch"], st["seg_start"])
+            keys = keys_cache.get(kk)
+            if keys is None:
+                keys = keys_cache[kk] = _round_keys(st["seed"], st["epoch"], st["seg_start"])
+            pos = st["seg_start"] + permute(st["cursor"], st["seg_len"], keys)
+            st["cursor"] += 1
+            return (pos if pos < n else None), st  # プールが減っていたら欠番として飛ばす
+        end = st["seg_start"] + st["seg_len"]
+        if end < n:
+            st.update(seg_start=end, seg_len=n - end, cursor=0)         # 増えた分を同じ epoch で
+        else:
+            st.update(epoch=st["epoch"] + 1, seg_start=0, seg_len=n, cursor=0)  # 出し切った → 次の周
+        if n <= 0:
+            break
+    return None, st
+
+
+def peek(st: dict, pool: List, k: int, skip: Iterable[str] = ()) -> List:
+    """状態を変えずに、次の k 件（skip の ID は飛ばす）"""
+    n = len(pool)
+    if n <= 0 or k <= 0:
+        return []
+    skip = set(skip)
+    out, got = [], set()
+    cache: dict = {}
+    for _ in range(2 * n + k):  # 周回をまたいでも有限回で止める
+        pos, st = _step(st, n, cache)
+        if pos is None:
+            continue
+        q = pool[pos]
+        if q.id in skip or q.id in got:
+            continue
+        out.append(q)
+        got.add(q.id)
+        if len(out) >= k:
+            break
+    return out
+
+
+def commit(st: dict, pool: List, shown_ids: Iterable[str]) -> dict:
+    """表示した ID を、現在位置から連続している分だけ消費した状態を返す"""
+    n = len(pool)
+    shown = set(shown_ids)
+    cache: dict = {}
+    for _ in range(2 * n + len(shown)):
+        if not shown:
+            break
+        pos, nxt = _step(st, n, cache)
+        if pos is not None:
+            qid = pool[pos].id
+            if qid not in shown:
+                break
+            shown.discard(qid)  # 周の切れ目で同じ ID をもう一度消費しない
+        st = nxt
+    return st
+
+
+# ---- 永続化（users DB） ----
+
+def _get_tables():
+    global _tables
+    if _tables is None:
+        with _tables_lock:
+            if _tables is None:
+                from sqlalchemy import MetaData, Table, Column, Integer, BigInteger, String, DateTime
+                from sqlalchemy import PrimaryKeyConstraint
+
+                md = MetaData()
+                walk = Table(
+                    "walk_state", md,
+                    Column("user_id", Integer, nullable=False),
+                    Column("skill", String(64), nullable=False),
+                    Column("domain", String(64), nullable=False),
+                    Column("seed", BigInteger, nullable=False),
+                    Column("epoch", Integer, nullable=False, default=0),
+                    Column("seg_start", Integer, nullable=False, default=0),
+                    Column("seg_len", Integer, nullable=False),
+                    Column("cursor", Integer, nullable=False, default=0),
+                    Column("updated_at", DateTime),
+                    PrimaryKeyConstraint("user_id", "skill", "domain", name="pk_walk_state"),
+                )
+                _tables = {"metadata": md, "walk_state": walk}
+    return _tables
+
+
+def init_db():
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            _get_tables()["metadata"].create_all(auth.get_engine())
+            _initialized = True
+
+
+def _load(key) -> Optional[dict]:
+    from sqlalchemy import select
+
+    init_db()
+    t = _get_tables()["walk_state"]
+    with auth.get_engine().connect() as conn:
+        r = conn.execute(select(t).where(t.c.user_id == key[0], t.c.skill == key[1], t.c.domain == key[2])).first()
+    if r is None:
+        return None
+    m = r._mapping
+    return {k: m[k] for k in ("seed", "epoch", "seg_start", "seg_len", "cursor")}
+
+
+def _save(key, st: dict):
+    import datetime as dt
+
+    init_db()
+    t = _get_tables()["walk_state"]
+    row = {"user_id": key[0], "skill": key[1], "domain": key[2], **st, "updated_at": dt.datetime.utcnow()}
+    try:
+        with auth.get_engine().begin() as conn:
+            upd = (t.update()
+                   .where(t.c.user_id == key[0], t.c.skill == key[1], t.c.domain == key[2])
+                   .values(**{k: row[k] for k in ("seed", "epoch", "seg_start", "seg_len", "cursor", "updated_at")}))
+            if conn.execute(upd).rowcount == 0:
+                conn.execute(t.insert(), [row])
+    except Exception as e:
+        print(f"[WARN] walk state save failed: {e}")
+
+
+def get_state(user_id: int, skill: str, domain: str, n: int) -> dict:
+    """プロセス内キャッシュ → DB → 新規（乱数 seed）の順で状態を得る"""
+    key = (int(user_id), skill, domain)
+    with _lock:
+        st = _states.get(key)
+    if st is not None:
+        return st
+    try:
+        st = _load(key)
+    except Exception as e:
+        print(f"[WARN] walk state load failed: {e}")
+        st = None
+    if st is None:
+        st = new_state(n)
+    with _lock:
+        return _states.setdefault(key, st)
+
+
+def advance(user_id: int, skill: str, domain: str, pool: List, shown_ids: Iterable[str]) -> dict:
+    """表示したバッチで cursor を進め、永続化はバックグラウンドで行う"""
+    key = (int(user_id), skill, domain)
+    st = get_state(user_id, skill, domain, len(pool))
+    nxt = commit(st, pool, shown_ids)
+    if nxt != st:
+        with _lock:
+            _states[key] = nxt
+        try:
+            from app.services import background
+            background.submit(_save, key, nxt)
+        except Exception:
+            _save(key, nxt)
+    return nxt
+
+
+def token(user_id: int, skill: str, domain: str) -> Optional[tuple]:
+    """現在位置（先読みの鮮度チェック用）。まだ状態が無ければ None"""
+    with _lock:
+        st = _states.get((int(user_id), skill, domain))
+    return None if st is None else (st["seed"], st["epoch"], st["seg_start"], st["cursor"])
+
+
+def forget(user_id: int):
+    """通算リセット：このユーザーの歩行状態を消す（次回は新しい seed で最初から）"""
+    with _lock:
+        for key in [k for k in _states if k[0] == int(user_id)]:
+            del _states[key]
+    try:
+        init_db()
+        t = _get_tables()["walk_state"]
+        with auth.get_engine().begin() as conn:
+            conn.execute(t.delete().where(t.c.user_id == int(user_id)))
+    except Exception as e:
+        print(f"[WARN] walk state reset failed: {e}")
@@ -1,18 +1,71 @@
-import sys, os, re
+import sys, os, re, time
 from typing import List, Set
 from pathlib import Path
 import streamlit as st
-from streamlit_lottie import st_lottie
 import json
 
+_t_boot = time.perf_counter()
+
 # --- パス設定（app/ 下で services を import できるように） ---
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+# === 区間プロファイラ（?debug=1 のときサイドバーにウォーターフォール表示） ===
+try:
+    from app.services import profiler as _prof
+except Exception:
+    from services import profiler as _prof
+_prof.begin_run()
+
+# === メトリクス（CQ_METRICS_PORT / CQ_METRICS_FILE 指定時に Prometheus 形式で出力。初回だけ起動） ===
+try:
+    from app.services import metrics as _metrics
+except Exception:
+    from services import metrics as _metrics
+_metrics.start_exporters()
+
 # === services モジュール ===
-from services.db import load_questions
-from services.grader import grade_mcq, grade_sjt
-from services.ai_eval import eval_free_response  # 自由記述のAI評価
-from services.ai_eval import gen_session_feedback  # セッション講評生成
+# spec_eval / summary_jobs などは app.services.ai_eval を読むので、同じモジュール（LLM クライアント・
+# 評価プールが1つ）になるよう app.services を先に試す
+try:
+    from app.services.grader import grade_mcq, grade_sjt
+    from app.services.ai_eval import eval_free_responses, when_all_done  # 自由記述のAI評価（締め切り付き）
+    from app.services.ai_eval import EVAL_POLL_S, EVAL_UPGRADE_MAX_S
+    from app.services.ai_eval import gen_session_feedback  # セッション講評生成
+except ImportError:
+    from services.grader import grade_mcq, grade_sjt
+    from services.ai_eval import eval_free_responses, when_all_done
+    from services.ai_eval import EVAL_POLL_S, EVAL_UPGRADE_MAX_S
+    from services.ai_eval import gen_session_feedback
+
+
+# 出題選定（Streamlit 非依存）と出題回数の集計、無重複の歩行状態、次バッチ先読み用のバックグラウンド実行プール
+try:
+    from app.services import selector as _sel
+    from app.services import exposure as _exposure
+    from app.services import walk as _walk
+    from app.services import background as _bg
+except Exception:
+    from services import selector as _sel
+    from services import exposure as _exposure
+    from services import walk as _walk
+    from services import background as _bg
+
+# 採点結果の永続ログ（write-behind）と、能力推定（適応出題）、間違えた問題の復習スケジュール、
+# ユーザー全体の中での順位（スコア分布スケッチ）、通算講評・自由記述評価の先回り
+try:
+    from app.services import attempts as _attempts
+    from app.services import adaptive as _adaptive
+    from app.services import review as _review  # noqa: F401  import で採点時の復習スケジュール更新が有効になる
+    from app.services import percentile as _pct
+    from app.services import summary_jobs as _summary_jobs
+    from app.services import spec_eval as _spec_eval
+except Exception:
+    from services import attempts as _attempts
+    from services import adaptive as _adaptive
+    from services import review as _review  # noqa: F401
+    from services import percentile as _pct
+    from services import summary_jobs as _summary_jobs
+    from services import spec_eval as _spec_eval
 
 
 # === DBが無ければJSONLから自動作成するセットアップ ===
@@ -24,11 +77,14 @@ except Exception:
 
 try:
     # config がある構成
-    from app.services.config import DB_PATH, JSONL_PATH
+    from app.services.config import DB_PATH, JSONL_PATH, ensure_runtime_paths
 except Exception:
     # config が無い構成のフォールバック
     DB_PATH = Path("data/cq.db")
     JSONL_PATH = Path("data/questions.jsonl")
+
+    def ensure_runtime_paths():
+        Path(DB_PATH).parent.mkdir(parents=True, exist_ok=True)
 # === ユーザー認証（ログイン／登録） =========================================
 # services.auth を両対応インポート（account_id方式）
 try:
@@ -96,8 +152,11 @@ def require_user():
         st.stop()
     return st.session_state["user"]
 
+_prof.add_span("bootstrap", _t_boot)
+
 # ここでユーザー必須にする（下の本体ロジックは必ずログイン後に動く）
-_current_user = require_user()
+with _prof.span("auth"):
+    _current_user = require_user()
 USER_ID = _current_user["id"]                  # 数値ID
 USER_ACCOUNT = _current_user["account_id"]     # 文字列ユーザーID
 USER_NAME = _current_user.get("display_name") or USER_ACCOUNT
@@ -136,29 +195,16 @@ def dev_notice(msg: str):
     else:
         print(f"[DEV ONLY] {msg}")
    
-# --- Streamlit Cloud対応: data/cq.db を /tmp にコピー ---
-import shutil
-from pathlib import Path
-
-local_db = Path("data/cq.db")
-# --- Cloud用DBコピー（config側で処理済みのため、ここでは安全にスキップ） ---
-import os, shutil, tempfile
-from pathlib import Path
-
-# 既存の data/cq.db を基準に動作（ローカルでは /tmp を使わない）
-local_db = Path("data/cq.db")
-_tmpdir = Path(tempfile.gettempdir())
-
-# Linux（Streamlit Cloudなど）でのみコピーを試みる
-if os.name == "posix":
-    tmp_db = _tmpdir / "cq.db"
-    if (not tmp_db.exists()) and local_db.exists():
+def _reapply_calibration():
+    """作り直した cq.db に、項目分析で再推定した difficulty を戻す（集計が無ければ何もしない）"""
+    try:
         try:
-            shutil.copy(local_db, tmp_db)
-            print("✅ Copied DB to /tmp for Streamlit Cloud")
-        except Exception:
-            pass  # ⚠️ ローカルWindowsでは無視（ログ出さない）
-
+            from app.services import item_analysis as _ia  # numpy を読むので、再 import したときだけ
+        except ImportError:
+            from services import item_analysis as _ia
+        _ia.reapply()
+    except Exception as e:
+        print(f"[WARN] difficulty recalibration not reapplied: {e}")
 
 def _ensure_db():
     """
@@ -167,6 +213,9 @@ def _ensure_db():
     Streamlit Cloud など一時環境では DB が存在しないことがあるため、
     無くても常に安全に再生成できるようにしている。
     """
+    # Streamlit Cloud対応: ディレクトリ作成と data/cq.db → /tmp へのコピー（config 側、初回のみ）
+    ensure_runtime_paths()
+
     jsonl = Path(JSONL_PATH)
     db = Path(DB_PATH)
 
@@ -202,6 +251,7 @@ def _ensure_db():
             _imp.import_jsonl()
         else:
             raise RuntimeError("import_jsonl.py に run() も import_jsonl() も見つかりません。")
+        _reapply_calibration()
     else:
         # ✅ Cloud環境でDBが存在しないときの安全対策（暫定）
         # デプロイ直後に /tmp や data/ が空の場合、毎回JSONLから再生成する
@@ -211,10 +261,12 @@ def _ensure_db():
                     _imp.run(str(jsonl), str(db))
                 elif hasattr(_imp, "import_jsonl"):
                     _imp.import_jsonl()
+                _reapply_calibration()
         except Exception as e:
             print(f"[WARN] 強制再生成失敗: {e}")
 
-_ensure_db()
+with _prof.span("ensure_db"):
+    _ensure_db()
 
 
 # === セットアップここまで ===
@@ -242,6 +294,12 @@ except Exception:
 
 # ▼通算リセットボタン
 if st.button("🧹 通算をリセット", help="回をまたいだ講評履歴を消去します"):
+    try:
+        _attempts.reset_history(USER_ID)
+        _adaptive.forget(USER_ID)
+        _walk.forget(USER_ID)
+    except Exception as e:
+        print(f"[WARN] history reset failed: {e}")
     st.session_state.history_items = []
     st.success("通算データをリセットしました。")
 
@@ -276,6 +334,9 @@ def _render_session_summary(summary: dict | None):
         st.info("まだ通算データがありません。")
         return
 
+    if summary.get("mode"):
+        st.caption(f"⚡ {summary['mode']}：混雑のため AI の代わりに集計ルールで講評しています。")
+
     scores = summary.get("skill_scores", {}) or {}
     st.markdown("**スキル別スコア**")
     for k, v in scores.items():
@@ -308,24 +369,13 @@ def _render_session_summary(summary: dict | None):
             st.markdown(f"- {skill}（{level}）｜{tags} — {why}")
 
 
-def domain_tagset(domain_label: str) -> Set[str]:
-    """ドメイン選択に応じた優先タグ集合"""
-    if domain_label == "ビジネス":
-        return {"business", "workplace", "meeting", "team", "office", "review", "deadline", "decision"}
-    else:  # 日常
-        return {"daily", "日常", "friend", "family", "生活", "home", "communication"}
-
-def filter_by_domain_strict(qs, domain_label: str) -> List:
-    """タグ一致のみ採用（越境補充なし）"""
-    pref = domain_tagset(domain_label)
-    return [q for q in qs if any(t in pref for t in (q.tags or []))]
+# domain_tagset / filter_by_domain_strict は services.selector 側に移動（先読みスレッドと共用）
+domain_tagset = _sel.domain_tagset
+filter_by_domain_strict = _sel.filter_by_domain_strict
 
 
-def render_prompt_block(text: str):
-    """会話や長文を読みやすく描画（引用＋改行維持、A:/B:の前に空行）"""
-    if not text:
-        return
-
+def prompt_markdown(text: str) -> str:
+    """設問本文を引用ブロックの Markdown に整形（A:/B:の前に空行、改行維持）"""
     # 「 A:」「 B:」「 C:」の直前に空行を入れる（文頭/直後どちらでも機能）
     text = re.sub(r'\s+A:', '\n\nA:', text)
     text = re.sub(r'\s+B:', '\n\nB:', text)
@@ -333,7 +383,16 @@ def render_prompt_block(text: str):
 
     # Markdown改行維持（行末半角スペース2つ）
     lines = [ln.rstrip() + "  " for ln in text.split("\n")]
-    body = "\n".join([f"> {ln}" if ln else ">" for ln in lines])
+    return "\n".join([f"> {ln}" if ln else ">" for ln in lines])
+
+
+def render_prompt_block(text: str, body: str | None = None):
+    """会話や長文を読みやすく描画（body があれば整形済み Markdown をそのまま使う）"""
+    if not text:
+        return
+
+    if body is None:
+        body = prompt_markdown(text)
 
     with st.container(border=True):
         st.markdown("#### 🗣️ 設問（本文）")
@@ -389,6 +448,7 @@ def show_praise_card(correct_count: int, total_count: int):
         st.write(msg)
         data = _LOTTIE.get(key)
         if data:
+            from streamlit_lottie import st_lottie  # 初回表示時にだけ読み込む
             st_lottie(data, height=160, key=f"lottie_{key}")
         else:
             st.caption("（アニメ素材が見つかりません）")
@@ -434,8 +494,17 @@ if "batch_no" not in st.session_state:
 if "_last_loaded_batch_no" not in st.session_state:
     st.session_state._last_loaded_batch_no = -1
 # 回を跨いだ通算の履歴（各問の成績をここに貯める）
+# メモリ上は直近 HISTORY_TAIL 件だけ保持し、全件は attempts テーブルに永続化する
 if "history_items" not in st.session_state:
     st.session_state.history_items = []
+# ログイン（ユーザー切替）時は永続ログの直近分からセッションを復元
+if st.session_state.get("_history_user") != USER_ID:
+    try:
+        st.session_state.history_items = _attempts.load_tail(USER_ID)
+    except Exception as e:
+        print(f"[WARN] history restore failed: {e}")
+        st.session_state.history_items = []
+    st.session_state._history_user = USER_ID
 # --- 採点状態フラグと講評の一時保持 ---
 if "_graded" not in st.session_state:
     st.session_state._graded = False
@@ -443,38 +512,27 @@ if "_ai_summary" not in st.session_state:
     st.session_state._ai_summary = None
 if "_ai_summary_total" not in st.session_state:
     st.session_state._ai_summary_total = None
+if "_grade_view" not in st.session_state:
+    st.session_state._grade_view = None
+# 次バッチの先読み（{"key": (skill, domain, batch_no), "future": Future}）と整形済み本文
+if "_prefetch" not in st.session_state:
+    st.session_state._prefetch = None
+if "_prompt_md" not in st.session_state:
+    st.session_state._prompt_md = {}
 
 # -------------------------------
 # バッチ取得
 # -------------------------------
-def get_new_batch(_skill: str, _domain: str, want: int = 2):
-    """
-    指定スキル／ドメインから未出題の問題を最大 want 件返す。
-    在庫不足時はユーザー向けUIには出さず、開発者向けに dev_notice だけ出す。
-    """
-    is_sjt = (_skill == "状況判断")
-    picked = []
-
-    # 多めに取得 → タイプで絞る
-    candidates = load_questions(skill_filter=_skill, limit=200)
-    if is_sjt:
-        candidates = [q for q in candidates if q.type == "sjt"]
+def _mark_shown(picked, _skill: str, _domain: str, want: int):
+    """表示するバッチを出題済みに登録（在庫不足は DEV だけ通知）"""
+    if _sel.SELECT_MODE == "walk":
+        # seen_ids は持たず、ユーザーごとの歩行位置を進める（永続化は裏で）
+        _sel.mark_shown(_skill, _domain, [q.id for q in picked], USER_ID)
     else:
-        candidates = [q for q in candidates if q.type != "sjt"]
-
-    # ドメイン厳格フィルタ（越境補充なし）
-    domain_candidates = filter_by_domain_strict(candidates, _domain)
-
-
-    # 未出題のみを pick
-    seen = st.session_state.get("seen_ids", set())
-    for q in domain_candidates:
-        if len(picked) >= want:
-            break
-        if q.id not in seen:
-            picked.append(q)
-            seen.add(q.id)
-    st.session_state["seen_ids"] = seen
+        seen = st.session_state.get("seen_ids", set())
+        seen.update(q.id for q in picked)
+        st.session_state["seen_ids"] = seen
+    _exposure.record(q.id for q in picked)  # メモリに数えるだけ（DB へはまとめて書く）
 
     # 在庫不足は DEV だけ通知（UIには出さない）
     if len(picked) < want:
@@ -483,8 +541,74 @@ def get_new_batch(_skill: str, _domain: str, want: int = 2):
             " data/questions.jsonl に追加して import してください。"
         )
 
+@_prof.profiled("get_new_batch")
+def get_new_batch(_skill: str, _domain: str, want: int = 2):
+    """
+    指定スキル／ドメインから未出題の問題を最大 want 件返す。
+    在庫不足時はユーザー向けUIには出さず、開発者向けに dev_notice だけ出す。
+    """
+    # 期限の来た復習は出題済みでも出す。ただし直前のバッチ（採点の永続化が未完了かもしれない）は避ける
+    avoid = {q.id for q in st.session_state.get("fixed_questions") or []}
+    picked = _sel.pick_batch(_skill, _domain, want=want, exclude=st.session_state.get("seen_ids", set()),
+                             user_id=USER_ID, avoid=avoid)
+    _mark_shown(picked, _skill, _domain, want)
     return picked
 
+# -------------------------------
+# 次バッチの先読み
+#   表示中バッチの直後に、同じスキル／ドメインの次バッチを裏で選定＋本文整形しておく。
+#   予約した ID は「差し替えて表示した時点」で初めて seen_ids に入れる。
+# -------------------------------
+def _materialize_batch(_skill: str, _domain: str, want: int, exclude: frozenset, user_id: int,
+                       avoid: frozenset):
+    """（バックグラウンドスレッド）次バッチを選定し、設問本文の Markdown まで作る"""
+    qs = _sel.pick_batch(_skill, _domain, want=want, exclude=exclude, user_id=user_id, avoid=avoid)
+    return qs, {q.id: prompt_markdown(q.prompt) for q in qs if q.prompt}
+
+def _drop_prefetch():
+    pf = st.session_state.get("_prefetch")
+    if pf:
+        pf["future"].cancel()
+    st.session_state._prefetch = None
+
+def _start_prefetch(_skill: str, _domain: str, next_batch_no: int, want: int = 2):
+    key = (_skill, _domain, next_batch_no)
+    pf = st.session_state.get("_prefetch")
+    if pf and pf["key"] == key:
+        return
+    _drop_prefetch()
+    exclude = frozenset(st.session_state.get("seen_ids", set()))  # 表示中バッチも含む
+    avoid = frozenset(q.id for q in st.session_state.get("fixed_questions") or [])
+    st.session_state._prefetch = {
+        "key": key,
+        "exclude": exclude,
+        "walk": _sel.walk_token(_skill, _domain, USER_ID),
+        "future": _bg.submit(_materialize_batch, _skill, _domain, want, exclude, USER_ID, avoid),
+    }
+
+def _take_prefetched(_skill: str, _domain: str, batch_no: int):
+    """先読み結果が今回のバッチに使えれば (questions, prompt_md) を返す。使えなければ None"""
+    pf = st.session_state.get("_prefetch")
+    st.session_state._prefetch = None
+    if not pf:
+        return None
+    if pf["key"] != (_skill, _domain, batch_no):
+        pf["future"].cancel()
+        return None
+    try:
+        qs, md = pf["future"].result()
+    except Exception as e:
+        print(f"[WARN] prefetch failed: {e}")
+        return None
+    # 予約後に出題済みになったものがあれば同期取得にフォールバック
+    # （復習は予約前から seen_ids に入っているので、予約後に増えた分だけを見る）
+    newly_seen = st.session_state.get("seen_ids", set()) - pf["exclude"]
+    if any(q.id in newly_seen for q in qs):
+        return None
+    if pf.get("walk") != _sel.walk_token(_skill, _domain, USER_ID):
+        return None  # walk モード：予約後に歩行位置が動いた
+    return qs, md
+
 
 # スキル or ドメイン変更検知
 if (st.session_state.current_skill != skill) or (st.session_state.current_domain != domain):
@@ -493,18 +617,26 @@ if (st.session_state.current_skill != skill) or (st.session_state.current_domain
     st.session_state.seen_ids = set()
     st.session_state.batch_no = 0
     st.session_state._last_loaded_batch_no = -1
+    _drop_prefetch()  # 旧スキル／ドメインの先読みは破棄（予約IDは seen_ids に入っていない）
     clear_answer_widgets()
 
 # バッチロード
 if st.session_state._last_loaded_batch_no != st.session_state.batch_no:
     clear_answer_widgets()
-    qs = get_new_batch(skill, domain, want=2)
+    taken = _take_prefetched(skill, domain, st.session_state.batch_no)
+    if taken:
+        qs, prompt_md = taken
+        _mark_shown(qs, skill, domain, want=2)
+    else:
+        qs, prompt_md = get_new_batch(skill, domain, want=2), {}
     st.session_state.fixed_questions = qs
+    st.session_state._prompt_md = prompt_md
     st.session_state._last_loaded_batch_no = st.session_state.batch_no
-# 新しいバッチに切り替わったので採点状態と講評をリセット
-st.session_state._graded = False
-st.session_state._ai_summary = None
-st.session_state._ai_summary_total = None
+    # 新しいバッチに切り替わったので採点状態と講評をリセット
+    st.session_state._graded = False
+    st.session_state._grade_view = None
+    st.session_state._ai_summary = None
+    st.session_state._ai_summary_total = None
 
 questions = st.session_state.fixed_questions
 
@@ -515,323 +647,456 @@ if not questions:
     st.stop()
 
 
+# 表示が確定したので、次バッチを裏で用意しておく（「次の問題」押下時は差し替えるだけ）
+_start_prefetch(skill, domain, st.session_state.batch_no + 1)
+
 st.divider()
 st.subheader(f"出題：{domain} × {skill}（{len(questions)}問）")
 
+is_sjt_mode = (skill == "状況判断")
+
+# ======================================================================
+# 以下の3ブロックは st.fragment 単位で再実行される。
+#   - 出題（_question_fragment）: ラジオ／自由記述の操作はこのブロックだけ再実行
+#   - 採点（_grading_fragment）  : 回答は session_state の q_* / free_* から読む
+#   - 通算（_summary_fragment）   : 通算スコアとAI講評ボタン
+# ブロック間の受け渡しは session_state のみ（_graded / _grade_view / history_items /
+# _ai_summary_total）。採点で通算が変わるときだけアプリ全体を再実行する。
+# ======================================================================
+
+def _record_history(session_items: list, persist: bool = True):
+    """通算履歴に追加（永続化はキューに積むだけで待たない。メモリ側は直近分に切り詰め）"""
+    if not session_items:
+        return
+    if persist:
+        try:
+            _attempts.enqueue(USER_ID, session_items)
+        except Exception as e:
+            print(f"[WARN] attempts enqueue failed: {e}")
+        _summary_jobs.enqueue(USER_ID)  # 通算講評を裏で作り始める（ボタン押下時に出来上がっているように）
+    hist = st.session_state.history_items
+    hist.extend(session_items)
+    if len(hist) > _attempts.HISTORY_TAIL:
+        del hist[:-_attempts.HISTORY_TAIL]
+
+def _collect_answers(qs) -> List:
+    return [st.session_state.get(f"q_{q.id}") for q in qs]
+
+def _speculate_free(uid, qid, prompt):
+    """自由記述の入力が確定したら（フォーカスが外れたら）裏で評価を始めておく"""
+    _spec_eval.speculate(uid, qid, prompt, st.session_state.get(f"free_{qid}") or "")
+
 # -------------------------------
 # 出題UI
 # -------------------------------
-answers = []
-for i, q in enumerate(questions, start=1):
-    st.markdown(f"**Q{i}.**")
-    render_prompt_block(q.prompt)
-
-    opts = ["A", "B", "C", "D"][:len(q.choices) if q.choices else 0]
-
-    def fmt(k):
-        if q.choices and "ABCD".find(k) != -1 and "ABCD".index(k) < len(q.choices):
-            return f"{k}: {q.choices['ABCD'.index(k)]}"
-        return k
-
-    key = st.radio(
-        "選択肢",
-        options=opts,
-        format_func=fmt,
-        index=None,
-        horizontal=False,
-        key=f"q_{q.id}"
-    )
-    answers.append(key)
-
-    if skill == "状況判断":
-        st.text_area(
-            "自由記述（任意）: あなたならどう対応しますか？",
-            key=f"free_{q.id}",
-            placeholder="例）先方へ初動の方針と目安時間を即共有し、再現条件を確認します…",
-            height=110
+@st.fragment
+def _question_fragment(qs, sjt_mode: bool):
+    for i, q in enumerate(qs, start=1):
+        st.markdown(f"**Q{i}.**")
+        render_prompt_block(q.prompt, body=st.session_state.get("_prompt_md", {}).get(q.id))
+
+        opts = ["A", "B", "C", "D"][:len(q.choices) if q.choices else 0]
+
+        def fmt(k, q=q):
+            if q.choices and "ABCD".find(k) != -1 and "ABCD".index(k) < len(q.choices):
+                return f"{k}: {q.choices['ABCD'.index(k)]}"
+            return k
+
+        st.radio(
+            "選択肢",
+            options=opts,
+            format_func=fmt,
+            index=None,
+            horizontal=False,
+            key=f"q_{q.id}"
         )
 
-    st.markdown("---")
+        if sjt_mode:
+            st.text_area(
+                "自由記述（任意）: あなたならどう対応しますか？",
+                key=f"free_{q.id}",
+                placeholder="例）先方へ初動の方針と目安時間を即共有し、再現条件を確認します…",
+                height=110,
+                on_change=_speculate_free,
+                args=(USER_ID, q.id, q.prompt),
+            )
+
+        st.markdown("---")
+
+_question_fragment(questions, is_sjt_mode)
 
 # -------------------------------
 # 採点／フィードバック
 # -------------------------------
-is_sjt_mode = (skill == "状況判断")
-
-if is_sjt_mode:
-    if st.session_state.get("_graded", False):
-        st.info("このバッチは採点済みです。下部の「次の問題を解く（2問）」で新バッチに進めます。")
-    elif st.button("フィードバックを見る", type="primary", use_container_width=True):
-
-        feedbacks = grade_sjt(questions, answers)
-        for i, (q, fb) in enumerate(zip(questions, feedbacks), start=1):
-            st.markdown(f"### Q{i}")
-            with st.container(border=True):
-                st.markdown("**シナリオ（再掲）**")
-                render_prompt_block(q.prompt)
-            st.markdown(f"**あなたの選択:** 🟢 {fb['chosen'] or '—'}")
-            st.markdown("#### 各選択肢の解説")
-            for key in ["A", "B", "C", "D"]:
-                if q.feedbacks and key in q.feedbacks:
-                    fbt = q.feedbacks[key]
-                    line = f"{key}: {fbt.get('type','—')} — {fbt.get('desc','—')}"
-                    if fb["chosen"] == key:
-                        st.markdown(f"**👉 {line}**")
-                    else:
-                        st.markdown(line)
-            user_free = (st.session_state.get(f"free_{q.id}") or "").strip()
-            if user_free:
-                ai = eval_free_response(q.prompt, user_free)
-                st.markdown("#### 自由記述へのAIフィードバック")
-                st.markdown(f"**あなたの回答:**\n> {user_free}")
-                st.write(f"- スコア: {ai.get('score_total', 0)} / 100")
-                subs = ai.get("subscores", {}) or {}
-                st.write(
-                    f"- 文脈適合度: {subs.get('context_fit', 0)} / "
-                    f"対人配慮: {subs.get('interpersonal_sensitivity', 0)} / "
-                    f"明瞭さ: {subs.get('clarity', 0)}"
+def _grade_sjt_batch(qs, answers) -> dict:
+    """SJT の採点＋自由記述評価を行い、表示用ビューを返す（通算履歴にも追加）"""
+    feedbacks = grade_sjt(qs, answers)
+
+    # 自由記述の評価（表示用と集計用で使い回し — 二重評価しない）
+    # 締め切りに間に合わなかったものは暫定評価（ルールベース）。本評価は pending で後から届く
+    free_items = {}
+    for q in qs:
+        user_free = (st.session_state.get(f"free_{q.id}") or "").strip()
+        if user_free:
+            free_items[q.id] = (q.prompt, user_free)
+    free_ai, pending = eval_free_responses(free_items, user_id=USER_ID)
+
+    session_items = []
+    for q, fb in zip(qs, feedbacks):
+        # 自由記述スコア（0..1）
+        ai = free_ai.get(q.id)
+        free_score01 = ai.get("score_total", 0) / 100.0 if ai else 0.0
+
+        # skill 正規化（全角/半角スペース除去）
+        skill_norm = (q.skill or "").replace(" ", "").replace("　", "")
+
+        # 望ましい選択 best（answer_key 優先、なければ feedbacks の type を参照）
+        best_key = getattr(q, "answer_key", None)
+        if not best_key and getattr(q, "feedbacks", None):
+            try:
+                best_key = next(
+                    (k for k, v in q.feedbacks.items() if (v or {}).get("type") in ("best", "good")),
+                    None
                 )
-                st.write(f"- 要点指摘: {ai.get('short_feedback', '—')}")
-                st.write(f"- 次ドリル: {ai.get('next_drill', '—')}")
-            st.markdown("---")
-        st.info("※ 状況判断は正誤を出さず、各選択肢の解説と自由記述AI評価を提示します。")
-
-        # ===== セッション講評（AI：状況判断） =====
-        from services.ai_eval import gen_session_feedback
+            except Exception:
+                best_key = None
+
+        # 未判定（best/chosen が無い）を 0 点計上せずスキップ
+        #    ※ 自由記述があれば free_score01 だけで反映する
+        item = {
+            "id": q.id,
+            "type": q.type,          # "sjt"
+            "skill": skill_norm,
+            "tags": q.tags or [],
+            "free_score01": free_score01,
+            "chosen": fb.get("chosen"),
+            "best": best_key,
+        }
+        if (item["best"] is None or item["chosen"] is None) and free_score01 == 0.0:
+            # 選択評価も自由記述も無い → 平均を歪めるので除外
+            continue
 
-        # ① 自由記述の評価キャッシュ（表示用と集計用で使い回し）
-        _free_cache: dict[str, dict] = {}
-
-        session_items = []
-        for q, fb in zip(questions, feedbacks):
-            # 自由記述スコア（0..1）— 二重評価を避ける
-            user_free = (st.session_state.get(f"free_{q.id}") or "").strip()
-            free_score01 = 0.0
-            if user_free:
-                ai = _free_cache.get(q.id)
-                if not ai:
-                    ai = eval_free_response(q.prompt, user_free)
-                    _free_cache[q.id] = ai
-                free_score01 = ai.get("score_total", 0) / 100.0
-
-            # skill 正規化（全角/半角スペース除去）
-            skill_norm = (q.skill or "").replace(" ", "").replace("　", "")
-
-            # 望ましい選択 best（answer_key 優先、なければ feedbacks の type を参照）
-            best_key = getattr(q, "answer_key", None)
-            if not best_key and getattr(q, "feedbacks", None):
-                try:
-                    best_key = next(
-                        (k for k, v in q.feedbacks.items() if (v or {}).get("type") in ("best", "good")),
-                        None
-                    )
-                except Exception:
-                    best_key = None
-
-            # ② 未判定（best/chosen が無い）を 0 点計上せずスキップ
-            #    ※ 自由記述があれば free_score01 だけで反映する
-            item = {
-                "id": q.id,
-                "type": q.type,          # "sjt"
-                "skill": skill_norm,
-                "tags": q.tags or [],
-                "free_score01": free_score01,
-                "chosen": fb.get("chosen"),
-                "best": best_key,
-            }
-            if (item["best"] is None or item["chosen"] is None) and free_score01 == 0.0:
-                # 選択評価も自由記述も無い → 平均を歪めるので除外
-                continue
-
-            session_items.append(item)
-        st.session_state.history_items.extend(session_items)
+        session_items.append(item)
 
+    if DEBUG_DEV:
         print("DEBUG session_items:", session_items)
-        summary = gen_session_feedback(session_items)
-# 採点完了フラグとAI講評キャッシュを更新（SJT）
-        st.session_state._graded = True
-        st.session_state._ai_summary = summary
-        st.session_state._ai_summary_total = None
-
-        # ③ JSON“そのまま出力”ではなく、箇条書きでレンダリング
-        def _render_session_summary(summary: dict):
-            scores = summary.get("skill_scores", {}) or {}
-            st.markdown("**スキル別スコア**")
-            for k, v in scores.items():
-                try:
-                    st.markdown(f"- {k}: {float(v):.2f}")
-                except Exception:
-                    st.markdown(f"- {k}: {v}")
-
-            def _bullets(title, key):
-                items = summary.get(key) or []
-                if not items:
-                    return
-                st.markdown(f"**{title}**")
-                for x in items:
-                    st.markdown(f"- {x}")
-
-            _bullets("特徴", "traits")
-            _bullets("強み", "strengths")
-            _bullets("弱み", "weaknesses")
-            _bullets("次アクション", "next_actions")
-
-            recs = summary.get("recommended_drills") or []
-            if recs:
-                st.markdown("**おすすめドリル**")
-                for d in recs:
-                    skill = d.get("skill", "")
-                    level = d.get("level", "")
-                    tags  = ", ".join(d.get("tags") or [])
-                    why   = d.get("why", "")
-                    st.markdown(f"- {skill}（{level}）｜{tags} — {why}")
-
-# （SJT専用）採点後のみAI講評ボタンを表示（デフォ表示防止＆二重表示防止）
-if is_sjt_mode and st.session_state.get("_graded", False) and st.session_state.get("history_items"):
-    if st.button("🧠 AI講評を見る", type="secondary", use_container_width=True, key=f"ai_summary_btn_sjt_{st.session_state.batch_no}"):
-
-        # ✅ 通算のみ表示（セッション講評は出さない）
-        total_payload = {"session_items": st.session_state.history_items}
-        summary_total = gen_session_feedback(total_payload)
-        st.session_state._ai_summary_total = summary_total
-        with st.expander("🧠 AI講評（通算）", expanded=True):
-            _render_session_summary(summary_total)
-
-
-
-
-
-
-
+    if pending:
+        # 暫定を含むバッチ：メモリ上の履歴には今載せ、永続化は本評価で差し替えてから（画面を離れても行う）。
+        # バッチ講評は画面に出していないので、暫定のときは生成を待たない
+        _record_history(session_items, persist=False)
+        when_all_done(pending, lambda finals, uid=USER_ID, items=session_items: _apply_final_evals(uid, items, finals))
+        return {"kind": "sjt", "feedbacks": feedbacks, "free_ai": free_ai, "pending": pending,
+                "pending_since": time.monotonic()}
+    _record_history(session_items)
+    st.session_state._ai_summary = gen_session_feedback(session_items, user_id=USER_ID)
+    return {"kind": "sjt", "feedbacks": feedbacks, "free_ai": free_ai}
+
+def _apply_final_evals(user_id: int, session_items: list, finals: dict):
+    """（裏スレッド）本評価で free_score01 を差し替えてから attempts に積む。st.* には触らない"""
+    for item in session_items:
+        ai = finals.get(item["id"])
+        if ai:
+            item["free_score01"] = ai.get("score_total", 0) / 100.0
+    try:
+        _attempts.enqueue(user_id, session_items)
+    except Exception as e:
+        print(f"[WARN] attempts enqueue failed: {e}")
+    _summary_jobs.enqueue(user_id)
+
+def _swap_finished_evals(view: dict):
+    """届いた本評価を暫定と差し替える（描画の前に呼ぶ）。待ちすぎたものは暫定のまま諦める"""
+    pending = view.get("pending") or {}
+    for k in [k for k, f in pending.items() if f.done()]:
+        view["free_ai"][k] = pending.pop(k).result()
+    if pending and time.monotonic() - view.get("pending_since", 0) > EVAL_UPGRADE_MAX_S:
+        pending.clear()  # 記録のほうは本評価が届いた時点で差し替わる
+
+@st.fragment(run_every=EVAL_POLL_S)
+def _pending_eval_fragment():
+    """暫定評価の本評価の到着を見張る。届いていたら採点表示ごと描き直す"""
+    view = st.session_state.get("_grade_view") or {}
+    pending = view.get("pending") or {}
+    if not pending:
+        return
+    # 採点表示から呼ばれたとき（描画の途中）は rerun しない。ボタン操作の再実行を打ち切ってしまうため
+    inline = view.pop("_inline", False)
+    expired = time.monotonic() - view.get("pending_since", 0) > EVAL_UPGRADE_MAX_S
+    if not inline and (expired or any(f.done() for f in pending.values())):
+        st.rerun()
+    st.caption("⏳ AI の評価を待っています。届いたら差し替えます。")
+
+def _render_sjt_view(qs, view: dict):
+    for i, (q, fb) in enumerate(zip(qs, view["feedbacks"]), start=1):
+        st.markdown(f"### Q{i}")
+        with st.container(border=True):
+            st.markdown("**シナリオ（再掲）**")
+            render_prompt_block(q.prompt)
+        st.markdown(f"**あなたの選択:** 🟢 {fb['chosen'] or '—'}")
+        st.markdown("#### 各選択肢の解説")
+        for key in ["A", "B", "C", "D"]:
+            if q.feedbacks and key in q.feedbacks:
+                fbt = q.feedbacks[key]
+                line = f"{key}: {fbt.get('type','—')} — {fbt.get('desc','—')}"
+                if fb["chosen"] == key:
+                    st.markdown(f"**👉 {line}**")
+                else:
+                    st.markdown(line)
+        ai = view["free_ai"].get(q.id)
+        if ai:
+            user_free = (st.session_state.get(f"free_{q.id}") or "").strip()
+            st.markdown("#### 自由記述へのAIフィードバック" + (f"（{ai['mode']}）" if ai.get("mode") else ""))
+            st.markdown(f"**あなたの回答:**\n> {user_free}")
+            st.write(f"- スコア: {ai.get('score_total', 0)} / 100")
+            subs = ai.get("subscores", {}) or {}
+            st.write(
+                f"- 文脈適合度: {subs.get('context_fit', 0)} / "
+                f"対人配慮: {subs.get('interpersonal_sensitivity', 0)} / "
+                f"明瞭さ: {subs.get('clarity', 0)}"
+            )
+            st.write(f"- 要点指摘: {ai.get('short_feedback', '—')}")
+            st.write(f"- 次ドリル: {ai.get('next_drill', '—')}")
+        st.markdown("---")
+    st.info("※ 状況判断は正誤を出さず、各選択肢の解説と自由記述AI評価を提示します。")
+
+def _grade_mcq_batch(qs, answers) -> dict:
+    """MCQ を採点し、表示用ビューを返す（通算履歴にも追加）"""
+    from collections import defaultdict
+
+    results, correct, total = grade_mcq(qs, answers)
+
+    # ① 今バッチの成績だけで、0/1 の厳密平均を作る（未回答は除外）
+    session_items = []
+    per_skill_correct = defaultdict(int)
+    per_skill_total   = defaultdict(int)
+
+    for r, q in zip(results, qs):
+        skill_norm = (q.skill or "").replace(" ", "").replace("　", "")
+
+        # 未回答は除外（平均を歪めない）
+        if r.is_correct is None and not r.chosen:
+            continue
+
+        # 0/1カウント（MCQのみ）
+        if r.is_correct is True:
+            per_skill_correct[skill_norm] += 1
+            per_skill_total[skill_norm]   += 1
+        elif r.is_correct is False:
+            per_skill_total[skill_norm]   += 1
+
+        session_items.append({
+            "id": q.id,
+            "type": q.type,          # "mcq"
+            "skill": skill_norm,
+            "difficulty": q.difficulty,
+            "tags": q.tags or [],
+            "correct": r.is_correct,
+            "chosen": r.chosen,
+            "answer_key": r.correct_key
+        })
+
+    # ② スキル別の正解率（0..1）を事前計算して LLM に手渡す
+    pre_skill_scores = {}
+    for sk, tot in per_skill_total.items():
+        if tot > 0:
+            pre_skill_scores[sk] = round(per_skill_correct[sk] / tot, 2)
+
+    # ③ 正解数/全問数も渡す（未回答は全問数に含めない）
+    correct_count = sum(1 for r in results if r.is_correct is True)
+    total_count   = len([r for r in results if r.is_correct is not None])
+
+    payload = {
+        "session_items": session_items,
+        "meta": {
+            "correct": correct_count,
+            "total": total_count,
+            "pre_skill_scores": pre_skill_scores,   # ←これを尊重させる
+        }
+    }
+    st.session_state._last_payload = payload  # ← AI講評ボタン用に保持
 
+    # 能力推定を更新（各 item に ability / ability_after が付き、attempts に残る）。
+    # 先読み済みの次バッチは更新前の推定で選んでいるので捨てる
+    try:
+        _adaptive.record(USER_ID, session_items)
+    except Exception as e:
+        print(f"[WARN] ability update failed: {e}")
+    _drop_prefetch()
+    _record_history(session_items)
 
-if not is_sjt_mode:
-    if st.session_state.get("_graded", False):
-        st.info("このバッチは採点済みです。下部の「次の問題を解く（2問）」で新バッチに進めます。")
-    elif st.button("採点する", type="primary", use_container_width=True):
+    if DEBUG_DEV:
+        print("DEBUG session_items:", session_items)
+        print("DEBUG meta:", payload["meta"])
+    return {"kind": "mcq", "results": results, "correct": correct, "total": total}
+
+def _render_mcq_view(qs, view: dict):
+    results, correct, total = view["results"], view["correct"], view["total"]
+    st.success(f"スコア：{correct} / {total}（{round(100 * correct / total)} 点）")
+    show_praise_card(correct, total)
+
+    with st.expander("各問の解説・正答"):
+        for i, r in enumerate(results, start=1):
+            st.markdown(
+                f"**Q{i}**：{'✅ 正解' if r.is_correct else ('❌ 不正解' if r.is_correct is not None else '— 未回答')}"
+            )
+            st.write(f"- あなたの選択: {r.chosen or '—'}")
+            st.write(f"- 正答: {r.correct_key or '—'}")
+            q = qs[i - 1]
+            st.markdown("**解説（選択肢別）**")
+            ex_dict = q.explanations or {}
+            rendered_any = False
+            for key in ["A", "B", "C", "D"]:
+                if key in ex_dict and ex_dict[key]:
+                    line = f"{key}: {ex_dict[key]}"
+                    if key == (r.correct_key or ""):
+                        st.markdown(f"**👉 {line}**")
+                    else:
+                        st.markdown(line)
+                    rendered_any = True
+            if not rendered_any:
+                st.write("（この問題には解説が登録されていません）")
+            st.markdown("---")
 
- 
-        results, correct, total = grade_mcq(questions, answers)
-        st.success(f"スコア：{correct} / {total}（{round(100 * correct / total)} 点）")
-        show_praise_card(correct, total)
+@st.fragment
+def _grading_fragment(qs, sjt_mode: bool):
+    label = "フィードバックを見る" if sjt_mode else "採点する"
+    if not st.session_state.get("_graded", False):
+        if st.button(label, type="primary", use_container_width=True):
+            answers = _collect_answers(qs)
+            with _prof.span("grading"):
+                if sjt_mode:
+                    view = _grade_sjt_batch(qs, answers)
+                else:
+                    view = _grade_mcq_batch(qs, answers)
+            # 採点完了フラグとビューを保持（以降の再実行でも結果を表示し続ける）
+            st.session_state._graded = True
+            st.session_state._grade_view = view
+            st.session_state._ai_summary_total = None
+            # 通算（別フラグメント）に反映するため、ここだけアプリ全体を再実行
+            st.rerun()
+        return
 
-        with st.expander("各問の解説・正答"):
-            for i, r in enumerate(results, start=1):
-                st.markdown(
-                    f"**Q{i}**：{'✅ 正解' if r.is_correct else ('❌ 不正解' if r.is_correct is not None else '— 未回答')}"
-                )
-                st.write(f"- あなたの選択: {r.chosen or '—'}")
-                st.write(f"- 正答: {r.correct_key or '—'}")
-                q = questions[i - 1]
-                st.markdown("**解説（選択肢別）**")
-                ex_dict = q.explanations or {}
-                rendered_any = False
-                for key in ["A", "B", "C", "D"]:
-                    if key in ex_dict and ex_dict[key]:
-                        line = f"{key}: {ex_dict[key]}"
-                        if key == (r.correct_key or ""):
-                            st.markdown(f"**👉 {line}**")
-                        else:
-                            st.markdown(line)
-                        rendered_any = True
-                if not rendered_any:
-                    st.write("（この問題には解説が登録されていません）")
-                st.markdown("---")
-
-        # ===== セッション講評（AI：選択式） =====
-        from services.ai_eval import gen_session_feedback
-        from collections import defaultdict
-
-        # ① 今バッチの成績だけで、0/1 の厳密平均を作る（未回答は除外）
-        session_items = []
-        per_skill_correct = defaultdict(int)
-        per_skill_total   = defaultdict(int)
-
-        for r, q in zip(results, questions):
-            skill_norm = (q.skill or "").replace(" ", "").replace("　", "")
-
-            # 未回答は除外（平均を歪めない）
-            if r.is_correct is None and not r.chosen:
-                continue
-
-            # 0/1カウント（MCQのみ）
-            if r.is_correct is True:
-                per_skill_correct[skill_norm] += 1
-                per_skill_total[skill_norm]   += 1
-            elif r.is_correct is False:
-                per_skill_total[skill_norm]   += 1
-
-            session_items.append({
-                "id": q.id,
-                "type": q.type,          # "mcq"
-                "skill": skill_norm,
-                "difficulty": q.difficulty,
-                "tags": q.tags or [],
-                "correct": r.is_correct,
-                "chosen": r.chosen,
-                "answer_key": r.correct_key
-            })
-
-        # ② スキル別の正解率（0..1）を事前計算して LLM に手渡す
-        pre_skill_scores = {}
-        for sk, tot in per_skill_total.items():
-            if tot > 0:
-                pre_skill_scores[sk] = round(per_skill_correct[sk] / tot, 2)
-
-        # ③ 正解数/全問数も渡す（未回答は全問数に含めない）
-        correct_count = sum(1 for r in results if r.is_correct is True)
-        total_count   = len([r for r in results if r.is_correct is not None])
-
-        payload = {
-            "session_items": session_items,
-            "meta": {
-                "correct": correct_count,
-                "total": total_count,
-                "pre_skill_scores": pre_skill_scores,   # ←これを尊重させる
-            }
-        }
-        st.session_state._last_payload = payload  # ← AI講評ボタン用に保持
+    view = st.session_state.get("_grade_view")
+    if view and view.get("kind") == "sjt":
+        _swap_finished_evals(view)
+        _render_sjt_view(qs, view)
+        if view.get("pending"):
+            view["_inline"] = True
+            _pending_eval_fragment()
+    elif view:
+        _render_mcq_view(qs, view)
+    st.info("このバッチは採点済みです。下部の「次の問題を解く（2問）」で新バッチに進めます。")
 
-        st.session_state.history_items.extend(session_items)
-        
-        print("DEBUG session_items:", session_items)
-        print("DEBUG meta:", payload["meta"])
+_grading_fragment(questions, is_sjt_mode)
 
-# 採点完了フラグのみ立て、AI講評はまだ生成しない
-st.session_state._graded = True
-st.session_state._ai_summary = None
-st.session_state._ai_summary_total = None
+# -------------------------------
+# 通算スコア／AI講評
+# -------------------------------
 # --- 通算スコア（MCQのみ）インライン表示：採点ボタン ↔ AI講評ボタン の間 ---
+def _load_skill_stats() -> dict | None:
+    """user_skill_stats（永続集計）を読む。読めなければ None（履歴スキャンにフォールバック）"""
+    try:
+        return _attempts.get_skill_stats(USER_ID)
+    except Exception as e:
+        print(f"[WARN] skill stats unavailable: {e}")
+        return None
+
 def _render_total_score_inline():
-    hist = st.session_state.get("history_items", [])
-    # MCQで正誤が判定されたもののみ集計（未回答は除外）
-    mcq_items = [
-        it for it in hist
-        if (it or {}).get("type") == "mcq" and isinstance((it or {}).get("correct"), bool)
-    ]
-    total = len(mcq_items)
-    correct = sum(1 for it in mcq_items if it.get("correct") is True)
+    stats = _load_skill_stats()
+    if stats is not None:
+        # MCQで正誤が判定されたもののみ集計（未回答は除外）— スキル数ぶんの合計だけで済む
+        total = sum(d["graded"] for d in stats.values())
+        correct = sum(d["correct"] for d in stats.values())
+    else:
+        hist = st.session_state.get("history_items", [])
+        mcq_items = [
+            it for it in hist
+            if (it or {}).get("type") == "mcq" and isinstance((it or {}).get("correct"), bool)
+        ]
+        total = len(mcq_items)
+        correct = sum(1 for it in mcq_items if it.get("correct") is True)
+
+    ranks, tenant, tenant_ranks = {}, "", {}
+    if stats:
+        try:
+            ranks = _pct.placement(stats)
+            tenant = _pct.user_tenant(USER_ID)
+            if tenant:
+                tenant_ranks = _pct.placement(stats, cohort=f"tenant:{tenant}")
+        except Exception as e:
+            print(f"[WARN] percentile read failed: {e}")
 
     if total > 0:
         pct = round(100 * correct / total)
         with st.container(border=True):
             st.markdown(f"**📈 通算スコア**：{correct} / {total}（{pct}%）")
+            if ranks or tenant_ranks:
+                keys = set(ranks) | set(tenant_ranks)
+                order = [_pct.OVERALL] + sorted(k for k in keys if k != _pct.OVERALL)
+
+                def _rank(k):
+                    parts = [f"上位 {ranks[k]}%"] if k in ranks else []
+                    if k in tenant_ranks:
+                        parts.append(f"{tenant}内 上位 {tenant_ranks[k]}%")
+                    return f"{k}：" + "／".join(parts)
+
+                st.caption("🏅 " + "　".join(_rank(k) for k in order if k in keys))
     else:
         st.caption("📈 通算スコア：まだMCQの記録はありません")
 
-_render_total_score_inline()
+def _total_summary() -> dict:
+    """通算講評：採点後に裏で作っておいたもの（同じ履歴の版）があればそれ（生成中なら待つ）、無ければその場で生成"""
+    stats = _load_skill_stats()
+    if stats:
+        ready = _summary_jobs.get_ready(USER_ID, _summary_jobs.history_version(stats), wait_s=_summary_jobs.WAIT_S)
+        if ready is not None:
+            return ready
+    return gen_session_feedback(_summary_jobs.total_payload(st.session_state.history_items, stats),
+                                user_id=USER_ID)
+
+@st.fragment
+def _summary_fragment(sjt_mode: bool):
+    _render_total_score_inline()
+
+    # SJT は採点後のみ、MCQ は通算履歴があればAI講評ボタンを表示
+    if not st.session_state.get("history_items"):
+        return
+    if sjt_mode and not st.session_state.get("_graded", False):
+        return
+
+    btn_key = f"ai_summary_btn_{'sjt' if sjt_mode else 'mcq'}_{st.session_state.batch_no}"
+    if st.button("🧠 AI講評を見る", type="secondary", use_container_width=True, key=btn_key):
+        # ✅ 通算だけを生成・表示（セッション講評は出さない）
+        with _prof.span("total_summary"):
+            st.session_state._ai_summary_total = _total_summary()
+
+    if st.session_state.get("_ai_summary_total"):
+        with st.expander("🧠 AI講評（通算）", expanded=True):
+            _render_session_summary(st.session_state._ai_summary_total)
 
-# ボタン押下時のみAI講評を生成・表示
-if (not is_sjt_mode) and st.session_state.get("history_items") and st.button(
-    "🧠 AI講評を見る", type="secondary", use_container_width=True, key=f"ai_summary_btn_mcq_{st.session_state.batch_no}"
-):
+_summary_fragment(is_sjt_mode)
 
-    # ✅ 通算だけを生成・表示（セッション講評は出さない）
-    total_payload = {"session_items": st.session_state.history_items}
-    summary_total = gen_session_feedback(total_payload)
-    st.session_state._ai_summary_total = summary_total
-    with st.expander("🧠 AI講評（通算）", expanded=True):
-        _render_session_summary(summary_total)
+# -------------------------------
+# 開発者向け：今回の rerun の区間ウォーターフォール＋直近 p50/p95
+# -------------------------------
+def _render_profiler_sidebar():
+    spans = _prof.current_run()
+    total_ms = max(_prof.run_elapsed_ms(), 1e-6)
+    width = 24
+    lines = []
+    for sp in spans:
+        off = min(width - 1, int(width * sp["start_ms"] / total_ms))
+        bar = max(1, int(round(width * sp["dur_ms"] / total_ms)))
+        name = ("  " * sp["depth"] + sp["name"])[:22]
+        lines.append(f"{name:<22} {' ' * off}{'█' * bar} {sp['dur_ms']:.1f}ms")
+    lines.append(f"{'(rerun total)':<22} {total_ms:.1f}ms")
+
+    rows = [
+        {"span": k, "n": v["n"], "p50 ms": round(v["p50_ms"], 1), "p95 ms": round(v["p95_ms"], 1)}
+        for k, v in sorted(_prof.stats().items())
+    ]
+    with st.sidebar.expander("⏱ Profiler (dev)", expanded=False):
+        st.code("\n".join(lines), language=None)
+        st.table(rows)
 
 # -------------------------------
 # 次の2問ボタン
@@ -841,8 +1106,11 @@ st.divider()
 if st.button("次の問題を解く（2問）", type="secondary", use_container_width=True):
     # 採点状態とAI講評を完全リセット
     st.session_state._graded = False
+    st.session_state._grade_view = None
     st.session_state._ai_summary = None
     st.session_state._ai_summary_total = None
     st.session_state.batch_no += 1
     st.rerun()
 
+if DEBUG_DEV:
+    _render_profiler_sidebar()
@@ -0,0 +1,257 @@
+# bench/api_load.py
+# JSON API（app/api.py）の負荷試験と、同じ流れを Streamlit で回したとき（bench/load_sessions.py）との比較（オフライン）。
+#   python -m bench.api_load --users 20 --batches 5
+#   python -m bench.api_load --users 20 --batches 3 --sjt 0.3 --compare --out api.json
+#
+# 構成は load_sessions と同じ：モック LLM をスレッドで起動し、一時ディレクトリの users.db / cq.db で
+# `python -m app.api` を子プロセスとして起動する（--url なら起動済みの API に繋ぐ）。
+# 1ユーザーの流れ（各リクエストの所要時間をステップ別に計る）:
+#   register → [batch（2問）→ grade（mcq / sjt。--sjt の割合は状況判断＋自由記述）→ feedback（通算講評）] × batches
+# ユーザーごとにスレッド1本（urllib、接続は毎回張る）。
+# --compare は同じ設定で bench.load_sessions も走らせ、batches/s・requests/s とアプリ側の CPU 秒 / バッチを並べる
+# （Streamlit 側の「リクエスト」は送った BackMsg の数。answer のクリックごとに再実行が1回ある）。
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from bench import mock_openai
+from bench.load_sessions import FREE_TEXTS, ROOT, _free_port, _pct, _prepare_bank, _proc_usage
+
+STEPS = ("register", "batch", "grade", "feedback")
+MCQ_SKILL = "要約"
+SJT_SKILL = "状況判断"
+
+
+class Client:
+    def __init__(self, url: str, timeout: float = 120.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.token = ""
+
+    def call(self, method: str, path: str, body: Optional[dict] = None) -> dict:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(self.url + path, data=data, method=method)
+        req.add_header("Content-Type", "application/json")
+        if self.token:
+            req.add_header("Authorization", f"Bearer {self.token}")
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as r:
+                return json.loads(r.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"{e.code} {e.read().decode('utf-8', 'replace')[:100]}")
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.messages: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def step(self, name: str, fn):
+        t = time.perf_counter()
+        try:
+            return fn()
+        except Exception as e:
+            with self._lock:
+                self.errors[name] += 1
+                self.messages[f"{name}: {type(e).__name__}: {str(e)[:100]}"] += 1
+            raise
+        finally:
+            with self._lock:
+                self.samples[name].append((time.perf_counter() - t) * 1e3)
+
+
+def _user(i: int, url: str, args, rec: Recorder, done: Counter, run_id: str, lock: threading.Lock):
+    rnd = random.Random(args.seed * 100_003 + i)
+    sjt = rnd.random() < args.sjt
+    think = args.think_ms / 1e3
+    time.sleep(args.ramp_s * i / max(1, args.users))
+    c = Client(url)
+    try:
+        c.token = rec.step("register", lambda: c.call(
+            "POST", "/api/register", {"account_id": f"api_{run_id}_{i}", "password": f"pw-{run_id}-{i}"}))["token"]
+        seen: List[str] = []
+        skill = SJT_SKILL if sjt else MCQ_SKILL
+        for _ in range(args.batches):
+            qs = rec.step("batch", lambda: c.call(
+                "GET", f"/api/batch?skill={urllib.request.quote(skill)}&n=2&exclude={','.join(seen)}"))["questions"]
+            if not qs:
+                raise RuntimeError("no questions")
+            seen.extend(q["id"] for q in qs)
+            answers = {q["id"]: rnd.choice("ABCD"[:max(1, len(q["choices"]))]) for q in qs}
+            time.sleep(think)
+            if sjt:
+                free = {q["id"]: rnd.choice(FREE_TEXTS) for q in qs}
+                rec.step("grade", lambda: c.call("POST", "/api/grade/sjt", {"answers": answers, "free": free}))
+            else:
+                rec.step("grade", lambda: c.call("POST", "/api/grade/mcq", {"answers": answers}))
+            time.sleep(think)
+            rec.step("feedback", lambda: c.call("POST", "/api/feedback/session", {}))
+            with lock:
+                done["batches"] += 1
+        with lock:
+            done["sessions"] += 1
+    except Exception:
+        with lock:
+            done["failed"] += 1
+
+
+def _start_api(tmp: Path, port: int, openai_url: str, bank: Path):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{(tmp / 'users.db').as_posix()}",
+        "CQ_DB_PATH": str(bank),
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY") or "mock",
+        "OPENAI_BASE_URL": openai_url,
+        "CQ_BCRYPT_ROUNDS": env.get("CQ_BCRYPT_ROUNDS", "4"),
+        "CQ_API_SECRET": env.get("CQ_API_SECRET") or "bench",
+    })
+    log = open(tmp / "api.log", "w")
+    return subprocess.Popen([sys.executable, "-m", "app.api", "--port", str(port)],
+                            env=env, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+
+
+def _wait_healthy(url: str, proc, timeout: float = 60.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"api exited with {proc.returncode}")
+        try:
+            Client(url, timeout=2).call("GET", "/api/health")
+            return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("api did not become healthy")
+
+
+def _run(args) -> Dict:
+    mock, proc, usage = None, None, {}
+    tmp = Path(tempfile.mkdtemp(prefix="cq_api_load_"))
+    try:
+        url = args.url
+        if not url:
+            mock = mock_openai.from_args(args, seed=args.seed)
+            openai_url = mock.start()
+            port = _free_port()
+            proc = _start_api(tmp, port, openai_url, _prepare_bank(tmp, args.bank, args.seed))
+            url = f"http://127.0.0.1:{port}"
+        _wait_healthy(url, proc)
+        print(f"[api_load] {args.users} users x {args.batches} batches -> {url} (log: {tmp})", file=sys.stderr)
+
+        rec, done, lock = Recorder(), Counter(), threading.Lock()
+        run_id = f"{int(time.time())}"
+        threads = [threading.Thread(target=_user, args=(i, url, args, rec, done, run_id, lock))
+                   for i in range(args.users)]
+        t0 = time.perf_counter()
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        wall = time.perf_counter() - t0
+        if proc is not None:
+            usage = _proc_usage(proc.pid)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if mock is not None:
+            mock.stop()
+
+    steps = {}
+    for name in STEPS:
+        xs = rec.samples.get(name, [])
+        if xs:
+            steps[name] = {"n": len(xs), "errors": rec.errors.get(name, 0),
+                           "p50_ms": round(_pct(xs, 0.50), 1), "p95_ms": round(_pct(xs, 0.95), 1),
+                           "p99_ms": round(_pct(xs, 0.99), 1), "max_ms": round(max(xs), 1)}
+    total = sum(len(v) for v in rec.samples.values())
+    return {
+        "wall_s": round(wall, 2),
+        "sessions": {"started": args.users, "completed": done["sessions"], "failed": done["failed"]},
+        "throughput": {"requests_per_s": round(total / wall, 2), "batches_per_s": round(done["batches"] / wall, 3)},
+        "steps": steps,
+        "errors": dict(rec.messages.most_common()),
+        "mock": mock.stats() if mock else {},
+        "app_process": usage,
+        "batches": done["batches"],
+    }
+
+
+def _run_streamlit(args) -> Dict:
+    from bench import load_sessions
+
+    out = Path(tempfile.mkdtemp(prefix="cq_api_cmp_")) / "streamlit.json"
+    argv = ["--users", str(args.users), "--batches", str(args.batches), "--sjt", str(args.sjt),
+            "--think-ms", str(args.think_ms), "--ramp-s", str(args.ramp_s), "--bank", str(args.bank),
+            "--seed", str(args.seed), "--out", str(out),
+            "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+            "--ms-per-token", str(args.ms_per_token), "--error-rate", str(args.error_rate),
+            "--error-codes", args.error_codes, "--tokens", str(args.tokens),
+            "--tail-rate", str(args.tail_rate), "--tail-ms", str(args.tail_ms)]
+    load_sessions.main(argv)
+    r = json.loads(out.read_text(encoding="utf-8"))
+    r["throughput"]["requests_per_s"] = r["throughput"]["steps_per_s"]
+    r["batches"] = round(r["throughput"]["batches_per_s"] * r["wall_s"])
+    return r
+
+
+def _line(name: str, r: Dict) -> str:
+    cpu = r.get("app_process", {}).get("cpu_s")
+    per = f"{1e3 * cpu / r['batches']:8.1f}" if cpu is not None and r.get("batches") else f"{'-':>8s}"
+    return (f"{name:10s} {r['throughput']['requests_per_s']:10.2f} {r['throughput']['batches_per_s']:10.3f} "
+            f"{r['wall_s']:8.2f} {per}  {r['sessions']['completed']}/{r['sessions']['started']}")
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="JSON API の負荷試験（モック LLM）。--compare で Streamlit 経由と比べる")
+    ap.add_argument("--users", type=int, default=10, help="同時ユーザー数")
+    ap.add_argument("--batches", type=int, default=3, help="1ユーザーで解くバッチ（2問）数")
+    ap.add_argument("--sjt", type=float, default=0.0, help="状況判断（自由記述の AI 評価あり）を選ぶユーザーの割合")
+    ap.add_argument("--think-ms", type=float, default=0.0, help="操作の間の待ち時間")
+    ap.add_argument("--ramp-s", type=float, default=0.0, help="ユーザーの開始をこの秒数に散らす")
+    ap.add_argument("--bank", type=int, default=0, help="合成バンクの問題数（0 なら data/cq.db のコピー）")
+    ap.add_argument("--url", default="", help="起動済みの API に繋ぐ")
+    ap.add_argument("--compare", action="store_true", help="同じ設定で bench.load_sessions も走らせて並べる")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="", help="結果 JSON の出力先")
+    mock_openai.add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    results = {"api": _run(args)}
+    if args.compare:
+        results["streamlit"] = _run_streamlit(args)
+
+    api = results["api"]
+    for name, r in api["steps"].items():
+        print(f"  {name:<10} n={r['n']:<5} err={r['errors']:<3} p50 {r['p50_ms']:>8.1f}  p95 {r['p95_ms']:>8.1f}  "
+              f"p99 {r['p99_ms']:>8.1f}  max {r['max_ms']:>8.1f} ms", file=sys.stderr)
+    for msg, n in api["errors"].items():
+        print(f"  [ERR] {n:4d}  {msg}", file=sys.stderr)
+    print(f"{'path':10s} {'req/s':>10s} {'batches/s':>10s} {'wall_s':>8s} {'cpu_ms/b':>8s}  sessions")
+    for name, r in results.items():
+        print(_line(name, r))
+
+    if args.out:
+        Path(args.out).write_text(json.dumps({"config": vars(args), "results": results}, ensure_ascii=False,
+                                             indent=2), encoding="utf-8")
+    return 0 if not api["sessions"]["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# bench/attempts_throughput.py
+# 多数のセッションが同時に採点したときの attempts 書き込みスループットを計測する。
+#   python -m bench.attempts_throughput --sessions 200 --batches 50
+# 各セッション（スレッド）は「2問採点 → enqueue」を繰り返す。
+# enqueue の待ち時間（＝採点がディスクを待つ時間）と、永続化完了までの rows/s を表示する。
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+def _pct(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * (len(xs) - 1)))] if xs else 0.0
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="attempts write-behind スループット")
+    ap.add_argument("--sessions", type=int, default=100)
+    ap.add_argument("--batches", type=int, default=50, help="1セッションあたりの採点回数（1回2問）")
+    ap.add_argument("--database-url", default="", help="未指定なら一時 SQLite")
+    args = ap.parse_args(argv)
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        tmp = Path(tempfile.mkdtemp(prefix="cq_attempts_bench_")) / "users.db"
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp.as_posix()}"
+
+    from app.services import attempts
+    attempts.init_db()
+
+    skills = ["要約", "意図理解", "印象マネジメント"]
+    enqueue_lat = []
+    lat_lock = threading.Lock()
+    gate = threading.Barrier(args.sessions)
+
+    def session(uid: int):
+        rnd = random.Random(uid)
+        local = []
+        gate.wait()
+        for b in range(args.batches):
+            items = [{
+                "id": f"q_{rnd.randrange(5000)}", "type": "mcq", "skill": rnd.choice(skills),
+                "difficulty": round(rnd.random(), 2), "tags": ["business"],
+                "correct": rnd.random() < 0.6, "chosen": rnd.choice("ABCD"), "answer_key": "B",
+            } for _ in range(2)]
+            t = time.perf_counter()
+            attempts.enqueue(uid, items)
+            local.append(time.perf_counter() - t)
+        with lat_lock:
+            enqueue_lat.extend(local)
+
+    threads = [threading.Thread(target=session, args=(u + 1,)) for u in range(args.sessions)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    t_enqueued = time.perf_counter() - t0
+    attempts.flush()
+    t_durable = time.perf_counter() - t0
+
+    total = args.sessions * args.batches * 2
+    st = attempts.writer_stats()
+    print(f"database_url     : {os.environ['DATABASE_URL']}")
+    print(f"sessions x grades: {args.sessions} x {args.batches} (2 rows each) = {total} rows")
+    print(f"enqueue latency  : p50 {statistics.median(enqueue_lat) * 1e6:.0f}us  "
+          f"p99 {_pct(enqueue_lat, 0.99) * 1e6:.0f}us  max {max(enqueue_lat) * 1e3:.1f}ms")
+    print(f"all enqueued in  : {t_enqueued:.2f}s")
+    print(f"durable after    : {t_durable:.2f}s  ({st['written'] / t_durable:.0f} rows/s sustained)")
+    print(f"written/dropped  : {st['written']} / {st['dropped']}")
+    tail = attempts.load_tail(1, 5)
+    print(f"tail(user 1, 5)  : {[it['id'] for it in tail]}")
+    return 0 if st["written"] == total and not st["dropped"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
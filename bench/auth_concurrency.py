@@ -0,0 +1,77 @@
+# bench/auth_concurrency.py
+# N スレッドで同時に新規登録→ログインを行い、エラー件数とスループットを表示する。
+#   python -m bench.auth_concurrency --threads 16 --per-thread 20
+# 既定では一時ディレクトリの SQLite を使う（data/users.db には触らない）。
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="users DB の同時登録／認証ストレス")
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--per-thread", type=int, default=10, help="1スレッドあたりの登録ユーザー数")
+    ap.add_argument("--database-url", default="", help="未指定なら一時 SQLite")
+    args = ap.parse_args(argv)
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        tmp = Path(tempfile.mkdtemp(prefix="cq_auth_bench_")) / "users.db"
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp.as_posix()}"
+
+    # bcrypt のコストはDBの同時実行性とは無関係なので、最小ラウンドにして計測を DB 側に寄せる
+    os.environ.setdefault("CQ_BCRYPT_ROUNDS", "4")
+
+    # DATABASE_URL はモジュール読み込み時に確定するので、環境変数設定後に import する
+    from app.services import auth
+    auth.init_db()
+
+    errors: Counter = Counter()
+    ops = Counter()
+    lock = threading.Lock()
+    start_gate = threading.Barrier(args.threads)
+    run_id = f"{int(time.time())}"
+
+    def worker(tid: int):
+        start_gate.wait()
+        for i in range(args.per_thread):
+            aid = f"bench_{run_id}_{tid}_{i}"
+            try:
+                auth.create_user(aid, "pw-" + aid)
+                u = auth.authenticate(aid, "pw-" + aid)
+                if u is None:
+                    raise RuntimeError("authenticate returned None")
+                with lock:
+                    ops["register"] += 1
+                    ops["authenticate"] += 1
+            except Exception as e:  # 種類ごとに数える（database is locked 等）
+                with lock:
+                    errors[f"{type(e).__name__}: {str(e)[:80]}"] += 1
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(args.threads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    total_ops = sum(ops.values())
+    print(f"database_url : {auth.DATABASE_URL}")
+    print(f"threads      : {args.threads} x {args.per_thread} users")
+    print(f"ok ops       : register={ops['register']} authenticate={ops['authenticate']}")
+    print(f"elapsed      : {elapsed:.2f}s  ({total_ops / elapsed:.1f} ops/s)")
+    print(f"errors       : {sum(errors.values())}")
+    for msg, n in errors.most_common():
+        print(f"  {n:5d}  {msg}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
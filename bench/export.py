@@ -0,0 +1,70 @@
+# bench/export.py
+# Parquet エクスポート（app/services/export.py）のスループットとメモリ上限を計測する。
+#   python -m bench.export --rows 1000000 --chunk 100000
+# 一時 DB に合成 attempts を書き、全件 → 追加分だけ（ウォーターマーク）の2回書き出す。
+# 出力を pandas でそのまま読み戻し、件数・列型を確認する。
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from bench.item_analysis import _fill_attempts, _make_bank
+
+
+def _rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="parquet export benchmark")
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--incremental-rows", type=int, default=100_000)
+    ap.add_argument("--items", type=int, default=500)
+    ap.add_argument("--chunk", type=int, default=100_000)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    tmp = Path(tempfile.mkdtemp(prefix="cq_export_bench_"))
+    os.environ["DATABASE_URL"] = f"sqlite:///{(tmp / 'users.db').as_posix()}"
+    rnd = np.random.default_rng(args.seed)
+
+    from app.services import export
+
+    bank_path = tmp / "cq.db"
+    true_d = _make_bank(bank_path, args.items, rnd)
+    t = time.perf_counter()
+    _fill_attempts(os.environ["DATABASE_URL"], args.rows, true_d, rnd)
+    print(f"synthetic attempts: {args.rows} rows in {time.perf_counter() - t:.1f}s ({tmp})")
+
+    out = tmp / "export"
+    rss0 = _rss_mb()
+    res = export.run(out=out, chunk_rows=args.chunk, bank_path=bank_path, log=lambda *_: None)
+    print(f"full export       : {res['rows']} rows, {res['files']} files in {res['seconds']:.2f}s "
+          f"({res['rows'] / max(res['seconds'], 1e-9):.0f} rows/s), peak RSS +{_rss_mb() - rss0:.0f} MB")
+
+    _fill_attempts(os.environ["DATABASE_URL"], args.incremental_rows, true_d, rnd, user_offset=10**7)
+    res2 = export.run(out=out, chunk_rows=args.chunk, bank_path=bank_path, log=lambda *_: None)
+    print(f"incremental export: {res2['rows']} rows (ids {res2['from_id']} -> {res2['to_id']}) "
+          f"in {res2['seconds']:.2f}s")
+
+    import pandas as pd
+
+    t = time.perf_counter()
+    df = pd.read_parquet(out / "attempts")
+    qs = pd.read_parquet(out / "questions")
+    size = sum(f.stat().st_size for f in out.rglob("*.parquet"))
+    print(f"pandas read back  : {len(df)} attempts, {len(qs)} questions in {time.perf_counter() - t:.2f}s, "
+          f"{size / 2**20:.1f} MB on disk")
+    print("  dtypes:", ", ".join(f"{c}={t}" for c, t in df.dtypes.astype(str).items()))
+    ok = (len(df) == args.rows + args.incremental_rows and df["attempt_id"].is_unique
+          and res2["rows"] == args.incremental_rows and len(qs) == args.items)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# bench/exposure.py
+# 小さいプール（ドメイン×スキル）に多数のセッションが同時に出題を取りに行ったときの、
+# 問題ごとの出題回数の偏りを、露出制御あり／なしで比べる。
+#   python -m bench.exposure --sessions 200 --batches 3 --skill 要約 --domain 日常
+# 出題回数の変動係数（CV）と最多/最少、DB への書き込み回数（flush 数）を表示する。
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+def _run(sessions: int, batches: int, skill: str, domain: str, enabled: bool):
+    from app.services import exposure, selector
+
+    exposure.ENABLED = enabled
+    with exposure._lock:
+        exposure._base.clear()
+        exposure._unflushed.clear()
+    shown = {q.id: 0 for q in selector._index_for(skill, domain, skill == "状況判断").items}
+    lock = threading.Lock()
+    gate = threading.Barrier(sessions)
+    short = [0]
+
+    def session():
+        seen = set()
+        gate.wait()
+        for _ in range(batches):
+            qs = selector.pick_batch(skill, domain, want=2, exclude=seen)
+            if len(qs) < 2:
+                with lock:
+                    short[0] += 1
+            seen.update(q.id for q in qs)
+            exposure.record(q.id for q in qs)
+            with lock:
+                for q in qs:
+                    shown[q.id] += 1
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    counts = list(shown.values())
+    mean = statistics.mean(counts)
+    cv = statistics.pstdev(counts) / mean if mean else 0.0
+    return {"pool": len(counts), "shown": sum(counts), "cv": cv, "min": min(counts), "max": max(counts),
+            "short": short[0], "seconds": elapsed}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="exposure control benchmark")
+    ap.add_argument("--sessions", type=int, default=200)
+    ap.add_argument("--batches", type=int, default=3)
+    ap.add_argument("--skill", default="要約")
+    ap.add_argument("--domain", default="日常")
+    args = ap.parse_args(argv)
+
+    tmp = Path(tempfile.mkdtemp(prefix="cq_exposure_bench_")) / "users.db"
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp.as_posix()}"
+    os.environ.setdefault("CQ_SELECT_MODE", "random")
+
+    from app.services import exposure
+
+    print(f"{args.sessions} sessions x {args.batches} batches of 2, pool {args.domain} x {args.skill}")
+    results = {}
+    for enabled in (False, True):
+        r = results[enabled] = _run(args.sessions, args.batches, args.skill, args.domain, enabled)
+        label = "least-exposed" if enabled else "random       "
+        print(f"  {label}: pool {r['pool']}, shown {r['shown']}, CV {r['cv']:.3f}, "
+              f"min/max {r['min']}/{r['max']}, short batches {r['short']}, {r['seconds'] * 1e3:.0f} ms")
+    exposure.flush()
+    print(f"  DB writes for {results[True]['shown'] + results[False]['shown']} shown questions: "
+          f"{exposure.stats()['flushes']} flush transaction(s)")
+    return 0 if results[True]["cv"] <= results[False]["cv"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
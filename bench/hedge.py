@@ -0,0 +1,140 @@
+# bench/hedge.py
+# 2つのローカルスタブ（遅延の性質が違う）で、ヘッジなし／ありの応答時間を比べる（オフライン）。
+#   python -m bench.hedge --requests 400 --concurrency 8
+#   python -m bench.hedge --primary-tail-rate 0.05 --primary-tail-ms 5000 --out hedge.json
+#
+# 主:     OpenAI 互換（/v1/chat/completions）。普段は速いが、一部の応答が大きく遅れる（裾が重い）
+# 2番目:  Anthropic 形式（/v1/messages）。主より遅いが安定
+# どちらも app.services.llm_providers の Provider / Router をそのまま使う（keep-alive の HTTP クライアント込み）。
+# モードごとにスタブを同じ seed で作り直すので、主の遅延の並びは両モードで同じになる。
+# 先に --warmup 件を流して主の p90 を貯めてから計測する（その間はヘッジの待ち時間が既定値）。
+# 出力: 各モードの p50 / p90 / p99 / max（ms）、スタブが受けたリクエスト数（ヘッジで増えた割合）、勝った側の件数。
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List
+
+from bench.mock_openai import MockOpenAI
+
+MESSAGES = [
+    {"role": "system", "content": "必ず次のJSON形式のみを返してください: {\"score_total\": 0-100}"},
+    {"role": "user", "content": "【状況】納期が遅れている\n【回答】事情を確認し、再調整案を共有します"},
+]
+
+
+def _pct(xs: List[float], q: float) -> float:
+    return round(xs[min(len(xs) - 1, int(q * (len(xs) - 1)))], 1)
+
+
+def _run_mode(args, hedge: bool) -> Dict:
+    from app.services.llm_providers import AnthropicProvider, OpenAIProvider, Router
+
+    primary = MockOpenAI(latency_ms=args.primary_latency_ms, jitter_ms=args.primary_jitter_ms,
+                         tail_rate=args.primary_tail_rate, tail_ms=args.primary_tail_ms,
+                         tokens=args.tokens, seed=args.seed)
+    secondary = MockOpenAI(latency_ms=args.secondary_latency_ms, jitter_ms=args.secondary_jitter_ms,
+                           tokens=args.tokens, seed=args.seed + 1)
+    primary_url = primary.start()
+    secondary_url = secondary.start().rsplit("/v1", 1)[0]  # Anthropic SDK は /v1/messages を自分で足す
+    try:
+        router = Router([OpenAIProvider("dummy", primary_url, "mock-primary"),
+                         AnthropicProvider("dummy", secondary_url, "mock-secondary")], hedge=hedge)
+
+        def call():
+            return router.chat.completions.create(model="ignored", messages=MESSAGES, temperature=0.2)
+
+        for _ in range(args.warmup):
+            call()
+        before = (primary.stats()["requests"], secondary.stats()["requests"])
+
+        lat: List[float] = []
+        winners: Counter = Counter()
+        errors: Counter = Counter()
+        lock = threading.Lock()
+        todo = iter(range(args.requests))
+
+        def worker():
+            while True:
+                with lock:
+                    if next(todo, None) is None:
+                        return
+                t = time.perf_counter()
+                try:
+                    resp = call()
+                except Exception as e:
+                    with lock:
+                        errors[type(e).__name__] += 1
+                    continue
+                ms = (time.perf_counter() - t) * 1e3
+                with lock:
+                    lat.append(ms)
+                    winners["secondary" if str(resp.id).startswith("msg_") else "primary"] += 1
+
+        threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+        t0 = time.perf_counter()
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        elapsed = time.perf_counter() - t0
+        time.sleep(args.drain_s)  # 負けた側の応答を待ってから数える
+        sent = (primary.stats()["requests"] - before[0], secondary.stats()["requests"] - before[1])
+    finally:
+        primary.stop()
+        secondary.stop()
+
+    lat.sort()
+    ok = len(lat)
+    return {
+        "hedge": hedge,
+        "ok": ok,
+        "errors": dict(errors),
+        "elapsed_s": round(elapsed, 2),
+        "p50_ms": _pct(lat, 0.5) if ok else None,
+        "p90_ms": _pct(lat, 0.9) if ok else None,
+        "p99_ms": _pct(lat, 0.99) if ok else None,
+        "max_ms": round(lat[-1], 1) if ok else None,
+        "primary_requests": sent[0],
+        "secondary_requests": sent[1],
+        "extra_request_pct": round(100.0 * sent[1] / max(1, sent[0]), 1),
+        "winners": dict(winners),
+        "hedge_delay_ms": round(router.providers[0].hedge_delay() * 1e3, 1),
+    }
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="LLM リクエストのヘッジ（主が p90 を過ぎたら2番目にも送る）の効果")
+    ap.add_argument("--requests", type=int, default=300)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--warmup", type=int, default=40, help="計測前に流す件数（p90 の観測を貯める）")
+    ap.add_argument("--tokens", type=int, default=50)
+    ap.add_argument("--primary-latency-ms", type=float, default=300.0)
+    ap.add_argument("--primary-jitter-ms", type=float, default=100.0)
+    ap.add_argument("--primary-tail-rate", type=float, default=0.08)
+    ap.add_argument("--primary-tail-ms", type=float, default=3000.0)
+    ap.add_argument("--secondary-latency-ms", type=float, default=600.0)
+    ap.add_argument("--secondary-jitter-ms", type=float, default=100.0)
+    ap.add_argument("--drain-s", type=float, default=0.0, help="計測後、負けた側の応答を待つ秒数（リクエスト数の集計用）")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", default="", help="結果の JSON を書き出すパス")
+    args = ap.parse_args(argv)
+    if not args.drain_s:
+        args.drain_s = (args.primary_tail_ms + args.primary_latency_ms) / 1e3
+
+    results = [_run_mode(args, hedge=False), _run_mode(args, hedge=True)]
+    print(f"{'mode':8s} {'p50':>8s} {'p90':>8s} {'p99':>8s} {'max':>8s} {'extra%':>7s}  winners")
+    for r in results:
+        print(f"{'hedged' if r['hedge'] else 'single':8s} {r['p50_ms']:8.1f} {r['p90_ms']:8.1f} {r['p99_ms']:8.1f} "
+              f"{r['max_ms']:8.1f} {r['extra_request_pct']:7.1f}  {r['winners']}"
+              + (f"  errors={r['errors']}" if r["errors"] else ""))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
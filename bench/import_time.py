@@ -0,0 +1,96 @@
+# bench/import_time.py
+# アプリが使う services のコールド import 時間を計測し、予算超過なら終了コード 1 を返す。
+#   python -m bench.import_time                # 既定予算
+#   python -m bench.import_time --budget-ms 80 --repeat 5
+# 新しいプロセスで `python -X importtime` を実行し、最上位モジュールの cumulative を合計する。
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# streamlit_app_cq.py が import する services（streamlit 本体はアプリ側の固定費なので対象外）
+MODULES = [
+    "app.services.config",
+    "app.services.profiler",
+    "app.services.db",
+    "app.services.grader",
+    "app.services.ai_eval",
+    "app.services.auth",
+    "app.services.import_jsonl",
+    "app.services.selector",
+    "app.services.exposure",
+    "app.services.walk",
+    "app.services.background",
+    "app.services.attempts",
+    "app.services.adaptive",
+    "app.services.review",
+    "app.services.percentile",
+    "app.services.summary_jobs",
+    "app.services.spec_eval",
+]
+
+DEFAULT_BUDGET_MS = float(os.getenv("CQ_IMPORT_BUDGET_MS", "100"))
+
+
+def _measure_once() -> tuple[float, list[tuple[float, str]]]:
+    """1回分: (合計ms, [(cumulative_ms, module), ...])"""
+    code = "import " + ", ".join(MODULES)
+    env = dict(os.environ)
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else "import failed")
+
+    total_us = 0
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(parts[1].strip())
+        except ValueError:
+            continue  # ヘッダ行
+        name = parts[2]
+        # インデント無し＝最上位の import（子は親の cumulative に含まれる）。
+        # site / encodings などインタプリタ起動分は除外して app 配下だけを数える
+        if name.startswith(" ") and not name.startswith("  ") and name.strip().split(".")[0] == "app":
+            total_us += cumulative
+            rows.append((cumulative / 1000.0, name.strip()))
+    return total_us / 1000.0, sorted(rows, reverse=True)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="services のコールド import 時間チェック")
+    ap.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    ap.add_argument("--repeat", type=int, default=3, help="計測回数（中央値で判定）")
+    args = ap.parse_args(argv)
+
+    totals = []
+    top = []
+    for _ in range(max(1, args.repeat)):
+        total, rows = _measure_once()
+        totals.append(total)
+        top = rows
+    median = statistics.median(totals)
+
+    print(f"cold import of {len(MODULES)} service modules: median {median:.1f} ms "
+          f"(runs: {', '.join(f'{t:.1f}' for t in totals)}) / budget {args.budget_ms:.0f} ms")
+    for ms, name in top[:8]:
+        print(f"  {ms:8.1f} ms  {name}")
+    if median > args.budget_ms:
+        print("FAIL: import-time budget exceeded")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
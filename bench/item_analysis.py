@@ -0,0 +1,108 @@
+# bench/item_analysis.py
+# 項目分析ジョブ（app/services/item_analysis.py）のスループットとメモリ上限を計測する。
+#   python -m bench.item_analysis --rows 2000000 --chunk 200000
+# 一時 DB に合成 attempts を直接 INSERT（真の困難度を持つ Rasch モデルから生成）し、
+# ジョブを全件 → 追加分だけ（ウォーターマーク）の2回実行する。
+# 再推定 difficulty と真値の相関、rows/s、ピーク RSS の増分を表示する。
+import argparse
+import datetime as dt
+import math
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+def _rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _make_bank(path: Path, n_items: int, rnd) -> np.ndarray:
+    """一時 cq.db（questions）を作り、真の困難度（0..1）を返す。作問時 difficulty は 0.5 固定"""
+    true_d = rnd.uniform(0.15, 0.85, n_items)
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE questions (id TEXT PRIMARY KEY, skill TEXT, level TEXT, type TEXT, "
+                     "prompt TEXT, choices_json TEXT, answer_key TEXT, explanations_json TEXT, "
+                     "difficulty REAL, tags_json TEXT, feedbacks_json TEXT)")
+        conn.executemany("INSERT INTO questions (id, skill, type, difficulty, answer_key) VALUES (?,?,?,?,?)",
+                         [(f"q_{i}", "要約", "mcq", 0.5, "A") for i in range(n_items)])
+    return true_d
+
+
+def _fill_attempts(db_url: str, n_rows: int, true_d: np.ndarray, rnd, user_offset: int = 0):
+    """合成 attempts を直接書く（アプリ経由より速い）"""
+    from app.services import attempts
+
+    attempts.init_db()
+    path = db_url[len("sqlite:///"):]
+    n_users = max(1, n_rows // 50)
+    theta_u = rnd.normal(0.0, 1.0, n_users)
+    b = np.log(true_d / (1 - true_d))
+    now = dt.datetime.utcnow().isoformat(sep=" ")
+    with sqlite3.connect(path) as conn:
+        step = 200_000
+        for s in range(0, n_rows, step):
+            k = min(step, n_rows - s)
+            u = rnd.integers(0, n_users, k)
+            q = rnd.integers(0, len(true_d), k)
+            p = 1 / (1 + np.exp(-(theta_u[u] - b[q])))
+            x = rnd.random(k) < p
+            wrong = np.array(list("BCD"))[rnd.integers(0, 3, k)]
+            chosen = np.where(x, "A", wrong)
+            ab = theta_u[u] + rnd.normal(0, 0.3, k)  # 回答時点の推定 θ（真値＋誤差）
+            conn.executemany(
+                "INSERT INTO attempts (user_id, question_id, type, skill, difficulty, tags_json, correct, "
+                "chosen, answer_key, ability, created_at) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                ((int(u[i]) + user_offset, f"q_{q[i]}", "mcq", "要約", 0.5, "[]", bool(x[i]),
+                  str(chosen[i]), "A", float(ab[i]), now) for i in range(k)),
+            )
+        conn.commit()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="item analysis job benchmark")
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--incremental-rows", type=int, default=100_000)
+    ap.add_argument("--items", type=int, default=500)
+    ap.add_argument("--chunk", type=int, default=200_000)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    tmp = Path(tempfile.mkdtemp(prefix="cq_item_bench_"))
+    os.environ["DATABASE_URL"] = f"sqlite:///{(tmp / 'users.db').as_posix()}"
+    rnd = np.random.default_rng(args.seed)
+
+    from app.services import item_analysis
+
+    bank_path = tmp / "cq.db"
+    true_d = _make_bank(bank_path, args.items, rnd)
+    t = time.perf_counter()
+    _fill_attempts(os.environ["DATABASE_URL"], args.rows, true_d, rnd)
+    print(f"synthetic attempts: {args.rows} rows in {time.perf_counter() - t:.1f}s ({tmp})")
+
+    rss0 = _rss_mb()
+    res = item_analysis.run(chunk_rows=args.chunk, bank_path=bank_path, log=lambda *_: None)
+    print(f"full run       : {res['rows']} rows in {res['seconds']:.2f}s "
+          f"({res['rows'] / max(res['seconds'], 1e-9):.0f} rows/s), peak RSS +{_rss_mb() - rss0:.0f} MB, "
+          f"{res['items_written']} difficulties written")
+
+    _fill_attempts(os.environ["DATABASE_URL"], args.incremental_rows, true_d, rnd, user_offset=10**7)
+    res2 = item_analysis.run(chunk_rows=args.chunk, bank_path=bank_path, log=lambda *_: None)
+    print(f"incremental run: {res2['rows']} rows (ids {res2['from_id']} -> {res2['to_id']}) in {res2['seconds']:.2f}s")
+
+    with sqlite3.connect(bank_path) as conn:
+        est = dict(conn.execute("SELECT id, difficulty FROM questions").fetchall())
+    est_d = np.array([est[f"q_{i}"] for i in range(args.items)])
+    r = float(np.corrcoef(est_d, true_d)[0, 1])
+    rmse = math.sqrt(float(np.mean((est_d - true_d) ** 2)))
+    print(f"recalibrated vs true difficulty: r={r:.3f}  RMSE={rmse:.3f}  (authored was 0.5 for all)")
+    return 0 if res2["rows"] == args.incremental_rows and r > 0.9 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,415 @@
+# bench/load_sessions.py
+# 1つの Streamlit プロセスに N 人が同時に解いたときの負荷試験（オフライン・Linux 1台で完結）。
+#   python -m bench.load_sessions --users 20 --batches 5
+#   python -m bench.load_sessions --users 50 --batches 3 --latency-ms 1500 --error-rate 0.05 --sjt 0.3 --out lt.json
+#
+# 構成:
+#   - bench/mock_openai.py のモックをスレッドで起動し、OPENAI_BASE_URL をそこへ向ける
+#   - 一時ディレクトリの users.db / cq.db（data/cq.db のコピー、--bank N なら合成バンク）で
+#     `streamlit run app/streamlit_app_cq.py` を子プロセスとして起動する（--url なら起動済みのアプリに繋ぐ）
+#   - 各セッションはブラウザと同じく /_stcore/stream の WebSocket で BackMsg(rerun_script) を送り、
+#     ForwardMsg の delta から画面上のウィジェットを拾って操作する（N セッションを1つの asyncio ループで回す）
+#     AppTest は Runtime がプロセスで1つなので、同じプロセス内で並行に動かせない
+# 1セッションの流れ（ステップごとに「送信 → script_finished まで」を計る）:
+#   connect → login（新規登録）→ [answer × 問題数 → grade（採点する／フィードバックを見る）
+#   → ai_feedback（AI講評を見る）→ next（次の問題を解く）] × batches
+#   --sjt の割合のセッションは「状況判断」を選び、自由記述も入れて採点する（自由記述の AI 評価が走る）
+# 出力はステップ別の件数・エラー数・p50/p95/p99（ms）、全体のスループット、モックの統計、
+# アプリ側プロセスの CPU 時間とピーク RSS。
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from bench import mock_openai
+
+ROOT = Path(__file__).resolve().parents[1]
+APP = ROOT / "app" / "streamlit_app_cq.py"
+STEPS = ("connect", "login", "answer", "grade", "ai_feedback", "next")
+STEP_TIMEOUT = 120.0
+FREE_TEXTS = ["事情を確認し、期限の目安を共有します", "代替案を出して再調整し、合意します",
+              "まず相手の状況を聞き、優先順位を一緒に決めます"]
+
+
+def _pct(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * (len(xs) - 1)))] if xs else 0.0
+
+
+class AppError(Exception):
+    pass
+
+
+class Session:
+    """WebSocket 越しの1ブラウザ分。画面の要素は delta_path → (種類, proto, fragment_id) で持つ"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.ws = None
+        self.elements: Dict[Tuple[int, ...], tuple] = {}
+        self.values: Dict[str, object] = {}  # widget id → WidgetState（ボタン以外は送り続ける）
+        self.exceptions: List[str] = []
+
+    async def connect(self):
+        from tornado.websocket import websocket_connect
+
+        ws_url = self.url.replace("http://", "ws://").rstrip("/") + "/_stcore/stream"
+        self.ws = await websocket_connect(ws_url, max_message_size=64 * 1024 * 1024)
+        await self.rerun()
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+            self.ws = None
+
+    async def rerun(self, triggers=(), fragment_id: str = ""):
+        """BackMsg(rerun_script) を送り、最後の script_finished まで画面を更新する"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        bm = BackMsg()
+        cs = bm.rerun_script
+        cs.query_string = ""
+        cs.page_script_hash = ""
+        if fragment_id:
+            cs.fragment_id = fragment_id
+        cs.widget_states.widgets.extend(list(self.values.values()) + list(triggers))
+        await self.ws.write_message(bm.SerializeToString(), binary=True)
+
+        run_fragments: set = set()
+        touched: set = set()
+        self.exceptions = []
+        deadline = time.monotonic() + STEP_TIMEOUT
+        while True:
+            raw = await asyncio.wait_for(self.ws.read_message(), max(0.1, deadline - time.monotonic()))
+            if raw is None:
+                raise AppError("websocket closed")
+            msg = ForwardMsg()
+            msg.ParseFromString(raw)
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                run_fragments = set(msg.new_session.fragment_ids_this_run)
+                touched = set()
+            elif kind == "delta":
+                path = tuple(msg.metadata.delta_path)
+                d = msg.delta
+                if d.WhichOneof("type") == "new_element":
+                    ty = d.new_element.WhichOneof("type")
+                    self.elements[path] = (ty, getattr(d.new_element, ty), d.fragment_id)
+                    if ty == "exception":
+                        self.exceptions.append(d.new_element.exception.message)
+                elif d.WhichOneof("type") == "add_block":
+                    self.elements[path] = ("block", d.add_block, d.fragment_id)
+                touched.add(path)
+            elif kind == "script_finished":
+                status = ForwardMsg.ScriptFinishedStatus.Name(msg.script_finished)
+                if status == "FINISHED_EARLY_FOR_RERUN":
+                    continue  # st.rerun() → 続けて次の実行が来る
+                if status == "FINISHED_WITH_COMPILE_ERROR":
+                    raise AppError("script compile error")
+                # ブラウザと同じく、今回の実行で描かれなかった要素を消す（フラグメント実行ならその中だけ）
+                for p in [p for p, e in self.elements.items()
+                          if p not in touched and (not run_fragments or e[2] in run_fragments)]:
+                    del self.elements[p]
+                if not run_fragments:
+                    live = {e[1].id for e in self.elements.values() if hasattr(e[1], "id")}
+                    self.values = {k: v for k, v in self.values.items() if k in live}
+                if self.exceptions:
+                    raise AppError(self.exceptions[0][:120])
+                return
+
+    # ---- 画面の検索と操作 ----
+
+    def find(self, ty: str, key: Optional[str] = None, label: Optional[str] = None,
+             key_prefix: Optional[str] = None) -> List[tuple]:
+        from streamlit.runtime.state.common import user_key_from_element_id
+
+        out = []
+        for p in sorted(self.elements):
+            t, proto, fid = self.elements[p]
+            if t != ty:
+                continue
+            k = user_key_from_element_id(proto.id) if hasattr(proto, "id") else None
+            if key is not None and k != key:
+                continue
+            if key_prefix is not None and not (k or "").startswith(key_prefix):
+                continue
+            if label is not None and label not in getattr(proto, "label", ""):
+                continue
+            out.append((proto, fid))
+        return out
+
+    def one(self, ty: str, **kw) -> tuple:
+        hits = self.find(ty, **kw)
+        if not hits:
+            raise AppError(f"{ty} {kw} not on screen")
+        return hits[0]
+
+    def _state(self, proto):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        ws = WidgetState()
+        ws.id = proto.id
+        return ws
+
+    async def click(self, widget: tuple):
+        proto, fid = widget
+        ws = self._state(proto)
+        ws.trigger_value = True
+        await self.rerun([ws], fragment_id=fid)
+
+    async def choose(self, widget: tuple, index: int, rerun: bool = True):
+        proto, fid = widget
+        ws = self._state(proto)
+        ws.int_value = index
+        self.values[proto.id] = ws
+        if rerun:
+            await self.rerun(fragment_id=fid)
+
+    async def select(self, widget: tuple, option: str):
+        proto, fid = widget
+        ws = self._state(proto)
+        ws.string_value = option
+        self.values[proto.id] = ws
+        await self.rerun(fragment_id=fid)
+
+    def type_text(self, widget: tuple, text: str):
+        # ブラウザではフォーカスが外れたときに送られる。次の操作と一緒に送る
+        proto, _ = widget
+        ws = self._state(proto)
+        ws.string_value = text
+        self.values[proto.id] = ws
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = Counter()
+        self.messages: Counter = Counter()
+
+    async def step(self, name: str, coro):
+        t = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            self.errors[name] += 1
+            msg = "timeout" if isinstance(e, asyncio.TimeoutError) else f"{type(e).__name__}: {str(e)[:100]}"
+            self.messages[f"{name}: {msg}"] += 1
+            raise
+        finally:
+            self.samples[name].append((time.perf_counter() - t) * 1e3)
+
+
+async def _session(i: int, url: str, args, rec: Recorder, done: Counter, run_id: str):
+    rnd = random.Random(args.seed * 100_003 + i)
+    sjt = rnd.random() < args.sjt
+    think = args.think_ms / 1e3
+    await asyncio.sleep(args.ramp_s * i / max(1, args.users))
+    s = Session(url)
+    try:
+        await rec.step("connect", s.connect())
+        await s.choose(s.one("radio", label=" "), 1)  # 新規登録フォームに切り替え
+        s.type_text(s.one("text_input", key="reg_account"), f"lt_{run_id}_{i}")
+        s.type_text(s.one("text_input", key="reg_pw"), f"pw-{run_id}-{i}")
+        await rec.step("login", s.click(s.one("button", label="新規登録")))
+        if sjt:
+            await s.select(s.one("selectbox", label="カテゴリ"), "状況判断")
+        for _ in range(args.batches):
+            radios = s.find("radio", key_prefix="q_")
+            if not radios:
+                raise AppError("no questions on screen")
+            for proto, fid in radios:
+                if sjt:
+                    free = s.find("text_area", key="free_" + proto.id.rsplit("-q_", 1)[-1])
+                    if free:
+                        s.type_text(free[0], rnd.choice(FREE_TEXTS))
+                await asyncio.sleep(think)
+                await rec.step("answer", s.choose((proto, fid), rnd.randrange(max(1, len(proto.options)))))
+            await asyncio.sleep(think)
+            await rec.step("grade", s.click(s.one("button", label="フィードバックを見る" if sjt else "採点する")))
+            await asyncio.sleep(think)
+            await rec.step("ai_feedback", s.click(s.one("button", label="AI講評を見る")))
+            await asyncio.sleep(think)
+            await rec.step("next", s.click(s.one("button", label="次の問題を解く")))
+            done["batches"] += 1
+        done["sessions"] += 1
+    except Exception:
+        done["failed"] += 1
+    finally:
+        s.close()
+
+
+# ---- アプリのプロセス ----
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_healthy(url: str, proc, timeout: float = 60.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"streamlit exited with {proc.returncode}")
+        try:
+            with urllib.request.urlopen(url.rstrip("/") + "/_stcore/health", timeout=2) as r:
+                if r.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError("streamlit did not become healthy")
+
+
+def _prepare_bank(tmp: Path, n: int, seed: int) -> Path:
+    db = tmp / "cq.db"
+    if n:
+        from bench import synth
+        from app.services import import_jsonl
+
+        src = tmp / "bank.jsonl"
+        synth.write_jsonl(src, n, seed)
+        import_jsonl.import_jsonl(src, db)
+    else:
+        shutil.copy(ROOT / "data" / "cq.db", db)
+    return db
+
+
+def _start_app(tmp: Path, port: int, openai_url: str, bank: Path):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{(tmp / 'users.db').as_posix()}",
+        "CQ_DB_PATH": str(bank),
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY") or "mock",
+        "OPENAI_BASE_URL": openai_url,
+        "CQ_BCRYPT_ROUNDS": env.get("CQ_BCRYPT_ROUNDS", "4"),  # 登録のハッシュで測定が埋もれないように
+    })
+    log = open(tmp / "streamlit.log", "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", str(APP), "--server.headless", "true",
+         "--server.address", "127.0.0.1", "--server.port", str(port), "--server.fileWatcherType", "none",
+         "--browser.gatherUsageStats", "false"],
+        env=env, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+def _proc_usage(pid: int) -> Dict:
+    """/proc からアプリ側の CPU 秒とピーク RSS（Linux のみ。読めなければ空）"""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        hwm = next(int(line.split()[1]) for line in Path(f"/proc/{pid}/status").read_text().splitlines()
+                   if line.startswith("VmHWM:"))
+        return {"cpu_s": round((int(fields[11]) + int(fields[12])) / ticks, 2), "peak_rss_mb": round(hwm / 1024, 1)}
+    except (OSError, StopIteration, IndexError, ValueError):
+        return {}
+
+
+def _report(rec: Recorder, done: Counter, wall: float, args, mock, usage: Dict) -> Dict:
+    steps = {}
+    for name in STEPS:
+        xs = rec.samples.get(name, [])
+        if not xs:
+            continue
+        steps[name] = {"n": len(xs), "errors": rec.errors.get(name, 0),
+                       "p50_ms": round(_pct(xs, 0.50), 1), "p95_ms": round(_pct(xs, 0.95), 1),
+                       "p99_ms": round(_pct(xs, 0.99), 1), "max_ms": round(max(xs), 1)}
+    total = sum(len(v) for v in rec.samples.values())
+    return {
+        "config": {k: v for k, v in vars(args).items()},
+        "wall_s": round(wall, 2),
+        "sessions": {"started": args.users, "completed": done["sessions"], "failed": done["failed"]},
+        "throughput": {"steps_per_s": round(total / wall, 2), "batches_per_s": round(done["batches"] / wall, 3)},
+        "steps": steps,
+        "errors": dict(rec.messages.most_common()),
+        "mock": mock.stats() if mock else {},
+        "app_process": usage,
+    }
+
+
+async def _run_all(url: str, args, rec: Recorder, done: Counter):
+    run_id = f"{int(time.time())}"
+    await asyncio.gather(*(_session(i, url, args, rec, done, run_id) for i in range(args.users)))
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="同時セッションの負荷試験（Streamlit + モック LLM）")
+    ap.add_argument("--users", type=int, default=10, help="同時セッション数")
+    ap.add_argument("--batches", type=int, default=3, help="1セッションで解くバッチ（2問）数")
+    ap.add_argument("--sjt", type=float, default=0.0, help="状況判断（自由記述の AI 評価あり）を選ぶセッションの割合")
+    ap.add_argument("--think-ms", type=float, default=0.0, help="操作の間の待ち時間")
+    ap.add_argument("--ramp-s", type=float, default=0.0, help="セッション開始をこの秒数に散らす")
+    ap.add_argument("--bank", type=int, default=0, help="合成バンクの問題数（0 なら data/cq.db のコピー）")
+    ap.add_argument("--url", default="", help="起動済みのアプリに繋ぐ（モックの向き先はアプリ側で設定しておく）")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="", help="結果 JSON の出力先")
+    mock_openai.add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    mock, proc, usage = None, None, {}
+    tmp = Path(tempfile.mkdtemp(prefix="cq_load_"))
+    try:
+        url = args.url
+        if not url:
+            mock = mock_openai.from_args(args, seed=args.seed)
+            openai_url = mock.start()
+            port = _free_port()
+            proc = _start_app(tmp, port, openai_url, _prepare_bank(tmp, args.bank, args.seed))
+            url = f"http://127.0.0.1:{port}"
+        _wait_healthy(url, proc)
+        print(f"[load] {args.users} sessions x {args.batches} batches -> {url} (log: {tmp})", file=sys.stderr)
+
+        rec, done = Recorder(), Counter()
+        t0 = time.perf_counter()
+        asyncio.run(_run_all(url, args, rec, done))
+        wall = time.perf_counter() - t0
+        if proc is not None:
+            usage = _proc_usage(proc.pid)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if mock is not None:
+            mock.stop()
+
+    report = _report(rec, done, wall, args, mock, usage)
+    print(f"wall {report['wall_s']}s, sessions {done['sessions']}/{args.users} completed, "
+          f"{report['throughput']['steps_per_s']} steps/s, {report['throughput']['batches_per_s']} batches/s",
+          file=sys.stderr)
+    for name, r in report["steps"].items():
+        print(f"  {name:<12} n={r['n']:<5} err={r['errors']:<3} p50 {r['p50_ms']:>8.1f}  p95 {r['p95_ms']:>8.1f}  "
+              f"p99 {r['p99_ms']:>8.1f}  max {r['max_ms']:>8.1f} ms", file=sys.stderr)
+    for msg, n in report["errors"].items():
+        print(f"  [ERR] {n:4d}  {msg}", file=sys.stderr)
+    if report["mock"]:
+        m = report["mock"]
+        print(f"  mock: {m['requests']} requests, {m['errors']} injected errors, "
+              f"max in flight {m['max_in_flight']}", file=sys.stderr)
+    if usage:
+        print(f"  app process: cpu {usage['cpu_s']}s, peak RSS {usage['peak_rss_mb']} MB", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    return 0 if not done["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+# bench/mock_openai.py
+# 負荷試験用のローカル OpenAI 互換サーバー（標準ライブラリのみ・オフライン）。
+#   python -m bench.mock_openai --port 8765 --latency-ms 800 --jitter-ms 300 --error-rate 0.05
+#   OPENAI_API_KEY=dummy OPENAI_BASE_URL=http://127.0.0.1:8765/v1 streamlit run app/streamlit_app_cq.py
+#
+# - POST /v1/chat/completions : system プロンプトで ai_eval の2種類を見分けて、それらしい JSON を返す
+#     SYSTEM_PROMPT（自由記述の評価）       → score_total / subscores / short_feedback / next_drill
+#     SESSION_SYSTEM_PROMPT（通算の講評）    → skill_scores / traits / ... / recommended_drills
+#   それ以外は短い文を返す
+# - POST /v1/messages          : Anthropic Messages API 形式で同じ本文を返す（ANTHROPIC_BASE_URL は /v1 を付けない）
+# - GET /v1/models             : モデル一覧（疎通確認用）
+# - GET /stats                 : 受けたリクエスト数・注入したエラー数・応答時間の合計
+# 応答時間は latency_ms + 出力トークン数 × ms_per_token（± jitter_ms の一様乱数）。
+# tail_rate の割合でさらに tail_ms 待つ（裾の重い遅延。ヘッジの効果を見る用）。
+# error_rate の割合で error_codes（既定 429/500）のどれかを返す（openai クライアントの再試行も込みで測れる）。
+# tokens は出力のおおよそのトークン数。本文の JSON に "_pad" キーを足して長さを合わせる（受け側は読まない）。
+# usage の数値は文字数からの概算。
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+SKILLS = ("要約", "意図理解", "構成力", "印象マネジメント", "状況判断")
+
+
+def _score(text: str) -> int:
+    # 同じ回答には同じ点（0..100）
+    return int(hashlib.blake2b(text.encode("utf-8"), digest_size=2).hexdigest(), 16) % 61 + 40
+
+
+def _eval_body(user: str) -> Dict:
+    s = _score(user)
+    return {
+        "score_total": s,
+        "subscores": {"context_fit": min(100, s + 5), "interpersonal_sensitivity": s,
+                      "clarity": max(0, s - 5)},
+        "short_feedback": "事情確認と方針提示ができています。期限の目安を添えるとより伝わります。",
+        "next_drill": "相手の制約を1行で確認してから代替案を2つ示す練習をしましょう。",
+    }
+
+
+def _session_body(user: str) -> Dict:
+    rnd = random.Random(_score(user))
+    return {
+        "skill_scores": {k: round(rnd.uniform(0.3, 0.9), 2) for k in SKILLS},
+        "traits": ["結論を先に述べる傾向", "相手の意図の読み取りは安定"],
+        "strengths": ["要点抽出"],
+        "weaknesses": ["根拠の具体性"],
+        "next_actions": ["結論→根拠2点の型で60〜120字の練習"],
+        "recommended_drills": [{"skill": "要約", "level": "intermediate", "tags": ["business"],
+                                "why": "応用パターン強化"}],
+    }
+
+
+def _content(messages: List[Dict], tokens: int) -> str:
+    system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+    user = "\n".join(m.get("content") or "" for m in messages if m.get("role") == "user")
+    if "score_total" in system:
+        body = _eval_body(user)
+    elif "skill_scores" in system:
+        body = _session_body(user)
+    else:
+        return "了解しました。" + "。" * max(0, tokens - 7)
+    text = json.dumps(body, ensure_ascii=False)
+    if tokens > len(text):
+        body["_pad"] = "あ" * (tokens - len(text))
+        text = json.dumps(body, ensure_ascii=False)
+    return text
+
+
+def _text(content) -> str:
+    # Anthropic の content は文字列か [{"type": "text", "text": ...}, ...]
+    if isinstance(content, list):
+        return "".join(b.get("text") or "" for b in content if isinstance(b, dict))
+    return content or ""
+
+
+class MockOpenAI:
+    """ThreadingHTTPServer を別スレッドで動かす。start() で base_url（…/v1）を返す"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 500.0,
+                 jitter_ms: float = 0.0, ms_per_token: float = 0.0, error_rate: float = 0.0,
+                 error_codes=(429, 500), tokens: int = 300, tail_rate: float = 0.0, tail_ms: float = 0.0,
+                 seed: Optional[int] = None):
+        self.host, self.port = host, port
+        self.latency_ms, self.jitter_ms, self.ms_per_token = latency_ms, jitter_ms, ms_per_token
+        self.error_rate, self.error_codes, self.tokens = error_rate, tuple(error_codes), tokens
+        self.tail_rate, self.tail_ms = tail_rate, tail_ms
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "errors": 0, "completions": 0, "busy_ms": 0.0, "in_flight": 0,
+                       "max_in_flight": 0}
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def _draw(self):
+        """（応答までの秒数, エラーにするならステータス）"""
+        with self._lock:
+            jitter = self._rnd.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+            err = self._rnd.choice(self.error_codes) if self._rnd.random() < self.error_rate else None
+            tail = self.tail_ms if self.tail_rate and self._rnd.random() < self.tail_rate else 0.0
+        ms = self.latency_ms + self.tokens * self.ms_per_token + jitter + tail
+        return max(0.0, ms) / 1e3, err
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code: int, obj: Dict, headers: Optional[Dict] = None):
+                data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model",
+                                                                 "owned_by": "bench"}]})
+                elif self.path.rstrip("/") == "/stats":
+                    self._send(200, mock.stats())
+                else:
+                    self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+            def do_POST(self):
+                n = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(n) if n else b""
+                path = self.path.split("?", 1)[0].rstrip("/")
+                if path.endswith("/chat/completions"):
+                    api = "openai"
+                elif path.endswith("/messages"):
+                    api = "anthropic"
+                else:
+                    self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                    return
+                try:
+                    req = json.loads(raw or b"{}")
+                except ValueError:
+                    self._send(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+                    return
+
+                sec, err = mock._draw()
+                with mock._lock:
+                    mock._stats["requests"] += 1
+                    mock._stats["in_flight"] += 1
+                    mock._stats["max_in_flight"] = max(mock._stats["max_in_flight"], mock._stats["in_flight"])
+                t = time.perf_counter()
+                try:
+                    if err is not None:
+                        time.sleep(min(sec, 0.05))  # エラーは早めに返る想定
+                        with mock._lock:
+                            mock._stats["errors"] += 1
+                        body = {"error": {"message": f"mock error {err}", "type": "server_error", "code": str(err)}}
+                        if api == "anthropic":
+                            body = {"type": "error", "error": {"type": "api_error", "message": f"mock error {err}"}}
+                        self._send(err, body, {"Retry-After": "0"} if err == 429 else None)
+                        return
+                    messages = req.get("messages") or []
+                    if api == "anthropic":
+                        messages = [{"role": "system", "content": _text(req.get("system"))}] + [
+                            {"role": m.get("role"), "content": _text(m.get("content"))} for m in messages]
+                    content = _content(messages, mock.tokens)
+                    time.sleep(sec)
+                    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 2
+                    completion_tokens = max(1, len(content) // 2)
+                    with mock._lock:
+                        mock._stats["completions"] += 1
+                    if api == "anthropic":
+                        self._send(200, {
+                            "id": f"msg_mock_{uuid.uuid4().hex[:12]}",
+                            "type": "message",
+                            "role": "assistant",
+                            "model": req.get("model") or "mock",
+                            "content": [{"type": "text", "text": content}],
+                            "stop_reason": "end_turn",
+                            "stop_sequence": None,
+                            "usage": {"input_tokens": prompt_tokens, "output_tokens": completion_tokens},
+                        })
+                        return
+                    self._send(200, {
+                        "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": req.get("model") or "mock",
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                     "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                  "total_tokens": prompt_tokens + completion_tokens},
+                    })
+                finally:
+                    with mock._lock:
+                        mock._stats["in_flight"] -= 1
+                        mock._stats["busy_ms"] += (time.perf_counter() - t) * 1e3
+
+        return Handler
+
+    def start(self) -> str:
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def add_arguments(ap: argparse.ArgumentParser):
+    """モックの設定オプション（load_sessions からも使う）"""
+    ap.add_argument("--latency-ms", type=float, default=800.0, help="応答までの基本待ち時間")
+    ap.add_argument("--jitter-ms", type=float, default=200.0, help="± の一様ゆらぎ")
+    ap.add_argument("--ms-per-token", type=float, default=0.0, help="出力1トークンあたりの追加待ち時間")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="エラー応答の割合（0..1）")
+    ap.add_argument("--error-codes", default="429,500", help="エラー時に返すステータス（カンマ区切り）")
+    ap.add_argument("--tokens", type=int, default=300, help="出力のおおよそのトークン数")
+    ap.add_argument("--tail-rate", type=float, default=0.0, help="さらに --tail-ms 待つ応答の割合（0..1）")
+    ap.add_argument("--tail-ms", type=float, default=0.0, help="裾の遅延の追加待ち時間")
+
+
+def from_args(args, host: str = "127.0.0.1", port: int = 0, seed: Optional[int] = None) -> MockOpenAI:
+    return MockOpenAI(host=host, port=port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                      ms_per_token=args.ms_per_token, error_rate=args.error_rate,
+                      error_codes=[int(c) for c in args.error_codes.split(",") if c.strip()],
+                      tokens=args.tokens, tail_rate=args.tail_rate, tail_ms=args.tail_ms, seed=seed)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="ローカル OpenAI 互換モックサーバー")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--seed", type=int, default=None)
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    mock = from_args(args, host=args.host, port=args.port, seed=args.seed)
+    print(f"mock OpenAI at {mock.start()}  (Ctrl-C で終了)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(mock.stats()))
+        mock.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+# bench/regrade.py
+# 正答キー修正後の一括再採点（app/services/regrade.py）のスループットと整合性を確認する。
+#   python -m bench.regrade --rows 2000000 --flip 0.1
+# 一時 DB に合成 attempts を書き、user_skill_stats を attempts から組み立てた後、
+# バンクの正答キーを一部書き換えて再採点（dry run → --apply）する。
+# 適用後の user_skill_stats が attempts からの集計し直しと一致すること、
+# 列指向の採点が grade_mcq の行ループより速いことを表示する。
+import argparse
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from bench.item_analysis import _fill_attempts, _make_bank
+
+_STATS_SQL = """
+SELECT user_id, COALESCE(skill, 'その他'),
+       SUM(correct IS NOT NULL), SUM(correct = 1),
+       SUM(CASE WHEN correct IS NOT NULL THEN COALESCE(difficulty, 0.5) ELSE 0 END),
+       SUM(CASE WHEN correct = 1 THEN COALESCE(difficulty, 0.5) ELSE 0 END)
+FROM attempts WHERE type = 'mcq' GROUP BY user_id, COALESCE(skill, 'その他')
+"""
+
+
+def _rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _build_stats(path: str):
+    """user_skill_stats を attempts から作る（アプリ経由で書いた場合と同じ値）"""
+    with sqlite3.connect(path) as conn:
+        conn.execute("DELETE FROM user_skill_stats")
+        conn.execute(
+            "INSERT INTO user_skill_stats (user_id, skill, attempts, graded, correct, free_score_sum, "
+            "score_sum, score_n, weighted_total, weighted_score, ability_n) "
+            "SELECT user_id, COALESCE(skill, 'その他'), COUNT(*), SUM(correct IS NOT NULL), SUM(correct = 1), 0, "
+            "SUM(correct = 1), SUM(correct IS NOT NULL), "
+            "SUM(CASE WHEN correct IS NOT NULL THEN COALESCE(difficulty, 0.5) ELSE 0 END), "
+            "SUM(CASE WHEN correct = 1 THEN COALESCE(difficulty, 0.5) ELSE 0 END), 0 "
+            "FROM attempts WHERE type = 'mcq' GROUP BY user_id, COALESCE(skill, 'その他')"
+        )
+        conn.commit()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="regrade job benchmark")
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--items", type=int, default=500)
+    ap.add_argument("--flip", type=float, default=0.1, help="正答キーを書き換える問題の割合")
+    ap.add_argument("--chunk", type=int, default=200_000)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    tmp = Path(tempfile.mkdtemp(prefix="cq_regrade_bench_"))
+    os.environ["DATABASE_URL"] = f"sqlite:///{(tmp / 'users.db').as_posix()}"
+    rnd = np.random.default_rng(args.seed)
+
+    from app.domain.models import Question
+    from app.services import grader, regrade
+
+    bank_path = tmp / "cq.db"
+    true_d = _make_bank(bank_path, args.items, rnd)
+    t = time.perf_counter()
+    _fill_attempts(os.environ["DATABASE_URL"], args.rows, true_d, rnd)
+    users_db = str(tmp / "users.db")
+    _build_stats(users_db)
+    print(f"synthetic attempts: {args.rows} rows in {time.perf_counter() - t:.1f}s ({tmp})")
+
+    # 採点そのもの：行ループ（grade_mcq）と列指向
+    n = min(args.rows, 200_000)
+    qids = [f"q_{i}" for i in rnd.integers(0, args.items, n)]
+    chosen = list(np.array(list("ABCD"))[rnd.integers(0, 4, n)])
+    bank = {f"q_{i}": Question(id=f"q_{i}", skill="要約", level="", type="mcq", prompt="", choices=[],
+                               answer_key="A", explanations=None, difficulty=0.5) for i in range(args.items)}
+    t = time.perf_counter()
+    _, loop_correct, _ = grader.grade_mcq([bank[q] for q in qids], chosen)
+    t_loop = time.perf_counter() - t
+    t = time.perf_counter()
+    keys = grader.AnswerKeys.from_questions(list(bank.values()))
+    col = grader.grade_columns(keys.lookup(qids), grader.encode_choices(chosen))
+    t_col = time.perf_counter() - t
+    assert int((col == 1).sum()) == loop_correct
+    print(f"grading {n} answers: grade_mcq loop {t_loop * 1e3:.0f} ms, columnar {t_col * 1e3:.0f} ms "
+          f"(x{t_loop / max(t_col, 1e-9):.1f})")
+
+    # 正答キーの修正
+    flip = rnd.choice(args.items, int(args.items * args.flip), replace=False)
+    with sqlite3.connect(bank_path) as conn:
+        conn.executemany("UPDATE questions SET answer_key = 'B' WHERE id = ?", [(f"q_{i}",) for i in flip])
+
+    rss0 = _rss_mb()
+    dry = regrade.run(apply=False, chunk_rows=args.chunk, bank_path=bank_path, log=lambda *_: None)
+    print(f"dry run : {dry['rows']} rows, {dry['changed']} would change, {dry['seconds']:.2f}s "
+          f"({dry['rows'] / max(dry['seconds'], 1e-9):.0f} rows/s), peak RSS +{_rss_mb() - rss0:.0f} MB")
+    for sk in dry["before"]:
+        b, a = dry["before"][sk], dry["after"][sk]
+        print(f"  {sk}: accuracy {b['correct'] / b['graded']:.3f} -> {a['correct'] / a['graded']:.3f}")
+
+    res = regrade.run(apply=True, chunk_rows=args.chunk, bank_path=bank_path, log=lambda *_: None)
+    print(f"apply   : {res['changed']} rows updated, {res['stats_rows']} stats rows, {res['seconds']:.2f}s")
+    again = regrade.run(apply=True, chunk_rows=args.chunk, bank_path=bank_path, log=lambda *_: None)
+    print(f"re-run  : {again['changed']} changed (idempotent)")
+
+    with sqlite3.connect(users_db) as conn:
+        stored = {(u, s): (g, c, round(wt, 6), round(ws, 6)) for u, s, g, c, wt, ws in conn.execute(
+            "SELECT user_id, skill, graded, correct, weighted_total, weighted_score FROM user_skill_stats")}
+        fresh = {(u, s): (g, c, round(wt, 6), round(ws, 6)) for u, s, g, c, wt, ws in conn.execute(_STATS_SQL)}
+    ok = stored == fresh and res["changed"] == dry["changed"] and again["changed"] == 0
+    print(f"user_skill_stats == recomputed from attempts: {stored == fresh} ({len(stored)} rows)")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
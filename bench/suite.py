@@ -0,0 +1,186 @@
+# bench/suite.py
+# 合成バンク（bench/synth.py）を規模ごとに作り、主要な処理の所要時間を測って JSON で出力する。
+#   python -m bench.suite                                   # 1k / 100k / 1M
+#   python -m bench.suite --scales 1000,100000 --out results.json
+#   python -m bench.suite --compare baseline.json           # 基準より遅くなったケースを表示（あれば終了コード 1）
+#
+# 規模ごとに一時ディレクトリへ JSONL を書いて import し、CQ_DB_PATH でアプリにその cq.db を使わせる
+# （規模ごとに子プロセスで実行。バンクのキャッシュやインポート済みモジュールを持ち越さない）。
+# ケース:
+#   import_jsonl              JSONL → cq.db（1回だけ。rows/s も出す）
+#   load_questions            スキル指定なし / あり（ORDER BY RANDOM() LIMIT 5）
+#   load_all_questions        バンク全件の読み込み
+#   select_first / select     get_new_batch 相当（selector.pick_batch、出題済みを増やしながら）。
+#                             first はインデックス構築を含む初回
+#   grade_mcq_2 / grade_mcq_1000
+#   fallback_rule_based       自由記述のルール評価
+#   fallback_session_profile  200問分の講評（LLM なし）
+# 結果は各ケースの median / p95（ms）と反復回数。--compare は median が threshold 倍を超えたものを回帰とする。
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+DEFAULT_SCALES = (1_000, 100_000, 1_000_000)
+BUDGET_SEC = 1.0     # ケースごとの計測時間の目安
+MAX_ITERS = 2000
+THRESHOLD = 1.25     # --compare で回帰とみなす倍率
+
+
+def _time(fn: Callable[[], object], budget: float = BUDGET_SEC, max_iters: int = MAX_ITERS,
+          min_iters: int = 3) -> Dict:
+    samples: List[float] = []
+    end = time.perf_counter() + budget
+    while len(samples) < max_iters and (len(samples) < min_iters or time.perf_counter() < end):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1e3)
+    samples.sort()
+    return {"iters": len(samples), "median_ms": round(statistics.median(samples), 4),
+            "p95_ms": round(samples[min(len(samples) - 1, int(0.95 * (len(samples) - 1)))], 4)}
+
+
+def _run_scale(n: int, seed: int) -> Dict[str, Dict]:
+    """（子プロセス）n 問の合成バンクで全ケースを測る"""
+    from bench import synth
+    from app.services import import_jsonl
+    from app.services.config import DB_PATH
+
+    results: Dict[str, Dict] = {}
+    src = Path(DB_PATH).with_suffix(".jsonl")
+    synth.write_jsonl(src, n, seed)
+    if Path(DB_PATH).exists():
+        Path(DB_PATH).unlink()
+    t = time.perf_counter()
+    import_jsonl.import_jsonl(src, DB_PATH)
+    sec = time.perf_counter() - t
+    results["import_jsonl"] = {"iters": 1, "median_ms": round(sec * 1e3, 2), "p95_ms": round(sec * 1e3, 2),
+                               "rows_per_s": round(n / sec)}
+
+    from app.services import db, grader, selector
+    from app.services.ai_eval import _fallback_rule_based, _fallback_session_profile
+
+    budget = BUDGET_SEC if n < 1_000_000 else BUDGET_SEC * 3
+    results["load_questions"] = _time(lambda: db.load_questions(None, 5), budget)
+    results["load_questions_skill"] = _time(lambda: db.load_questions("要約", 5), budget)
+    results["load_all_questions"] = _time(db.load_all_questions, budget, min_iters=1)
+
+    # get_new_batch 相当：出題済みを増やしながら2問ずつ
+    seen: set = set()
+
+    def select():
+        qs = selector.pick_batch("要約", "ビジネス", want=2, exclude=seen)
+        if len(qs) < 2:
+            seen.clear()  # 出し切ったら新しいセッション扱い
+        seen.update(q.id for q in qs)
+
+    results["select_first"] = _time(select, 0, max_iters=1, min_iters=1)
+    results["select"] = _time(select, budget)
+
+    bank = [q for q in selector._index_for("要約", "ビジネス", False).items][:1000]
+    rnd = random.Random(seed)
+    chosen = [rnd.choice("ABCD") for _ in bank]
+    results["grade_mcq_2"] = _time(lambda: grader.grade_mcq(bank[:2], chosen[:2]))
+    results["grade_mcq_1000"] = _time(lambda: grader.grade_mcq(bank, chosen))
+
+    answers = ["事情を確認し、期限の目安を共有します", "あり得ない。すぐやって", "了解", "代替案を出して再調整し、合意します"]
+    results["fallback_rule_based"] = _time(lambda: [_fallback_rule_based("", a) for a in answers])
+    items = [{"id": f"q{i}", "type": rnd.choice(("mcq", "sjt", "free")),
+              "skill": rnd.choice(("要約", "意図理解", "印象マネジメント", "状況判断")),
+              "correct": rnd.random() < 0.6, "chosen": "A", "best": rnd.choice("AB"),
+              "free_score01": rnd.random()} for i in range(200)]
+    results["fallback_session_profile"] = _time(lambda: _fallback_session_profile(items))
+    return results
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parents[1]).stdout.strip()
+    except Exception:
+        return ""
+
+
+def _child(n: int, seed: int) -> Dict[str, Dict]:
+    tmp = Path(tempfile.mkdtemp(prefix=f"cq_suite_{n}_"))
+    env = dict(os.environ)
+    env["CQ_DB_PATH"] = str(tmp / "cq.db")
+    env["DATABASE_URL"] = f"sqlite:///{(tmp / 'users.db').as_posix()}"
+    env["CQ_PROFILE"] = "0"
+    proc = subprocess.run([sys.executable, "-m", "bench.suite", "--child", str(n), "--seed", str(seed)],
+                          capture_output=True, text=True, env=env, cwd=Path(__file__).resolve().parents[1])
+    if proc.returncode != 0:
+        raise RuntimeError(f"scale {n} failed:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = THRESHOLD) -> List[str]:
+    """median が基準の threshold 倍を超えたケース"""
+    out = []
+    for scale, cases in current["results"].items():
+        base = baseline.get("results", {}).get(scale, {})
+        for name, r in cases.items():
+            b = base.get(name)
+            if b and b["median_ms"] > 0 and r["median_ms"] > b["median_ms"] * threshold:
+                out.append(f"{scale}/{name}: {b['median_ms']:.3f} -> {r['median_ms']:.3f} ms "
+                           f"(x{r['median_ms'] / b['median_ms']:.2f})")
+    return out
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="benchmark suite on synthetic banks")
+    ap.add_argument("--scales", default=",".join(str(s) for s in DEFAULT_SCALES))
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="", help="結果 JSON の出力先（未指定なら標準出力）")
+    ap.add_argument("--compare", default="", help="基準の結果 JSON")
+    ap.add_argument("--threshold", type=float, default=THRESHOLD)
+    ap.add_argument("--child", type=int, default=0, help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(_run_scale(args.child, args.seed)))
+        return 0
+
+    report = {
+        "suite": "cq-bench",
+        "version": 1,
+        "git": _git_rev(),
+        "created_at": dt.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "results": {},
+    }
+    for n in (int(s) for s in args.scales.split(",") if s.strip()):
+        t = time.perf_counter()
+        report["results"][str(n)] = _child(n, args.seed)
+        print(f"[bench] scale {n}: {time.perf_counter() - t:.1f}s", file=sys.stderr)
+        for name, r in report["results"][str(n)].items():
+            print(f"  {name:<26} median {r['median_ms']:>10.3f} ms  p95 {r['p95_ms']:>10.3f} ms  "
+                  f"({r['iters']} iters)", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+    if args.compare:
+        regressions = compare(report, json.loads(Path(args.compare).read_text(encoding="utf-8")), args.threshold)
+        for line in regressions:
+            print(f"[REGRESSION] {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+# bench/synth.py
+# ベンチマーク用の合成問題バンク（data/questions.jsonl と同じスキーマ）を作る。
+#   python -m bench.synth --n 100000 --out /tmp/bank.jsonl
+# - MCQ（要約 / 意図理解 / 印象マネジメント）と SJT（状況判断）を実データに近い比率で混ぜる
+# - tags はビジネス／日常どちらかのドメインタグ（selector.domain_tagset と一致するもの）＋スキルのタグ
+# - difficulty は 0.15..0.85、MCQ は answer_key と正答の explanations、SJT は選択肢ごとの feedbacks を持つ
+# 同じ seed なら同じバンクになる（id は連番）。
+import argparse
+import json
+import random
+import sys
+from typing import Dict, Iterator
+
+MCQ_SKILLS = {"要約": "summary", "意図理解": "intention", "印象マネジメント": "impression"}
+SJT_SKILL = "状況判断"
+SJT_RATIO = 0.3
+DOMAIN_TAGS = {
+    "business": ["business", "workplace", "meeting", "team", "office", "review", "deadline", "decision"],
+    "daily": ["daily", "日常", "friend", "family", "生活", "home", "communication"],
+}
+TOPICS = ["progress", "planning", "service", "schedule", "scope", "release", "travel", "empathy",
+          "マウント", "否定", "共感欠如", "上から目線", "会話泥棒", "resolution"]
+KEYS = "ABCD"
+_LINES = ["「来週の件、どうなってる？」", "「資料は8割できています」", "「じゃあ金曜に一度見せて」",
+          "「週末どこか行かない？」", "「天気次第だね」", "「その件は確認して折り返します」"]
+_FEEDBACK_TYPES = ["good", "neutral", "risky"]  # SJT の望ましい選択は type="best" の1つ
+
+
+def question(i: int, rnd: random.Random) -> Dict:
+    """i 番目の合成問題（dict。JSONL の1行分）"""
+    domain = rnd.choice(list(DOMAIN_TAGS))
+    tags = [domain] + rnd.sample(DOMAIN_TAGS[domain][1:], 1) + rnd.sample(TOPICS, 1)
+    prompt = "次の会話を読んで答えよ。\n" + "\n".join(rnd.choice(_LINES) for _ in range(rnd.randint(2, 6)))
+    if rnd.random() < SJT_RATIO:
+        n = rnd.choice((3, 4))
+        best = rnd.randrange(n)
+        return {
+            "id": f"syn_sj_{i:07d}", "skill": SJT_SKILL, "level": "beginner", "type": "sjt",
+            "prompt": prompt,
+            "choices": [f"選択肢{KEYS[k]}：{rnd.choice(_LINES)}" for k in range(n)],
+            "feedbacks": {KEYS[k]: {"type": "best" if k == best else rnd.choice(_FEEDBACK_TYPES),
+                                    "desc": f"{KEYS[k]} を選ぶ傾向の解説。"} for k in range(n)},
+            "difficulty": round(rnd.uniform(0.15, 0.85), 2),
+            "tags": tags + ["sjt"],
+        }
+    skill = rnd.choice(list(MCQ_SKILLS))
+    key = rnd.choice(KEYS)
+    return {
+        "id": f"syn_{MCQ_SKILLS[skill][:3]}_{i:07d}", "skill": skill,
+        "level": rnd.choice(("beginner", "beginner", "advanced")), "type": "mcq",
+        "prompt": prompt,
+        "choices": [f"選択肢{k}：{rnd.choice(_LINES)}" for k in KEYS],
+        "answer_key": key,
+        "explanations": {key: "会話の流れ（現状確認→課題→決定事項）を押さえた選択肢が正解。"},
+        "difficulty": round(rnd.uniform(0.15, 0.85), 2),
+        "tags": tags + [MCQ_SKILLS[skill]],
+    }
+
+
+def generate(n: int, seed: int = 0) -> Iterator[Dict]:
+    rnd = random.Random(seed)
+    for i in range(n):
+        yield question(i, rnd)
+
+
+def write_jsonl(path, n: int, seed: int = 0) -> int:
+    with open(path, "w", encoding="utf-8") as f:
+        for q in generate(n, seed):
+            f.write(json.dumps(q, ensure_ascii=False) + "\n")
+    return n
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="合成問題バンク（JSONL）")
+    ap.add_argument("--n", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="-", help="出力先（- は標準出力）")
+    args = ap.parse_args(argv)
+    if args.out == "-":
+        for q in generate(args.n, args.seed):
+            sys.stdout.write(json.dumps(q, ensure_ascii=False) + "\n")
+    else:
+        write_jsonl(args.out, args.n, args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())